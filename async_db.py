@@ -0,0 +1,204 @@
+import asyncio
+import functools
+import inspect
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import database as db
+import metrics
+
+# Количество потоков, выполняющих запросы (у каждого своё соединение из database.py)
+DB_WORKERS = getattr(config, 'DB_WORKERS', 4)
+# Сколько запросов может одновременно ждать выполнения, остальные ждут в цикле событий
+DB_MAX_PENDING = getattr(config, 'DB_MAX_PENDING', 256)
+# Группировка мелких записей: сколько секунд копить пачку и её максимальный размер.
+# При интервале 0 пачку составляют записи, пришедшие, пока фиксировалась предыдущая.
+DB_BATCH_INTERVAL = getattr(config, 'DB_BATCH_INTERVAL', 0.01)
+DB_BATCH_SIZE = getattr(config, 'DB_BATCH_SIZE', 200)
+
+db_queue_wait_seconds = metrics.histogram(
+    'bot_db_queue_wait_seconds', "Ожидание свободного потока БД (от вызова до начала выполнения)")
+
+
+class DBExecutor:
+    """
+    Выполняет синхронные функции database.py в отдельных потоках.
+
+    Очередь ограничена: если в работе уже max_pending запросов, новые вызовы
+    ждут освобождения места, не блокируя цикл событий aiogram.
+    """
+
+    def __init__(self, workers=DB_WORKERS, max_pending=DB_MAX_PENDING):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        self._slots = asyncio.Semaphore(max_pending)
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить func(*args, **kwargs) в потоке БД и дождаться результата"""
+        queued = time.perf_counter()
+
+        def call():
+            db_queue_wait_seconds.observe(time.perf_counter() - queued)
+            return func(*args, **kwargs)
+
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, call)
+
+    def shutdown(self):
+        """Дождаться выполнения начатых запросов и закрыть соединения"""
+        self._pool.shutdown(wait=True)
+        db.close_connections()
+
+
+class WriteBatcher:
+    """
+    Объединяет мелкие записи из разных обработчиков в общие транзакции.
+
+    Запись ставится в очередь, пачка фиксируется через interval секунд после
+    первой записи или сразу, как наберётся max_batch. Одновременно фиксируется
+    одна пачка; submit() возвращает результат только после COMMIT, а ошибка
+    конкретной записи выбрасывается в вызвавший её обработчик.
+    """
+
+    def __init__(self, executor, interval=DB_BATCH_INTERVAL, max_batch=DB_BATCH_SIZE):
+        self._executor = executor
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = []  # (name, args, future)
+        self._full = None  # событие "пачка заполнена" текущего цикла записи
+        self._task = None
+
+    async def submit(self, name, *args):
+        """Записать через пачку и дождаться фиксации"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((name, args, future))
+        if self._task is None or self._task.done():
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        elif len(self._queue) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def flush(self):
+        """Дождаться фиксации всех поставленных записей"""
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    async def _run(self):
+        while self._queue:
+            if self.interval and len(self._queue) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+
+            try:
+                results = await self._executor.run(db.write_batch, [(name, args) for name, args, _ in batch])
+            except Exception as e:
+                # Транзакция не зафиксирована - ни одна запись пачки не сохранена
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue  # обработчик отменён, запись всё равно выполнена
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+
+_executor = DBExecutor()
+_batcher = WriteBatcher(_executor)
+
+
+def _async(func):
+    """Делает из синхронной функции database.py корутину, выполняемую в пуле БД"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await _executor.run(func, *args, **kwargs)
+    return wrapper
+
+
+def _batched(name):
+    """Корутина для записи из db.BATCHABLE_WRITES, выполняемой в общей пачке"""
+    func = getattr(db, name)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Именованные аргументы приводим к позиционным, как их ждёт функция записи
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return await _batcher.submit(name, *bound.args)
+    return wrapper
+
+
+def _async_stream(gen_func, chunk_size=64):
+    """
+    Делает из синхронного генератора database.py асинхронный.
+
+    Элементы забираются из генератора порциями по chunk_size в потоках пула БД,
+    следующая порция читается только после того, как предыдущая обработана.
+    """
+    @functools.wraps(gen_func)
+    async def wrapper(*args, **kwargs):
+        iterator = gen_func(*args, **kwargs)
+        while True:
+            chunk = await _executor.run(lambda: list(itertools.islice(iterator, chunk_size)))
+            for item in chunk:
+                yield item
+            if len(chunk) < chunk_size:
+                return
+    return wrapper
+
+
+async def run(func, *args, **kwargs):
+    """Выполнить произвольную синхронную функцию работы с БД в пуле"""
+    return await _executor.run(func, *args, **kwargs)
+
+
+async def flush_writes():
+    """Дождаться фиксации записей, ожидающих в пачке"""
+    await _batcher.flush()
+
+
+def shutdown():
+    """Остановить пул потоков БД (вызывается при остановке бота после flush_writes)"""
+    _executor.shutdown()
+
+
+init_db = _async(db.init_db)
+add_subscription = _batched('add_subscription')
+get_all_subs = _async(db.get_all_subs)
+get_subs_page = _async(db.get_subs_page)
+get_stats_by_category = _async(db.get_stats_by_category)
+get_fx_rates = _async(db.get_fx_rates)
+get_sub_info = _async(db.get_sub_info)
+update_importance = _batched('update_importance')
+get_users_with_subs = _async(db.get_users_with_subs)
+delete_sub_by_id = _async(db.delete_sub_by_id)
+save_usage_score = _batched('save_usage_score')
+get_average_usage_score = _async(db.get_average_usage_score)
+check_subscription_rated = _async(db.check_subscription_rated)
+get_rated_subscriptions_for_week = _async(db.get_rated_subscriptions_for_week)
+get_unused_subscriptions = _async(db.get_unused_subscriptions)
+iter_unused_subscriptions = _async_stream(db.iter_unused_subscriptions)
+get_users_with_subs_page = _async(db.get_users_with_subs_page)
+get_survey_users_page = _async(db.get_survey_users_page)
+get_survey_groups = _async(db.get_survey_groups)
+start_broadcast_job = _async(db.start_broadcast_job)
+save_broadcast_cursor = _async(db.save_broadcast_cursor)
+finish_broadcast_job = _async(db.finish_broadcast_job)
+get_unfinished_broadcast_jobs = _async(db.get_unfinished_broadcast_jobs)
+claim_broadcast_deliveries = _async(db.claim_broadcast_deliveries)
+mark_broadcast_delivery = _async(db.mark_broadcast_delivery)
+get_user_settings = _async(db.get_user_settings)
+save_user_settings = _async(db.save_user_settings)
+get_scheduler_runs = _async(db.get_scheduler_runs)
+save_scheduler_run = _async(db.save_scheduler_run)
+get_fsm_record = _async(db.get_fsm_record)
+save_fsm_records = _async(db.save_fsm_records)
+delete_expired_fsm_records = _async(db.delete_expired_fsm_records)
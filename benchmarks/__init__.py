@@ -0,0 +1,4 @@
+def percentile(values, p):
+    """Перцентиль p (0-100) по выборке замеров ближайшим рангом; 0.0 для пустой выборки"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
@@ -0,0 +1,170 @@
+"""
+Стоимость маршрутизации нажатий инлайн-кнопок: прежняя цепочка фильтров
+F.data.startswith(...) с разбором split("_") против callback_codec.unpack
+и таблицы обработчиков по типу действия.
+
+Два замера на одной смеси нажатий (оценки опроса, удаление, важность,
+навигация, завершение опроса):
+    filters    - только выбор обработчика и разбор данных
+    dispatcher - полный путь Dispatcher.feed_update с пустыми обработчиками
+
+Печатает микросекунды на нажатие и длину callback_data в обоих форматах.
+
+Запуск: python -m benchmarks.callback_routing [--callbacks 20000] [--repeat 5] [--json result.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import CallbackQuery, Update
+
+import callback_codec as codec
+from handlers.callbacks import decode_callback
+from benchmarks.fake_api import RecordingSession, fake_update
+
+# Обработчики в порядке регистрации до перехода на callback_codec
+LEGACY_ROUTES = [
+    ("del_", lambda data: int(data.split("_")[1])),
+    ("rate_", lambda data: (int(data.split("_")[1]), datetime.strptime(data.split("_")[2], "%Y-%m-%d").date())),
+    ("pg_", lambda data: data[3:].split("_", 3)),
+    ("finish_survey_", lambda data: datetime.strptime(data.split("_")[2], "%Y-%m-%d").date()),
+    ("change_imp_", lambda data: int(data.split("_")[2])),
+]
+
+
+def make_actions(count, seed):
+    """Смесь нажатий: в основном оценки опроса, как в понедельник"""
+    rnd = random.Random(seed)
+    week = date(2025, 1, 6) + timedelta(weeks=rnd.randint(0, 100))
+    actions = []
+    for _ in range(count):
+        sub_id = rnd.randint(1, 2_000_000)
+        kind = rnd.random()
+        if kind < 0.6:
+            actions.append((codec.RateSub(sub_id, week), f"rate_{sub_id}_{week}"))
+        elif kind < 0.75:
+            actions.append((codec.ChangeImportance(sub_id), f"change_imp_{sub_id}"))
+        elif kind < 0.85:
+            actions.append((codec.DeleteSub(sub_id), f"del_{sub_id}"))
+        elif kind < 0.95:
+            actions.append((codec.Page(2, True, sub_id, week), f"pg_rate_n_{sub_id}_{week}"))
+        else:
+            actions.append((codec.FinishSurvey(week), f"finish_survey_{week}"))
+    return actions
+
+
+def callback(data):
+    return CallbackQuery.model_validate(fake_update(1, 1, callback_data=data)['callback_query'])
+
+
+def route_legacy(callbacks, filters):
+    for query in callbacks:
+        for magic, parse in filters:
+            if magic.resolve(query):
+                parse(query.data)
+                break
+
+
+def route_codec(callbacks, table):
+    for query in callbacks:
+        action = decode_callback(query)['callback_action']
+        table[type(action)](action)
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_filters(actions, repeat):
+    legacy = [callback(data) for _, data in actions]
+    packed = [callback(codec.pack(action)) for action, _ in actions]
+    filters = [(F.data.startswith(prefix), parse) for prefix, parse in LEGACY_ROUTES]
+    table = {cls: (lambda action: action) for cls in codec.ACTIONS.values()}
+    return {
+        'legacy_us': best_of(repeat, route_legacy, legacy, filters) / len(actions) * 1e6,
+        'codec_us': best_of(repeat, route_codec, packed, table) / len(actions) * 1e6,
+    }
+
+
+def legacy_dispatcher():
+    dp = Dispatcher()
+    for prefix, parse in LEGACY_ROUTES:
+        @dp.callback_query(F.data.startswith(prefix))
+        async def handler(query: CallbackQuery, parse=parse):
+            parse(query.data)
+    return dp
+
+
+def codec_dispatcher():
+    dp = Dispatcher()
+    table = {cls: (lambda action: action) for cls in codec.ACTIONS.values()}
+
+    @dp.callback_query(decode_callback)
+    async def dispatch_callback(query: CallbackQuery, callback_action):
+        table[type(callback_action)](callback_action)
+    return dp
+
+
+async def bench_dispatcher(actions, repeat):
+    bot = Bot('123456:benchmark', session=RecordingSession())
+    results = {}
+    for name, dp, datas in (
+        ('legacy_us', legacy_dispatcher(), [data for _, data in actions]),
+        ('codec_us', codec_dispatcher(), [codec.pack(action) for action, _ in actions]),
+    ):
+        updates = [
+            Update.model_validate(fake_update(i, 1, callback_data=data), context={'bot': bot})
+            for i, data in enumerate(datas, 1)
+        ]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for update in updates:
+                await dp.feed_update(bot, update)
+            timings.append(time.perf_counter() - started)
+        results[name] = min(timings) / len(updates) * 1e6
+    await bot.session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--callbacks', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    actions = make_actions(args.callbacks, args.seed)
+    results = {
+        'callbacks': args.callbacks,
+        'callback_data_bytes': {
+            'legacy': round(statistics.mean(len(data) for _, data in actions), 1),
+            'codec': round(statistics.mean(len(codec.pack(action)) for action, _ in actions), 1),
+        },
+        'filters': bench_filters(actions, args.repeat),
+        # Через Dispatcher - десятая часть нажатий: полный путь на порядок медленнее самих фильтров
+        'dispatcher': asyncio.run(bench_dispatcher(actions[:max(1, args.callbacks // 10)], args.repeat)),
+    }
+    for key in ('filters', 'dispatcher'):
+        timings = results[key]
+        timings['speedup'] = timings['legacy_us'] / timings['codec_us']
+        results[key] = {name: round(value, 2) for name, value in timings.items()}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Стоимость пересчёта цен в базовую валюту, когда у пользователей платежи
+в разных валютах.
+
+Одни и те же данные замеряются дважды: все цены в базовой валюте и доля
+--mixed цен в USD/EUR. Для каждого пользователя:
+    cold - get_stats_by_category со сброшенным кэшем подписок
+           (чтение из БД с пересчётом в SQL по курсам из памяти)
+    warm - get_stats_by_category из кэша подписок
+    to_base - векторный пересчёт страницы выгрузки (как в PDF-отчёте)
+
+Запуск: python -m benchmarks.currency_bench [--users 500] [--subs 8] [--mixed 0.5]
+        [--json result.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import currency
+import database as db
+from benchmarks import percentile
+from benchmarks.datagen import populate
+
+RATES = {'USD': 92.5, 'EUR': 100.2}
+
+
+def summary(values):
+    return {p: round(percentile(values, p) * 1000, 4) for p in (50, 95)}
+
+
+def run(user_ids):
+    timings = {'cold': [], 'warm': [], 'to_base': []}
+    rates = db.get_fx_rates()
+    for user_id in user_ids:
+        db.clear_subs_cache()
+        started = time.perf_counter()
+        db.get_stats_by_category(user_id)
+        timings['cold'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        db.get_stats_by_category(user_id)
+        timings['warm'].append(time.perf_counter() - started)
+
+        rows = list(db.iter_subscriptions_export(user_id))
+        started = time.perf_counter()
+        currency.to_base([row[2] for row in rows], [row[3] for row in rows], rates)
+        timings['to_base'].append(time.perf_counter() - started)
+    return {f'{name}_ms': summary(values) for name, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--subs', type=int, default=8)
+    parser.add_argument('--weeks', type=int, default=8)
+    parser.add_argument('--mixed', type=float, default=0.5, help="доля цен в иностранной валюте")
+    parser.add_argument('--json', help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'bench.db')
+        db.init_db()
+        conn = db.create_connection()
+        user_ids = populate(conn, users=args.users, subs_per_user=args.subs, weeks=args.weeks)
+        db.save_fx_rates(RATES)
+        results = {'params': vars(args), 'base_only': run(user_ids)}
+
+        # Часть подписок переводим в USD и EUR (цены делим на курс, чтобы суммы остались близкими)
+        with conn:
+            for code, rate in RATES.items():
+                conn.execute('''
+                    UPDATE subscriptions SET currency = ?, price = round(price / ?, 2)
+                    WHERE currency = ? AND abs(random() % 1000) < ?
+                ''', (code, rate, currency.BASE_CURRENCY, int(args.mixed * 1000 / len(RATES))))
+        results['mixed'] = run(user_ids)
+        db.close_connections()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Синтетические данные для бенчмарков: пользователи, подписки и история
+оценок использования.
+
+Заполнить файл БД (по умолчанию config.DB_NAME):
+    python -m benchmarks.datagen --users 1000 --subs 8 --weeks 26 [--db bench.db]
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+import config
+import database as db
+
+# Категории из config, если он есть, иначе набор по умолчанию
+CATEGORIES = getattr(config, 'CATEGORIES', None) or [
+    'Стриминг видео', 'Стриминг музыки', 'Игры', 'Образование', 'Коммуналка / ЖКХ',
+]
+SERVICES = [
+    'Netflix', 'Кинопоиск', 'Яндекс Плюс', 'Spotify', 'YouTube Premium',
+    'Steam', 'Skillbox', 'Электричество', 'Интернет', 'iCloud',
+]
+
+
+def last_monday(today=None):
+    """Понедельник текущей недели"""
+    today = today or date.today()
+    return today - timedelta(days=today.weekday())
+
+
+def populate(conn, users=1000, subs_per_user=8, weeks=26, seed=42, first_user_id=1):
+    """
+    Заполнить БД синтетическими данными: users × subs_per_user подписок и
+    weeks недель оценок использования для каждой. Пишет напрямую через
+    executemany в одной транзакции. Возвращает список user_id.
+    """
+    rnd = random.Random(seed)
+    user_ids = list(range(first_user_id, first_user_id + users))
+    week_dates = [last_monday() - timedelta(weeks=i) for i in range(weeks)]
+
+    with conn:
+        conn.executemany(
+            '''
+            INSERT INTO subscriptions (user_id, service_name, price, category, importance, date_added)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (
+                (
+                    user_id,
+                    rnd.choice(SERVICES),
+                    float(rnd.choice([99, 199, 299, 399, 599, 999, 1500])),
+                    rnd.choice(CATEGORIES),
+                    rnd.randint(1, 10),
+                    (week_dates[-1] - timedelta(days=7)).isoformat(),
+                )
+                for user_id in user_ids
+                for _ in range(subs_per_user)
+            ),
+        )
+        sub_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM subscriptions WHERE user_id BETWEEN ? AND ?',
+            (user_ids[0], user_ids[-1]),
+        )]
+        conn.executemany(
+            '''
+            INSERT OR IGNORE INTO usage_history (subscription_id, week_start_date, usage_score)
+            VALUES (?, ?, ?)
+            ''',
+            (
+                (sub_id, week.isoformat(), rnd.randint(1, 10))
+                for sub_id in sub_ids
+                for week in week_dates
+                if rnd.random() < 0.8  # часть недель пропущена, как у реальных пользователей
+            ),
+        )
+        # Агрегаты появляются начиная с 4-й версии схемы
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'usage_stats'").fetchone():
+            db.rebuild_usage_stats(sub_ids, conn=conn)
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=db.DB_NAME, help="файл БД (создаётся, если его нет)")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--subs', type=int, default=8, help="подписок на пользователя")
+    parser.add_argument('--weeks', type=int, default=26, help="недель истории оценок")
+    parser.add_argument('--first-user-id', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    db.DB_NAME = args.db
+    db.init_db()
+    user_ids = populate(db.create_connection(), users=args.users, subs_per_user=args.subs, weeks=args.weeks,
+                        seed=args.seed, first_user_id=args.first_user_id)
+    print(f"{args.db}: добавлено пользователей {len(user_ids)}, подписок {len(user_ids) * args.subs}")
+
+
+if __name__ == '__main__':
+    main()
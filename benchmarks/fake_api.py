@@ -0,0 +1,105 @@
+import asyncio
+import itertools
+import json
+import time
+
+from aiogram.client.session.base import BaseSession
+
+# Ответы заглушки Bot API: методы, которые возвращают сообщение
+_MESSAGE_METHODS = {
+    'sendmessage', 'sendphoto', 'senddocument', 'editmessagetext',
+    'editmessagereplymarkup', 'editmessagecaption',
+}
+
+_message_ids = itertools.count(1)
+_file_ids = itertools.count(1)
+
+
+def fake_user(user_id, is_bot=False):
+    return {'id': int(user_id), 'is_bot': is_bot, 'first_name': 'Bench' if is_bot else 'User'}
+
+
+def fake_result(method, params):
+    """
+    Правдоподобный результат метода Bot API для заглушки.
+
+    Для методов, отправляющих или редактирующих сообщения, возвращается Message
+    (у фото - с file_id), для getMe - пользователь-бот, для остальных - True.
+    """
+    method = method.lower()
+    if method == 'getme':
+        return fake_user(1, is_bot=True) | {'username': 'bench_bot'}
+    if method not in _MESSAGE_METHODS:
+        return True
+
+    chat_id = int(params.get('chat_id') or 0)
+    message = {
+        'message_id': int(params.get('message_id') or next(_message_ids)),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+    }
+    if method == 'sendphoto':
+        file_id = f"photo{next(_file_ids)}"
+        message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1200, 'height': 600}]
+    elif method == 'senddocument':
+        file_id = f"doc{next(_file_ids)}"
+        message['document'] = {'file_id': file_id, 'file_unique_id': file_id}
+    else:
+        message['text'] = str(params.get('text', ''))
+    return message
+
+
+def fake_update(update_id, user_id, text=None, callback_data=None, message_id=1):
+    """Входящее обновление: текстовое сообщение или нажатие инлайн-кнопки"""
+    user = fake_user(user_id)
+    chat = {'id': int(user_id), 'type': 'private'}
+    if callback_data is not None:
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': user,
+                'chat_instance': str(user_id),
+                'data': callback_data,
+                'message': {'message_id': message_id, 'date': int(time.time()), 'chat': chat, 'text': '…'},
+            },
+        }
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': chat,
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+class RecordingSession(BaseSession):
+    """
+    Сессия бота без сети: запросы к Bot API только считаются, а ответ
+    берётся из fake_result и разбирается так же, как ответ Telegram.
+
+    latency - имитация времени ответа Telegram, секунд.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = {key: value for key, value in method if value is not None}
+        content = json.dumps({'ok': True, 'result': fake_result(name, params)})
+        return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
@@ -0,0 +1,141 @@
+"""
+Локальная замена Telegram для нагрузочного теста webhook-режима.
+
+Поднимает заглушку Bot API (бот настраивается на неё через
+config.TELEGRAM_API_URL = "http://127.0.0.1:8090"; для нескольких процессов
+также config.FSM_STORAGE = 'sqlite') и отправляет в webhook
+бота поток синтетических обновлений, распределяя их по процессам.
+
+Пример:
+    python main.py webhook --workers 4 --port 8081
+    python -m benchmarks.fake_telegram --targets 8081-8084 --updates 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+from benchmarks import percentile
+from benchmarks.fake_api import fake_result, fake_update
+
+# Кнопки главного меню, которые нажимают синтетические пользователи
+TEXTS = ["📋 Список платежей", "💡 Советы по оптимизации", "/help"]
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отвечает на любой метод и считает вызовы"""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        return web.json_response({'ok': True, 'result': fake_result(method, params)})
+
+    async def start(self, host, port):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def parse_targets(value, host):
+    """'8081-8084' или '8081,8082' -> список URL webhook"""
+    ports = []
+    for part in value.split(','):
+        if '-' in part:
+            first, last = map(int, part.split('-'))
+            ports.extend(range(first, last + 1))
+        else:
+            ports.append(int(part))
+    return [f"http://{host}:{port}" for port in ports]
+
+
+async def send_updates(targets, path, secret, updates, users, concurrency):
+    """Отправить обновления и вернуть задержки ответа webhook (секунды)"""
+    latencies = []
+    errors = 0
+    rnd = random.Random(42)
+    urls = itertools.cycle([target + path for target in targets])
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    queue = asyncio.Queue()
+    for update_id in range(1, updates + 1):
+        queue.put_nowait(fake_update(update_id, rnd.randint(1, users), text=rnd.choice(TEXTS)))
+
+    async def worker(session):
+        nonlocal errors
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.post(next(urls), json=update, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return latencies, errors
+
+
+async def run(args):
+    api = FakeBotAPI()
+    runner = await api.start(args.api_host, args.api_port)
+    try:
+        started = time.perf_counter()
+        latencies, errors = await send_updates(
+            parse_targets(args.targets, args.host), args.path, args.secret,
+            args.updates, args.users, args.concurrency,
+        )
+        elapsed = time.perf_counter() - started
+        # Даём обработчикам в фоне закончить ответы
+        await asyncio.sleep(args.drain)
+    finally:
+        await runner.cleanup()
+
+    result = {
+        'updates': args.updates,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(args.updates / elapsed, 1),
+        'latency_ms': {p: round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)},
+        'api_calls': api.calls,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default='8080', help='порты процессов бота: 8081-8084 или 8081,8082')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--path', default='/webhook')
+    parser.add_argument('--secret', default=None)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--api-host', default='127.0.0.1')
+    parser.add_argument('--api-port', type=int, default=8090)
+    parser.add_argument('--drain', type=float, default=2.0, help='сколько секунд ждать ответов бота после отправки')
+    parser.add_argument('--json', help='сохранить результат в JSON')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
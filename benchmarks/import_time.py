@@ -0,0 +1,97 @@
+"""
+Время импорта модулей бота по данным `python -X importtime`.
+
+Показывает самые тяжёлые импорты и проверяет бюджет: код возврата 1, если
+суммарное время превышает --budget-ms, больше чем на --tolerance процентов
+превышает результат из --baseline (JSON предыдущего релиза) или при старте
+загружается модуль из --forbid (по умолчанию matplotlib - он должен загружаться лениво).
+
+Запуск: python -m benchmarks.import_time [--module handlers] [--budget-ms 1500]
+        [--baseline prev.json] [--json result.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """
+    Импортировать module в чистом интерпретаторе.
+
+    Returns:
+        Список (модуль, собственное время мкс, накопленное время мкс) в порядке загрузки
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='handlers')
+    parser.add_argument('--budget-ms', type=float, help='абсолютный бюджет, мс')
+    parser.add_argument('--baseline', help='JSON с результатом предыдущего релиза')
+    parser.add_argument('--tolerance', type=float, default=10, help='допустимый рост относительно --baseline, %%')
+    parser.add_argument('--forbid', nargs='*', default=['matplotlib'])
+    parser.add_argument('--repeat', type=int, default=3, help='берётся лучший из N запусков')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', help='сохранить результат в JSON для сравнения между релизами')
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda rows: rows[-1][2])
+    total_ms = best[-1][2] / 1000
+    loaded = {name for name, _, _ in best}
+    forbidden = sorted(name for name in args.forbid if name in loaded)
+
+    budget_ms = args.budget_ms
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline_ms = json.load(f)['total_ms']
+        limit_ms = baseline_ms * (1 + args.tolerance / 100)
+        budget_ms = min(budget_ms, limit_ms) if budget_ms else limit_ms
+        print(f"Предыдущий результат: {baseline_ms:.1f} мс")
+
+    print(f"Импорт {args.module}: {total_ms:.1f} мс" + (f" (бюджет {budget_ms:.0f} мс)" if budget_ms else ""))
+    print("Самые тяжёлые пакеты верхнего уровня:")
+    top_level = [row for row in best if '.' not in row[0]]
+    for name, _, cumulative in sorted(top_level, key=lambda row: -row[2])[:args.top]:
+        print(f"    {cumulative / 1000:8.1f} мс  {name}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'module': args.module,
+                'total_ms': total_ms,
+                'budget_ms': budget_ms,
+                'forbidden_loaded': forbidden,
+                'top': {name: cumulative / 1000 for name, _, cumulative in top_level},
+            }, f, ensure_ascii=False, indent=2)
+
+    ok = True
+    if budget_ms and total_ms > budget_ms:
+        print(f"Превышен бюджет времени импорта на {total_ms - budget_ms:.1f} мс")
+        ok = False
+    if forbidden:
+        print(f"При старте загружаются модули, которые должны загружаться лениво: {', '.join(forbidden)}")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Нагрузочный тест бота без Telegram: синтетические обновления проходят через
+настоящий Dispatcher со всеми обработчиками, запросы к Bot API записывает
+RecordingSession.
+
+Сценарии (каждый активный пользователь проходит его от начала до конца):
+    add        - добавление подписки через диалог (5 сообщений)
+    list       - список платежей
+    analytics  - аналитика с графиками
+    survey     - всплеск оценок еженедельного опроса по всем подпискам
+
+Для каждого сценария печатает обновления в секунду и перцентили задержки
+обработки обновления. Результат с хешем коммита сохраняется в JSON;
+--compare сравнивает его с прошлым запуском и завершается с кодом 1,
+если скорость упала или p95 вырос больше чем на --tolerance.
+
+Запуск: python -m benchmarks.load_test [--scenarios add,list,analytics,survey]
+        [--users 1000] [--active 100] [--concurrency 16] [--api-latency 0]
+        [--json result.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.types import Update
+
+import config
+import callback_codec as codec
+import database as db
+import async_db as adb
+from benchmarks import percentile
+from benchmarks.datagen import populate, last_monday
+from benchmarks.fake_api import RecordingSession, fake_update
+
+SCENARIOS = ('add', 'list', 'analytics', 'survey')
+
+_update_ids = itertools.count(1)
+
+
+def add_steps(user_id, subs):
+    category = config.CATEGORIES[user_id % len(config.CATEGORIES)]
+    return [
+        {'text': "➕ Добавить ежемесячный платёж"},
+        {'text': f"Сервис {user_id}"},
+        {'text': "299"},
+        {'text': category},
+        {'text': "7"},
+    ]
+
+
+def list_steps(user_id, subs):
+    return [{'text': "📋 Список платежей"}]
+
+
+def analytics_steps(user_id, subs):
+    return [{'text': "📊 Аналитика"}]
+
+
+def survey_steps(user_id, subs):
+    """Оценка каждой подписки из опроса: кнопка подписки, затем оценка"""
+    week = last_monday()
+    steps = []
+    for sub_id in subs:
+        steps.append({'callback_data': codec.pack(codec.RateSub(sub_id, week)), 'message_id': 1})
+        steps.append({'text': str(sub_id % 10 + 1)})
+    return steps
+
+
+STEPS = {
+    'add': add_steps,
+    'list': list_steps,
+    'analytics': analytics_steps,
+    'survey': survey_steps,
+}
+
+
+async def run_scenario(dp, bot, name, user_subs, concurrency):
+    """
+    Прогнать сценарий для всех пользователей user_subs ({user_id: [sub_id, ...]}),
+    не больше concurrency пользователей одновременно.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    calls_before = dict(bot.session.calls)
+
+    async def drive(user_id, subs):
+        nonlocal errors
+        async with slots:
+            for step in STEPS[name](user_id, subs):
+                update = Update.model_validate(fake_update(next(_update_ids), user_id, **step), context={'bot': bot})
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    if not errors:
+                        logging.error(f"{name}: ошибка обработки обновления: {e!r}")
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(user_id, subs) for user_id, subs in user_subs.items()))
+    elapsed = time.perf_counter() - started
+    return {
+        'users': len(user_subs),
+        'updates': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {p: round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)},
+        'api_calls': {
+            method: count - calls_before.get(method, 0)
+            for method, count in sorted(bot.session.calls.items())
+            if count != calls_before.get(method, 0)
+        },
+    }
+
+
+async def main_async(args, user_ids):
+    import main as bot_main
+    from services.charts import renderer
+
+    # Бот с записывающей сессией вместо настоящего; обработчики получают его в setup_dispatcher
+    bot_main.bot = Bot(token='123456:benchmark', session=RecordingSession(args.api_latency / 1000))
+    bot_main.setup_dispatcher()
+    await adb.init_db()
+    if 'analytics' in args.scenarios:
+        await renderer.prewarm()
+
+    active = user_ids[:args.active]
+    results = {}
+    try:
+        for name in args.scenarios:
+            # Подписки читаются перед сценарием: предыдущие сценарии могли их добавить
+            user_subs = {
+                user_id: [sub_id for sub_id, *_ in db.get_all_subs(user_id, include_id=True, exclude_zkh=True)]
+                for user_id in active
+            }
+            results[name] = await run_scenario(bot_main.dp, bot_main.bot, name, user_subs, args.concurrency)
+            print(f"{name}: {results[name]['updates_per_sec']} обновлений/с, "
+                  f"p95 {results[name]['latency_ms'][95]} мс", file=sys.stderr)
+        await adb.flush_writes()
+    finally:
+        renderer.shutdown()
+        await bot_main.dp.storage.close()
+    return results
+
+
+def git_commit():
+    """Текущий коммит (с пометкой о незакоммиченных изменениях) или None"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def compare(results, baseline, tolerance):
+    """Напечатать изменения относительно baseline. Возвращает True, если есть регрессия"""
+    regression = False
+    print(f"Сравнение с {baseline.get('commit')} (допуск {tolerance:.0%}):")
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        speed = current['updates_per_sec'] / previous['updates_per_sec'] - 1 if previous['updates_per_sec'] else 0.0
+        # В JSON ключи перцентилей - строки
+        old_p95 = previous['latency_ms'].get('95') or previous['latency_ms'].get(95)
+        p95 = current['latency_ms'][95] / old_p95 - 1 if old_p95 else 0.0
+        worse = speed < -tolerance or p95 > tolerance
+        regression = regression or worse
+        print(f"  {name}: обновлений/с {speed:+.1%}, p95 {p95:+.1%}{'  <- регрессия' if worse else ''}")
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="сценарии через запятую")
+    parser.add_argument('--users', type=int, default=1000, help="пользователей в БД")
+    parser.add_argument('--subs', type=int, default=8, help="подписок на пользователя")
+    parser.add_argument('--weeks', type=int, default=12, help="недель истории оценок")
+    parser.add_argument('--active', type=int, default=100, help="пользователей, проходящих каждый сценарий")
+    parser.add_argument('--concurrency', type=int, default=16, help="пользователей одновременно")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="время ответа Bot API, мс")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="сохранить результат в JSON")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'bench.db')
+        db.init_db()
+        user_ids = populate(db.create_connection(), users=args.users, subs_per_user=args.subs,
+                            weeks=args.weeks, seed=args.seed)
+        try:
+            scenarios = asyncio.run(main_async(args, user_ids))
+        finally:
+            adb.shutdown()
+
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('json', 'compare')},
+        'scenarios': scenarios,
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Планы и время запросов database.py до и после индексов из migrations.py.
+
+Запуск: python -m benchmarks.query_plans [--users 2000] [--subs 8] [--weeks 26]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import database as db
+import migrations
+from benchmarks.datagen import populate, last_monday
+
+
+def _scenario(user_id):
+    """Запросы, которые бот выполняет для одного пользователя"""
+    week = last_monday()
+    sub_id = db.get_all_subs(user_id, include_id=True)[0][0]
+    return [
+        ('get_all_subs', lambda: db.get_all_subs(user_id)),
+        ('get_all_subs(include_id, exclude_zkh)', lambda: db.get_all_subs(user_id, include_id=True, exclude_zkh=True)),
+        ('get_all_subs(include_usage)', lambda: db.get_all_subs(user_id, include_id=True, include_usage=True)),
+        ('get_stats_by_category', lambda: db.get_stats_by_category(user_id)),
+        ('get_rated_subscriptions_for_week', lambda: db.get_rated_subscriptions_for_week(user_id, week)),
+        ('check_subscription_rated', lambda: db.check_subscription_rated(user_id, sub_id, week)),
+        ('get_average_usage_score', lambda: db.get_average_usage_score(user_id, sub_id)),
+        ('get_unused_subscriptions', lambda: db.get_unused_subscriptions(user_id)),
+        ('get_users_with_subs', db.get_users_with_subs),
+    ]
+
+
+def _report(conn, user_id, repeat):
+    for name, call in _scenario(user_id):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        call()
+        conn.set_trace_callback(None)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            call()
+        elapsed_ms = (time.perf_counter() - started) / repeat * 1000
+
+        print(f"\n{name}: {elapsed_ms:.3f} мс")
+        for sql in statements:
+            for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+                print(f"    {row[3]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--subs', type=int, default=8)
+    parser.add_argument('--weeks', type=int, default=26)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'bench.db')
+        # Сравниваем сами запросы, поэтому кэш подписок отключаем
+        db.SUBS_CACHE_SIZE = 0
+        conn = db.create_connection()
+        migrations.apply_migrations(conn)
+        # Текущая схема без собственных индексов - как до миграции 2
+        indexes = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+        )]
+        for name in indexes:
+            conn.execute(f'DROP INDEX {name}')
+        user_ids = populate(conn, users=args.users, subs_per_user=args.subs, weeks=args.weeks)
+        user_id = user_ids[len(user_ids) // 2]
+
+        print("=== Без индексов ===")
+        _report(conn, user_id, args.repeat)
+
+        # Повторно применяется только миграция индексов: более поздние
+        # (ALTER TABLE ADD COLUMN) повторно выполнить нельзя
+        conn.execute('PRAGMA user_version = 1')
+        migrations.apply_migrations(conn, target=2)
+        conn.execute(f'PRAGMA user_version = {migrations.LATEST_VERSION}')
+        conn.execute('ANALYZE')
+        print(f"\n=== С индексами (схема версии {migrations.get_version(conn)}) ===")
+        _report(conn, user_id, args.repeat)
+
+        db.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Пропускная способность записи оценок использования: транзакция на каждую
+оценку (как до группировки) против пачек WriteBatcher из async_db.py.
+
+Имитирует понедельничный всплеск: --concurrency обработчиков одновременно
+сохраняют --ratings оценок. Печатает оценки в секунду и задержку подтверждения.
+С --shards K пользователи распределяются по K файлам БД (см. shards.py).
+
+Запуск: python -m benchmarks.ratings_throughput [--ratings 5000] [--concurrency 200]
+        [--synchronous FULL] [--interval 0.01] [--batch 200] [--shards 4] [--json result.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+import database as db
+import async_db as adb
+import shards
+from benchmarks import percentile
+from benchmarks.datagen import populate, last_monday
+
+
+async def run_mode(save, ratings, concurrency):
+    """Сохранить все оценки через save() не более чем concurrency одновременно"""
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def rate(sub_id, user_id, week, score):
+        async with slots:
+            started = time.perf_counter()
+            await save(sub_id, user_id, week, score)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(rate(*rating) for rating in ratings))
+    elapsed = time.perf_counter() - started
+    return {
+        'ratings': len(ratings),
+        'seconds': round(elapsed, 3),
+        'ratings_per_sec': round(len(ratings) / elapsed, 1),
+        'latency_ms': {p: round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)},
+    }
+
+
+def make_ratings(subs, count, week, seed):
+    rnd = random.Random(seed)
+    return [(*rnd.choice(subs), week, rnd.randint(1, 10)) for _ in range(count)]
+
+
+async def main_async(args):
+    subs = [
+        sub
+        for shard_subs in db._fan_out(
+            lambda path: db.create_connection(path).execute('SELECT id, user_id FROM subscriptions').fetchall()
+        )
+        for sub in shard_subs
+    ]
+    week = last_monday()
+    adb._batcher.interval = args.interval
+    adb._batcher.max_batch = args.batch
+
+    async def save_single(*rating):
+        # Прежний путь: отдельная транзакция и коммит на каждую оценку
+        await adb.run(db.save_usage_score, *rating)
+
+    results = {
+        'single': await run_mode(save_single, make_ratings(subs, args.ratings, week + timedelta(weeks=1), 1),
+                                 args.concurrency),
+        'batched': await run_mode(adb.save_usage_score, make_ratings(subs, args.ratings, week + timedelta(weeks=2), 2),
+                                  args.concurrency),
+    }
+    results['speedup'] = round(results['batched']['ratings_per_sec'] / results['single']['ratings_per_sec'], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--subs', type=int, default=8)
+    parser.add_argument('--ratings', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL'], default='NORMAL',
+                        help="режим синхронизации SQLite (FULL - fsync на каждый коммит)")
+    parser.add_argument('--interval', type=float, default=adb.DB_BATCH_INTERVAL)
+    parser.add_argument('--batch', type=int, default=adb.DB_BATCH_SIZE)
+    parser.add_argument('--shards', type=int, default=1, help="число файлов БД")
+    parser.add_argument('--json', help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'bench.db')
+        db.PRAGMAS = tuple(
+            f"PRAGMA synchronous={args.synchronous}" if pragma.startswith("PRAGMA synchronous") else pragma
+            for pragma in db.PRAGMAS
+        )
+        db.init_db()
+        populate(db.create_connection(), users=args.users, subs_per_user=args.subs, weeks=4)
+        if args.shards > 1:
+            # Данные создаются в одном файле и раскладываются по шардам так же, как при добавлении шардов
+            db.DB_SHARDS = [os.path.join(tmp, f'bench{index}.db') for index in range(1, args.shards)]
+            db.init_db()
+            shards.rebalance()
+        try:
+            results = asyncio.run(main_async(args))
+        finally:
+            adb.shutdown()
+
+    results['synchronous'] = args.synchronous
+    results['shards'] = args.shards
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Стоимость расчёта динамики использования (trends.py) для пользователей
+с многолетней историей еженедельных оценок.
+
+Для каждого пользователя замеряется:
+    query  - чтение истории за окно одним запросом (database.get_usage_series)
+    numpy  - векторный расчёт EWMA и наклона
+    python - те же показатели циклом по подпискам (для сравнения и проверки)
+
+Запуск: python -m benchmarks.trends_bench [--users 50] [--subs 15] [--weeks 156]
+        [--history 52] [--json result.json]
+"""
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import database as db
+import trends
+from benchmarks import percentile
+from benchmarks.datagen import populate
+
+
+def python_trends(rows, weeks):
+    """Показатели циклом по подпискам: словарь {sub_id: (ewma, slope)}"""
+    series = {}
+    for sub_id, column, score in rows:
+        series.setdefault(sub_id, {})[column] = score
+
+    result = {}
+    for sub_id, points in series.items():
+        weight_sum = value_sum = 0.0
+        for column, score in points.items():
+            weight = 0.5 ** ((weeks - 1 - column) / trends.TREND_HALFLIFE_WEEKS)
+            weight_sum += weight
+            value_sum += weight * score
+        ewma = value_sum / weight_sum
+
+        first = weeks - trends.TREND_SLOPE_WEEKS
+        xs = [c - first for c in points if c >= first]
+        ys = [points[c + first] for c in xs]
+        slope = math.nan
+        if len(xs) >= trends.TREND_MIN_POINTS:
+            mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+            spread = sum((x - mean_x) ** 2 for x in xs)
+            if spread:
+                slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+        result[sub_id] = (ewma, slope)
+    return result
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def check(numpy_result, python_result):
+    """Оба расчёта дают одинаковые показатели"""
+    for i, sub_id in enumerate(numpy_result.sub_ids.tolist()):
+        expected = python_result[sub_id]
+        got = (numpy_result.ewma[i], numpy_result.slope[i])
+        if not np.allclose(got, expected, equal_nan=True):
+            raise AssertionError(f"Подписка {sub_id}: {got} != {expected}")
+
+
+def run(user_ids, history):
+    today = date.today()
+    since = today - timedelta(days=today.weekday(), weeks=history - 1)
+    timings = {'query': [], 'numpy': [], 'python': []}
+    points = 0
+    for user_id in user_ids:
+        rows, elapsed = timed(db.get_usage_series, user_id, since)
+        timings['query'].append(elapsed)
+        points += len(rows)
+        numpy_result, elapsed = timed(trends.compute_trends, rows, history)
+        timings['numpy'].append(elapsed)
+        python_result, elapsed = timed(python_trends, rows, history)
+        timings['python'].append(elapsed)
+        check(numpy_result, python_result)
+    return {
+        'ratings_per_user': round(points / len(user_ids)),
+        **{
+            f'{name}_ms': {p: round(percentile(values, p) * 1000, 3) for p in (50, 95)}
+            for name, values in timings.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--subs', type=int, default=15)
+    parser.add_argument('--weeks', type=int, default=156, help="недель истории у каждого пользователя")
+    parser.add_argument('--history', type=int, default=trends.TREND_HISTORY_WEEKS, help="окно расчёта, недель")
+    parser.add_argument('--json', help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'bench.db')
+        db.init_db()
+        user_ids = populate(db.create_connection(), users=args.users, subs_per_user=args.subs, weeks=args.weeks)
+        results = {'params': vars(args), 'window': run(user_ids, args.history),
+                   'full_history': run(user_ids, args.weeks)}
+        db.close_connections()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш.
+
+    Ограничивается числом записей (maxsize), суммарным размером (max_bytes,
+    размер записи считает sizeof) и временем жизни записи (ttl, секунд).
+    on_evict(key, value) вызывается для каждой вытесненной или удалённой записи.
+    """
+
+    def __init__(self, maxsize=1024, max_bytes=None, ttl=None, sizeof=None, on_evict=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or (lambda value: 0)
+        self._on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Значение по ключу (запись становится самой свежей) или default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, size, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Добавить или заменить запись, вытеснив самые старые при переполнении"""
+        size = self._sizeof(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.maxsize
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key):
+        """Удалить запись, если она есть"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def _remove(self, key):
+        value, size, _ = self._data.pop(key)
+        self._bytes -= size
+        if self._on_evict:
+            self._on_evict(key, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Счётчики попаданий/промахов и текущий размер"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+            }
@@ -0,0 +1,214 @@
+"""
+Компактная упаковка callback_data инлайн-кнопок.
+
+Действие кнопки - NamedTuple, зарегистрированный под кодом. Упакованный вид:
+байт заголовка (версия формата и код действия), затем поля по порядку:
+int и bool - беззнаковый varint, date - номер недели (понедельника) от
+5 января 1970 г. Необязательные поля в конце (None) не пишутся. Байты
+кодируются в base64url без '='.
+
+Например, оценка подписки: "rate_123_2025-01-06" (19 байт) -> "Inu2Fg" (6 байт).
+Telegram ограничивает callback_data 64 байтами, поэтому ID подписок шардов
+(до 2^40 * K) и даты укладываются с большим запасом.
+
+Кнопки, отправленные до перехода на этот формат ("del_5", "rate_5_2025-01-06"...),
+разбираются в те же действия (unpack).
+"""
+import base64
+import typing
+from datetime import date, datetime, timedelta
+from typing import NamedTuple, Optional
+
+# Версия формата: старшие 3 бита байта заголовка, младшие 5 - код действия
+VERSION = 1
+# Понедельник, от которого считаются недели
+EPOCH_MONDAY = date(1970, 1, 5)
+
+# Код действия -> класс и класс -> код
+ACTIONS = {}
+_CODES = {}
+# Класс действия -> типы полей
+_FIELDS = {}
+
+
+# --- Кодирование полей ---
+
+def _write_varint(out, value):
+    if value < 0:
+        raise ValueError(f"Отрицательное значение {value}")
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise ValueError("Обрезанный varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_week(out, value):
+    days = (value - EPOCH_MONDAY).days
+    if days % 7:
+        raise ValueError(f"{value} - не понедельник")
+    _write_varint(out, days // 7)
+
+
+def _read_week(data, pos):
+    weeks, pos = _read_varint(data, pos)
+    return EPOCH_MONDAY + timedelta(weeks=weeks), pos
+
+
+def _read_bool(data, pos):
+    value, pos = _read_varint(data, pos)
+    return bool(value), pos
+
+
+_ENCODERS = {
+    int: (_write_varint, _read_varint),
+    bool: (lambda out, value: _write_varint(out, int(value)), _read_bool),
+    date: (_write_week, _read_week),
+}
+
+
+def action(code):
+    """Зарегистрировать NamedTuple как действие кнопки с кодом code (1..31)"""
+    def decorator(cls):
+        if not 0 < code < 32 or code in ACTIONS:
+            raise ValueError(f"Недопустимый код действия {code}")
+        types = []
+        for field_type in typing.get_type_hints(cls).values():
+            if typing.get_origin(field_type) is typing.Union:
+                # Optional[X] - поле может отсутствовать в конце данных
+                field_type = next(arg for arg in typing.get_args(field_type) if arg is not type(None))
+            if field_type not in _ENCODERS:
+                raise TypeError(f"{cls.__name__}: неподдерживаемый тип поля {field_type}")
+            types.append(field_type)
+        ACTIONS[code] = cls
+        _CODES[cls] = code
+        _FIELDS[cls] = tuple(types)
+        return cls
+    return decorator
+
+
+# --- Действия кнопок ---
+
+@action(1)
+class DeleteSub(NamedTuple):
+    """Удалить подписку"""
+    sub_id: int
+
+
+@action(2)
+class RateSub(NamedTuple):
+    """Оценить использование подписки за неделю"""
+    sub_id: int
+    week_start: date
+
+
+@action(3)
+class FinishSurvey(NamedTuple):
+    """Завершить опрос за неделю"""
+    week_start: date
+
+
+@action(4)
+class ChangeImportance(NamedTuple):
+    """Изменить важность подписки"""
+    sub_id: int
+
+
+@action(5)
+class Page(NamedTuple):
+    """Соседняя страница списка: cursor - id первой (назад) или последней (вперёд) подписки"""
+    list_id: int
+    forward: bool
+    cursor: int
+    week_start: Optional[date] = None
+
+
+def pack(item):
+    """Упаковать действие в строку для callback_data"""
+    cls = type(item)
+    out = bytearray([VERSION << 5 | _CODES[cls]])
+    values = list(item)
+    while values and values[-1] is None:
+        values.pop()
+    for field_type, value in zip(_FIELDS[cls], values):
+        _ENCODERS[field_type][0](out, value)
+    return base64.urlsafe_b64encode(out).rstrip(b'=').decode('ascii')
+
+
+def _unpack_packed(data):
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    if not raw or raw[0] >> 5 != VERSION:
+        raise ValueError(f"Неизвестная версия callback_data: {data!r}")
+    cls = ACTIONS.get(raw[0] & 0x1F)
+    if cls is None:
+        raise ValueError(f"Неизвестное действие: {data!r}")
+    values = []
+    pos = 1
+    for field_type in _FIELDS[cls]:
+        if pos == len(raw):
+            break
+        value, pos = _ENCODERS[field_type][1](raw, pos)
+        values.append(value)
+    if pos != len(raw):
+        raise ValueError(f"Лишние байты в callback_data: {data!r}")
+    # Недостающие поля берутся из значений по умолчанию, без них - TypeError
+    try:
+        return cls(*values)
+    except TypeError:
+        raise ValueError(f"Не хватает полей в callback_data: {data!r}") from None
+
+
+# --- Прежний текстовый формат ---
+
+def _legacy_week(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _legacy_page(parts):
+    # pg_<список>_<n|p>_<id>[_<неделя>]; списки по порядку keyboards.PAGE_LISTS
+    list_name, direction, cursor, *week = parts
+    return Page(('del', 'imp', 'rate').index(list_name), direction == 'n', int(cursor),
+                _legacy_week(week[0]) if week else None)
+
+
+# Первое слово прежнего формата -> разбор оставшихся частей
+_LEGACY = {
+    'del': lambda parts: DeleteSub(int(parts[0])),
+    'rate': lambda parts: RateSub(int(parts[0]), _legacy_week(parts[1])),
+    'finish': lambda parts: FinishSurvey(_legacy_week(parts[1])),     # finish_survey_<неделя>
+    'change': lambda parts: ChangeImportance(int(parts[1])),          # change_imp_<id>
+    'pg': _legacy_page,
+}
+
+
+def unpack(data):
+    """
+    Разобрать callback_data в действие.
+
+    Raises:
+        ValueError: данные не относятся ни к одному действию
+    """
+    # Упакованные данные начинаются с заглавной буквы (байт заголовка), прежние - со строчного слова
+    word, _, rest = data.partition('_')
+    legacy = _LEGACY.get(word) if rest else None
+    if legacy is not None:
+        try:
+            return legacy(rest.split('_'))
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"Некорректные callback_data {data!r}: {e}") from None
+    try:
+        return _unpack_packed(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError(str(e)) from None
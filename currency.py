@@ -0,0 +1,144 @@
+"""
+Валюты платежей и пересчёт в базовую валюту.
+
+Цена подписки хранится в валюте платежа (subscriptions.currency), курсы -
+в таблице fx_rates: сколько единиц базовой валюты (BASE_CURRENCY) стоит
+единица валюты. Курсы загружаются из локального файла, сеть не нужна;
+процесс бота держит их в памяти (database.get_fx_rates).
+
+Суммы, прогнозы, графики и советы считаются в базовой валюте. Пересчёт
+делается сразу для всех строк: в SQL при чтении подписок пользователя
+(database._load_user_subs) или векторно (to_base) для выгрузок страницами.
+
+Загрузка курсов (CSV "currency,rate" или JSON {"USD": 92.5, ...}):
+    python -m currency load rates.csv
+    python -m currency show
+"""
+import argparse
+import csv
+import json
+import os
+import re
+
+import numpy as np
+
+import config
+
+# Валюта, в которой считаются суммы и в которой цена указывается без знака валюты
+BASE_CURRENCY = getattr(config, 'BASE_CURRENCY', 'RUB')
+# Курсы по умолчанию, если в таблице fx_rates их нет: {'USD': 92.5, ...}
+FX_RATES = getattr(config, 'FX_RATES', {})
+
+# Знаки валют для вывода; остальные валюты выводятся кодом
+SYMBOLS = {'RUB': '₽', 'USD': '$', 'EUR': '€'}
+SYMBOL = SYMBOLS.get(BASE_CURRENCY, BASE_CURRENCY)
+
+# Как валюту могут написать при вводе цены
+_ALIASES = {
+    '₽': 'RUB', 'р': 'RUB', 'р.': 'RUB', 'руб': 'RUB', 'руб.': 'RUB', 'рублей': 'RUB',
+    '$': 'USD', 'долларов': 'USD',
+    '€': 'EUR', 'евро': 'EUR',
+}
+_PRICE_RE = re.compile(r'^\s*(?P<before>\D*?)\s*(?P<amount>\d+(?:[.,]\d+)?)\s*(?P<after>\D*?)\s*$')
+_CODE_RE = re.compile(r'^[A-Za-z]{3}$')
+
+
+def normalize_code(value):
+    """Код валюты (USD) по коду в любом регистре, знаку или названию; ValueError, если не распознан"""
+    value = str(value or '').strip()
+    code = _ALIASES.get(value.lower())
+    if code:
+        return code
+    if _CODE_RE.match(value):
+        return value.upper()
+    raise ValueError(f"неизвестная валюта: {value!r}")
+
+
+def parse_price(text):
+    """
+    Цена с необязательной валютой: "299", "9.99 USD", "$9.99", "5,50€".
+
+    Returns:
+        (сумма, код валюты); без валюты - BASE_CURRENCY
+    Raises:
+        ValueError, если текст не цена
+    """
+    match = _PRICE_RE.match(text or '')
+    if not match or (match['before'] and match['after']):
+        raise ValueError(f"не цена: {text!r}")
+    amount = float(match['amount'].replace(',', '.'))
+    label = match['before'] or match['after']
+    return amount, normalize_code(label) if label else BASE_CURRENCY
+
+
+def format_price(amount, code=BASE_CURRENCY):
+    """Цена для вывода: 299₽, 9.99$, 12.5 GBP"""
+    text = f"{amount:.2f}".rstrip('0').rstrip('.')
+    symbol = SYMBOLS.get(code)
+    return f"{text}{symbol}" if symbol else f"{text} {code}"
+
+
+def to_base(prices, codes, rates):
+    """
+    Пересчитать цены в базовую валюту одним векторным проходом.
+
+    prices, codes - цены и коды валют строк; rates - {код: курс к базовой валюте}.
+    Returns:
+        Массив цен в базовой валюте; цена в валюте без курса остаётся как есть
+        (так же, как в database._load_user_subs)
+    """
+    prices = np.asarray(prices, dtype=float)
+    if not prices.size:
+        return prices
+    # Курс ищется один раз на каждую встретившуюся валюту, а не на каждую строку
+    unique, inverse = np.unique(np.asarray(codes, dtype=object).astype(str), return_inverse=True)
+    factors = np.array([rates.get(code, 1.0) for code in unique], dtype=float)
+    return prices * factors[inverse]
+
+
+def read_rates_file(path):
+    """
+    Курсы из файла: CSV со столбцами currency,rate или JSON-объект {код: курс}.
+
+    Raises:
+        ValueError при ошибке в файле
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if os.path.splitext(path)[1].lower() == '.json':
+            items = json.load(f).items()
+        else:
+            items = ((row.get('currency'), row.get('rate')) for row in csv.DictReader(f))
+        rates = {}
+        for code, rate in items:
+            code = normalize_code(code)
+            try:
+                rate = float(rate)
+            except (TypeError, ValueError):
+                raise ValueError(f"курс {code} не число: {rate!r}") from None
+            if not rate > 0:
+                raise ValueError(f"курс {code} должен быть больше нуля: {rate}")
+            rates[code] = rate
+    return rates
+
+
+def main():
+    import database as db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load = subparsers.add_parser('load', help="загрузить курсы из файла")
+    load.add_argument('path', help="файл .csv или .json")
+    subparsers.add_parser('show', help="текущие курсы")
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.command == 'load':
+        rates = read_rates_file(args.path)
+        db.save_fx_rates(rates)
+        print(f"Загружено курсов: {len(rates)}")
+    for code, rate in sorted(db.get_fx_rates().items()):
+        print(f"{code}\t{rate:g}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,334 @@
+import contextlib
+import heapq
+import inspect
+import itertools
+import json
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
 from config import DB_NAME
 
+import currency
+import metrics
+import migrations
+import shards
+from cache import LRUCache
+from shards import DB_SHARDS, SHARD_ID_RANGE
 
-def create_connection():
-    """Создает подключение к БД"""
-    return sqlite3.connect(DB_NAME)
+# Размер кэша подготовленных выражений на одно соединение
+CACHED_STATEMENTS = 256
 
+# Настройки, применяемые к каждому новому соединению
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # читатели не блокируют писателя
+    "PRAGMA synchronous=NORMAL",     # в режиме WAL безопасно и без fsync на каждый коммит
+    "PRAGMA cache_size=-16000",      # ~16 МБ страничного кэша
+    "PRAGMA mmap_size=268435456",    # 256 МБ отображаемой в память БД
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
 
-def init_db():
-    """Инициализация таблиц при старте"""
-    conn = create_connection()
-    cursor = conn.cursor()
-
-    # Таблица подписок
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            service_name TEXT NOT NULL,
-            price REAL NOT NULL,
-            category TEXT NOT NULL,
-            importance INTEGER DEFAULT 5,
-            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица истории использования подписок
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usage_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            subscription_id INTEGER NOT NULL,
-            week_start_date DATE NOT NULL,
-            usage_score INTEGER NOT NULL CHECK(usage_score >= 1 AND usage_score <= 10),
-            date_recorded TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE,
-            UNIQUE(subscription_id, week_start_date)
-        )
-    ''')
-    
+# Постоянные соединения: по одному на поток и файл БД
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0  # увеличивается при close_connections(), чтобы потоки открыли соединения заново
+
+# Кольцо шардов (пересоздаётся, если изменился список файлов) и потоки для запросов ко всем шардам
+_ring = None
+_fan_out_pool = None
+_fan_out_lock = threading.Lock()
+
+# За сколько последних недель считается usage_stats.recent_avg
+RECENT_USAGE_WEEKS = 4
+
+# Подписчики на изменения данных пользователя (сбрасывают кэши)
+_write_listeners = []
+
+# Кэш подписок пользователей: сколько пользователей хранить (0 - без кэша) и сколько секунд.
+# Запись сбрасывается при изменениях в этом процессе, а изменения из других процессов
+# (воркеры webhook, CLI) видны по версии данных пользователя (таблица user_versions).
+SUBS_CACHE_SIZE = getattr(config, 'SUBS_CACHE_SIZE', 10000)
+SUBS_CACHE_TTL = getattr(config, 'SUBS_CACHE_TTL', 300)
+_subs_cache = LRUCache(maxsize=SUBS_CACHE_SIZE, ttl=SUBS_CACHE_TTL)
+_subs_invalidations = 0  # счётчик сбросов: не кладём в кэш прочитанное до параллельной записи
+
+# Курсы валют из таблицы fx_rates главного файла БД держатся в памяти столько секунд
+# (сбрасываются при save_fx_rates в этом процессе)
+FX_CACHE_TTL = getattr(config, 'FX_CACHE_TTL', 3600)
+_fx_cache = LRUCache(maxsize=1, ttl=FX_CACHE_TTL)
+
+# Вызовы дольше стольких миллисекунд пишутся в лог (None - не писать)
+DB_SLOW_QUERY_MS = getattr(config, 'DB_SLOW_QUERY_MS', 100)
+db_call_seconds = metrics.histogram('bot_db_call_seconds', "Время выполнения функций database.py", ['function'])
+
+
+def _open_connection(path):
+    """Открывает новое соединение и настраивает его"""
+    conn = sqlite3.connect(
+        path,
+        timeout=5.0,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,  # закрываем из close_connections(), используем только в своём потоке
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def create_connection(path=None):
+    """
+    Возвращает постоянное подключение к БД для текущего потока.
+
+    Соединение открывается один раз и переиспользуется всеми функциями модуля,
+    поэтому закрывать его не нужно. Для записи используйте `with conn:` -
+    транзакция будет зафиксирована или откатана автоматически; если запись
+    зависит от прочитанного в той же транзакции - `with _write_transaction(conn):`.
+    """
+    path = path or DB_NAME
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.generation != _generation:
+        connections = _local.connections = {}
+        _local.generation = _generation
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open_connection(path)
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_connections():
+    """Закрывает все открытые соединения (вызывается при остановке бота)"""
+    global _generation
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+@contextlib.contextmanager
+def _write_transaction(conn):
+    """
+    Транзакция, которая сразу берёт блокировку записи (BEGIN IMMEDIATE).
+
+    В отличие от `with conn:` (отложенная транзакция начинается с первой записи)
+    прочитанное внутри неё не может измениться до коммита - нужно, когда запись
+    зависит от прочитанного (старая оценка в _apply_usage_score и т. п.).
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
-    conn.close()
 
 
-def add_subscription(user_id, name, price, category, importance):
-    """Добавление новой записи"""
+def add_write_listener(callback):
+    """Подписаться на изменения данных: callback(user_id) вызывается после каждой записи"""
+    _write_listeners.append(callback)
+
+
+def _notify_write(user_id):
+    """Сообщить подписчикам, что данные пользователя изменились"""
+    if user_id is None:
+        return
+    for callback in _write_listeners:
+        callback(user_id)
+
+
+def shard_paths():
+    """Файлы БД с данными пользователей; первый (DB_NAME) хранит и общие таблицы"""
+    return [DB_NAME, *DB_SHARDS]
+
+
+def use_paths(db_name, db_shards):
+    """
+    Инициализатор процессов пулов (initializer=db.use_paths, initargs=(db.DB_NAME, tuple(db.DB_SHARDS))):
+    процесс, запущенный через spawn, работает с теми же файлами БД, что и родитель
+    (тесты и бенчмарки меняют DB_NAME / DB_SHARDS после импорта config).
+    """
+    global DB_NAME, DB_SHARDS
+    DB_NAME, DB_SHARDS = db_name, list(db_shards)
+
+
+def get_ring():
+    global _ring
+    paths = tuple(shard_paths())
+    if _ring is None or _ring.paths != paths:
+        _ring = shards.ShardRing(paths)
+    return _ring
+
+
+def get_user_shard(user_id):
+    """
+    Файл БД с данными пользователя: по кольцу шардов или закреплённый
+    на время переноса (см. shards.py).
+    """
+    if not DB_SHARDS:
+        return DB_NAME
+    pinned = create_connection().execute('SELECT shard FROM user_shards WHERE user_id = ?', (user_id,)).fetchone()
+    return pinned[0] if pinned else get_ring().get(user_id)
+
+
+def _user_connection(user_id):
+    """Соединение с шардом пользователя"""
+    return create_connection(get_user_shard(user_id))
+
+
+def _fan_out(func, paths=None):
+    """
+    Выполнить func(path) для всех шардов (или для paths) одновременно.
+
+    Returns:
+        Список результатов в порядке shard_paths()
+    """
+    global _fan_out_pool
+    paths = shard_paths() if paths is None else paths
+    if len(paths) <= 1:
+        return [func(path) for path in paths]
+    with _fan_out_lock:
+        if _fan_out_pool is None or _fan_out_pool._max_workers < len(paths):
+            _fan_out_pool = ThreadPoolExecutor(max_workers=len(paths), thread_name_prefix='db-shard')
+    return list(_fan_out_pool.map(func, paths))
+
+
+def init_db():
+    """Инициализация таблиц при старте: применяет недостающие миграции схемы во всех шардах"""
+    for index, path in enumerate(shard_paths()):
+        conn = create_connection(path)
+        migrations.apply_migrations(conn)
+        if index:
+            # ID подписок шарда начинаются со своего диапазона и не совпадают с ID других шардов
+            with conn:
+                conn.execute('''
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT 'subscriptions', ?
+                    WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'subscriptions')
+                ''', (index * SHARD_ID_RANGE,))
+
+
+def _run_write(name, *args):
+    """Выполнить одну запись из BATCHABLE_WRITES в отдельной транзакции"""
+    write, user_arg = BATCHABLE_WRITES[name]
+    conn = _user_connection(args[user_arg])
+    with _write_transaction(conn):
+        result, user_id = write(conn, *args)
+    _notify_write(user_id)
+    return result
+
+
+def _write_subscription(conn, user_id, name, price, category, importance, currency_code=currency.BASE_CURRENCY):
+    conn.execute('''
+        INSERT INTO subscriptions (user_id, service_name, price, category, importance, currency)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, name, price, category, importance, currency_code))
+    return None, user_id
+
+
+def add_subscription(user_id, name, price, category, importance, currency_code=currency.BASE_CURRENCY):
+    """Добавление новой записи (цена в валюте currency_code)"""
+    _run_write('add_subscription', user_id, name, price, category, importance, currency_code)
+
+
+def _load_fx_rates():
+    """Курсы из кэша или из БД: (словарь {код: курс}, он же в JSON для запросов)"""
+    cached = _fx_cache.get('rates')
+    if cached is not None:
+        return cached
+    rates = {**currency.FX_RATES, **dict(create_connection().execute('SELECT currency, rate FROM fx_rates'))}
+    rates[currency.BASE_CURRENCY] = 1.0
+    cached = (rates, json.dumps(rates))
+    _fx_cache.set('rates', cached)
+    return cached
+
+
+def get_fx_rates():
+    """Курсы валют к базовой: словарь {код: сколько базовой валюты за единицу}"""
+    return dict(_load_fx_rates()[0])
+
+
+def save_fx_rates(rates):
+    """Добавить или обновить курсы {код: курс}"""
     conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO subscriptions (user_id, service_name, price, category, importance)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, name, price, category, importance))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.executemany('''
+            INSERT INTO fx_rates (currency, rate) VALUES (?, ?)
+            ON CONFLICT(currency) DO UPDATE SET rate = excluded.rate, updated_at = CURRENT_TIMESTAMP
+        ''', list(rates.items()))
+    _fx_cache.clear()
+    # Цены в кэше подписок пересчитаны по старым курсам
+    clear_subs_cache()
+
+
+def _invalidate_subs(user_id):
+    """Сбросить кэш подписок пользователя"""
+    global _subs_invalidations
+    _subs_invalidations += 1
+    _subs_cache.pop(user_id)
+
+
+add_write_listener(_invalidate_subs)
+
+
+def _load_user_subs(user_id):
+    """
+    Полный набор подписок пользователя из кэша или из БД.
+
+    Returns:
+        Кортеж строк (id, service_name, price, category, importance, avg_usage, исходная цена, валюта)
+        по порядку добавления; price - в базовой валюте
+    """
+    path = get_user_shard(user_id)
+    conn = create_connection(path)
+    # Версия читается до подписок: запись между ними только сделает кэш устаревшим раньше
+    version = conn.execute('SELECT version FROM user_versions WHERE user_id = ?', (user_id,)).fetchone()
+    key = (path, version[0] if version else 0)
+    cached = _subs_cache.get(user_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    invalidations = _subs_invalidations
+    _, rates_json = _load_fx_rates()
+    # Средняя оценка берётся из агрегатов usage_stats, а не считается по всей истории.
+    # Цены пересчитываются в том же запросе по курсам из памяти (таблица курсов есть
+    # только в главном файле БД); валюта без курса остаётся как есть
+    subs = tuple(conn.execute('''
+        SELECT s.id, s.service_name, s.price * COALESCE(fx.value, 1.0), s.category, s.importance,
+               st.score_sum * 1.0 / st.score_count AS avg_usage, s.price, s.currency
+        FROM subscriptions s
+        LEFT JOIN usage_stats st ON s.id = st.subscription_id
+        LEFT JOIN json_each(?) fx ON fx.key = s.currency
+        WHERE s.user_id = ?
+        ORDER BY s.id
+    ''', (rates_json, user_id)))
+    if SUBS_CACHE_SIZE and invalidations == _subs_invalidations:
+        _subs_cache.set(user_id, (key, subs))
+    return subs
+
 
+def clear_subs_cache():
+    """Сбросить кэш подписок всех пользователей (после массовых изменений)"""
+    global _subs_invalidations
+    _subs_invalidations += 1
+    _subs_cache.clear()
 
-def get_all_subs(user_id, include_id=False, exclude_zkh=False, include_usage=False):
+
+def get_subs_cache_stats():
+    """Попадания, промахи и размер кэша подписок"""
+    return _subs_cache.stats()
+
+
+def get_all_subs(user_id, include_id=False, exclude_zkh=False, include_usage=False, include_currency=False):
     """
     Функция для получения подписок пользователя.
     
@@ -63,133 +337,368 @@ def get_all_subs(user_id, include_id=False, exclude_zkh=False, include_usage=Fal
         include_id: Если True, включает id подписки в результат
         exclude_zkh: Если True, исключает подписки категории 'Коммуналка / ЖКХ'
         include_usage: Если True, включает среднюю оценку использования
+        include_currency: Если True, добавляет в конец цену в валюте платежа и код валюты
     
     Returns:
-        Список кортежей с данными подписок
+        Список кортежей с данными подписок; price - в базовой валюте (currency.BASE_CURRENCY)
     """
-    conn = create_connection()
-    cursor = conn.cursor()
-    
-    # Формируем SELECT в зависимости от параметров
-    if include_usage:
-        # С JOIN для получения данных об использовании
-        select_fields = 's.id, s.service_name, s.price, s.category, s.importance, COALESCE(AVG(uh.usage_score), NULL) as avg_usage'
-        from_clause = 'FROM subscriptions s LEFT JOIN usage_history uh ON s.id = uh.subscription_id'
-        group_by = 'GROUP BY s.id'
-    elif include_id:
-        select_fields = 'id, service_name, price, category, importance'
-        from_clause = 'FROM subscriptions'
-        group_by = ''
-    else:
-        select_fields = 'service_name, price, category, importance'
-        from_clause = 'FROM subscriptions'
-        group_by = ''
-    
-    # Формируем WHERE
-    if include_usage:
-        # При JOIN нужно указывать префикс таблицы
-        where_clause = 'WHERE s.user_id = ?'
-    else:
-        where_clause = 'WHERE user_id = ?'
-    
-    params = [user_id]
-    
+    # Все варианты - срезы одного закэшированного набора
+    subs = _load_user_subs(user_id)
     if exclude_zkh:
-        if include_usage:
-            where_clause += " AND s.category != 'Коммуналка / ЖКХ'"
-        else:
-            where_clause += " AND category != 'Коммуналка / ЖКХ'"
-    
-    query = f'SELECT {select_fields} {from_clause} {where_clause} {group_by}'
-    
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+        subs = [sub for sub in subs if sub[3] != 'Коммуналка / ЖКХ']
+
+    start = 0 if include_usage or include_id else 1
+    end = 6 if include_usage else 5
+    if include_currency:
+        return [sub[start:end] + sub[6:] for sub in subs]
+    return [sub[start:end] for sub in subs]
+
+
+def get_subs_page(user_id, after_id=0, before_id=None, limit=10, exclude_zkh=False, week_start_date=None):
+    """
+    Страница подписок пользователя по порядку добавления (keyset-пагинация по id).
+
+    Args:
+        after_id: следующая страница - подписки с id больше after_id
+        before_id: предыдущая страница - ближайшие подписки с id меньше before_id
+        limit: размер страницы
+        exclude_zkh: исключить категорию 'Коммуналка / ЖКХ'
+        week_start_date: добавить к строкам оценку за эту неделю (None, если оценки нет)
+
+    Returns:
+        Кортеж (строки (id, service_name, price, category, importance, currency[, оценка]),
+        где price - в валюте платежа currency,
+        есть ли подписки до страницы, есть ли подписки после неё).
+        Если страница опустела (подписки удалены), возвращается первая страница.
+    """
+    conn = _user_connection(user_id)
+    condition = "s.user_id = ?" + (" AND s.category != 'Коммуналка / ЖКХ'" if exclude_zkh else "")
+    columns = "s.id, s.service_name, s.price, s.category, s.importance, s.currency"
+    join = ""
+    params = [user_id]
+    if week_start_date is not None:
+        columns += ", uh.usage_score"
+        join = "LEFT JOIN usage_history uh ON uh.subscription_id = s.id AND uh.week_start_date = ?"
+        params.insert(0, week_start_date)
+
+    backward = before_id is not None
+    rows = conn.execute(f'''
+        SELECT {columns} FROM subscriptions s {join}
+        WHERE {condition} AND s.id {'<' if backward else '>'} ?
+        ORDER BY s.id {'DESC' if backward else ''}
+        LIMIT ?
+    ''', (*params, before_id if backward else after_id, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        if after_id or backward:
+            return get_subs_page(user_id, limit=limit, exclude_zkh=exclude_zkh, week_start_date=week_start_date)
+        return [], False, False
+    if backward:
+        rows.reverse()
+
+    # Есть ли подписки по другую сторону страницы - одна проверка по индексу (user_id, id)
+    edge = rows[-1][0] if backward else rows[0][0]
+    other = conn.execute(
+        f"SELECT EXISTS (SELECT 1 FROM subscriptions s WHERE {condition} AND s.id {'>' if backward else '<'} ?)",
+        (user_id, edge)
+    ).fetchone()[0]
+    return (rows, more, bool(other)) if backward else (rows, bool(other), more)
 
 
 def get_stats_by_category(user_id):
     """Группировка расходов по категориям для графика"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT category, SUM(price) 
-        FROM subscriptions 
-        WHERE user_id = ? 
-        GROUP BY category
-    ''', (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-
-def delete_sub_by_id(sub_id):
-    """Удаление по первичному ключу"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM subscriptions WHERE id = ?', (sub_id,))
-    conn.commit()
-    conn.close()
+    totals = {}
+    for sub in _load_user_subs(user_id):
+        totals[sub[3]] = totals.get(sub[3], 0) + sub[2]
+    return sorted(totals.items())
+
+
+def get_sub_info(user_id, sub_id):
+    """Название и важность подписки пользователя или None, если такой подписки нет"""
+    conn = _user_connection(user_id)
+    return conn.execute(
+        'SELECT service_name, importance FROM subscriptions WHERE id = ? AND user_id = ?',
+        (sub_id, user_id)
+    ).fetchone()
+
+
+def _write_importance(conn, user_id, sub_id, importance):
+    row = conn.execute(
+        'UPDATE subscriptions SET importance = ? WHERE id = ? AND user_id = ? RETURNING service_name, user_id',
+        (importance, sub_id, user_id)
+    ).fetchone()
+    return row if row else (None, None)
+
+
+def update_importance(user_id, sub_id, importance):
+    """Изменить важность подписки пользователя. Возвращает название сервиса"""
+    return _run_write('update_importance', user_id, sub_id, importance)
+
+
+def get_users_with_subs():
+    """ID всех пользователей, у которых есть подписки (запрос ко всем шардам)"""
+    per_shard = _fan_out(lambda path: [
+        row[0] for row in create_connection(path).execute('SELECT DISTINCT user_id FROM subscriptions')
+    ])
+    return sorted(set().union(*per_shard))
+
+
+def delete_sub_by_id(user_id, sub_id):
+    """Удаление подписки пользователя по первичному ключу"""
+    conn = _user_connection(user_id)
+    with _write_transaction(conn):
+        row = conn.execute(
+            'DELETE FROM subscriptions WHERE id = ? AND user_id = ? RETURNING user_id', (sub_id, user_id)
+        ).fetchone()
+        if row:
+            # Внешние ключи в SQLite выключены, поэтому ON DELETE CASCADE выполняем сами
+            conn.execute('DELETE FROM usage_history WHERE subscription_id = ?', (sub_id,))
+            conn.execute('DELETE FROM usage_stats WHERE subscription_id = ?', (sub_id,))
+    if row:
+        _notify_write(row[0])
+
+
+def _write_usage_score(conn, subscription_id, user_id, week_start_date, usage_score):
+    owned = conn.execute(
+        'SELECT 1 FROM subscriptions WHERE id = ? AND user_id = ?', (subscription_id, user_id)
+    ).fetchone()
+    if not owned:
+        return None, None  # подписки нет (удалена) или она чужая
+    _apply_usage_score(conn, subscription_id, week_start_date, usage_score)
+    return None, user_id
 
 
 def save_usage_score(subscription_id, user_id, week_start_date, usage_score):
     """Сохранить оценку использования за неделю"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO usage_history 
-        (subscription_id, week_start_date, usage_score)
+    _run_write('save_usage_score', subscription_id, user_id, week_start_date, usage_score)
+
+
+def _apply_usage_score(conn, subscription_id, week_start_date, usage_score):
+    """
+    Записать оценку и обновить агрегаты usage_stats (внутри транзакции вызывающего).
+
+    Сумма и количество меняются на разницу со старой оценкой, среднее за последние
+    недели пересчитывается по индексу (не больше RECENT_USAGE_WEEKS строк).
+    """
+    week = str(week_start_date)
+    old = conn.execute('''
+        SELECT usage_score FROM usage_history
+        WHERE subscription_id = ? AND week_start_date = ?
+    ''', (subscription_id, week)).fetchone()
+
+    conn.execute('''
+        INSERT INTO usage_history (subscription_id, week_start_date, usage_score)
         VALUES (?, ?, ?)
-    ''', (subscription_id, week_start_date, usage_score))
-    conn.commit()
-    conn.close()
+        ON CONFLICT(subscription_id, week_start_date)
+        DO UPDATE SET usage_score = excluded.usage_score, date_recorded = CURRENT_TIMESTAMP
+    ''', (subscription_id, week, usage_score))
 
+    conn.execute('''
+        INSERT INTO usage_stats (subscription_id, score_sum, score_count, last_week)
+        VALUES (:sub_id, :score, 1, :week)
+        ON CONFLICT(subscription_id) DO UPDATE SET
+            score_sum = score_sum + :delta,
+            score_count = score_count + :added,
+            last_week = MAX(COALESCE(last_week, ''), :week)
+    ''', {
+        'sub_id': subscription_id,
+        'score': usage_score,
+        'week': week,
+        'delta': usage_score - old[0] if old else usage_score,
+        'added': 0 if old else 1,
+    })
 
-def get_average_usage_score(subscription_id, weeks=4):
-    """Получить среднюю оценку использования за последние N недель"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT AVG(usage_score) 
-        FROM usage_history 
-        WHERE subscription_id = ?
-        ORDER BY week_start_date DESC
-        LIMIT ?
-    ''', (subscription_id, weeks))
-    result = cursor.fetchone()
-    conn.close()
+    conn.execute('''
+        UPDATE usage_stats SET recent_avg = (
+            SELECT AVG(usage_score) FROM (
+                SELECT usage_score FROM usage_history
+                WHERE subscription_id = :sub_id
+                ORDER BY week_start_date DESC
+                LIMIT :weeks
+            )
+        )
+        WHERE subscription_id = :sub_id
+    ''', {'sub_id': subscription_id, 'weeks': RECENT_USAGE_WEEKS})
+
+
+def rebuild_usage_stats(subscription_ids=None, conn=None):
+    """
+    Пересчитать usage_stats по истории: для указанных подписок или для всех.
+
+    Нужен после массовой записи в usage_history в обход save_usage_score
+    (импорт, генерация тестовых данных). Выполняется в транзакции вызывающего,
+    если передано его соединение conn, иначе - во всех шардах.
+    """
+    if conn is None:
+        ids = None if subscription_ids is None else list(subscription_ids)
+        _fan_out(lambda path: _rebuild_usage_stats(create_connection(path), ids, own_transaction=True))
+    else:
+        _rebuild_usage_stats(conn, subscription_ids, own_transaction=False)
+    # Средние оценки в кэше подписок устарели
+    clear_subs_cache()
+
+
+def _rebuild_usage_stats(conn, subscription_ids, own_transaction):
+    ids = None if subscription_ids is None else json.dumps(list(subscription_ids))
+    try:
+        conn.execute('''
+            DELETE FROM usage_stats
+            WHERE :ids IS NULL OR subscription_id IN (SELECT value FROM json_each(:ids))
+        ''', {'ids': ids})
+        conn.execute('''
+            INSERT INTO usage_stats (subscription_id, score_sum, score_count, recent_avg, last_week)
+            SELECT subscription_id,
+                   SUM(usage_score),
+                   COUNT(*),
+                   AVG(CASE WHEN week_rank <= :weeks THEN usage_score END),
+                   MAX(week_start_date)
+            FROM (
+                SELECT subscription_id, usage_score, week_start_date,
+                       ROW_NUMBER() OVER (PARTITION BY subscription_id ORDER BY week_start_date DESC) AS week_rank
+                FROM usage_history
+                WHERE :ids IS NULL OR subscription_id IN (SELECT value FROM json_each(:ids))
+            )
+            GROUP BY subscription_id
+        ''', {'ids': ids, 'weeks': RECENT_USAGE_WEEKS})
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        raise
+    if own_transaction:
+        conn.commit()
+
+
+# Мелкие записи, которые можно объединять в общую транзакцию (write_batch).
+# Функция получает соединение вызывающего и возвращает (результат, user_id);
+# второе значение - номер аргумента с user_id, по которому выбирается шард.
+BATCHABLE_WRITES = {
+    'add_subscription': (_write_subscription, 0),
+    'update_importance': (_write_importance, 0),
+    'save_usage_score': (_write_usage_score, 1),
+}
+
+
+def _write_shard_batch(conn, writes):
+    """Пачка записей одного шарда одной транзакцией; возвращает (результаты, user_id)"""
+    results = []
+    user_ids = set()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for name, args in writes:
+            conn.execute('SAVEPOINT batch_write')
+            try:
+                result, user_id = BATCHABLE_WRITES[name][0](conn, *args)
+            except Exception as e:
+                conn.execute('ROLLBACK TO batch_write')
+                conn.execute('RELEASE batch_write')
+                results.append((False, e))
+                continue
+            conn.execute('RELEASE batch_write')
+            results.append((True, result))
+            user_ids.add(user_id)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        # Транзакция не зафиксирована - ни одна запись шарда не сохранена
+        return [(False, e)] * len(writes), set()
+    return results, user_ids
+
+
+def write_batch(writes):
+    """
+    Выполнить пачку записей одной транзакцией на шард (один коммит вместо многих).
+
+    writes: список пар (имя из BATCHABLE_WRITES, аргументы). Каждая запись
+    выполняется в своей точке сохранения, поэтому ошибка в одной откатывает
+    только её, а остальные фиксируются. Шарды фиксируются параллельно.
+
+    Returns:
+        Список пар (True, результат) или (False, исключение) в порядке writes
+    """
+    by_shard = {}
+    for index, (name, args) in enumerate(writes):
+        path = get_user_shard(args[BATCHABLE_WRITES[name][1]])
+        by_shard.setdefault(path, []).append(index)
+
+    paths = list(by_shard)
+    shard_results = _fan_out(
+        lambda path: _write_shard_batch(create_connection(path), [writes[i] for i in by_shard[path]]),
+        paths,
+    )
+
+    results = [None] * len(writes)
+    for path, (batch_results, user_ids) in zip(paths, shard_results):
+        for index, result in zip(by_shard[path], batch_results):
+            results[index] = result
+        for user_id in user_ids:
+            _notify_write(user_id)
+    return results
+
+
+def get_average_usage_score(user_id, subscription_id, weeks=RECENT_USAGE_WEEKS):
+    """Получить среднюю оценку использования подписки пользователя за последние N недель"""
+    conn = _user_connection(user_id)
+    if weeks == RECENT_USAGE_WEEKS:
+        # Уже посчитано в usage_stats
+        result = conn.execute(
+            'SELECT recent_avg FROM usage_stats WHERE subscription_id = ?',
+            (subscription_id,)
+        ).fetchone()
+    else:
+        result = conn.execute('''
+            SELECT AVG(usage_score) FROM (
+                SELECT usage_score
+                FROM usage_history 
+                WHERE subscription_id = ?
+                ORDER BY week_start_date DESC
+                LIMIT ?
+            )
+        ''', (subscription_id, weeks)).fetchone()
     if result and result[0] is not None:
         return round(result[0], 2)
     return None
 
 
-def check_subscription_rated(subscription_id, week_start_date):
-    """Проверить, была ли подписка оценена за указанную неделю"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
+def check_subscription_rated(user_id, subscription_id, week_start_date):
+    """Проверить, была ли подписка пользователя оценена за указанную неделю"""
+    conn = _user_connection(user_id)
+    result = conn.execute('''
         SELECT usage_score FROM usage_history 
         WHERE subscription_id = ? AND week_start_date = ?
-    ''', (subscription_id, week_start_date))
-    result = cursor.fetchone()
-    conn.close()
+    ''', (subscription_id, week_start_date)).fetchone()
     return result[0] if result else None
 
 
 def get_rated_subscriptions_for_week(user_id, week_start_date):
     """Получить список ID подписок, которые уже оценены за неделю"""
-    conn = create_connection()
-    cursor = conn.cursor()
+    conn = _user_connection(user_id)
     # Получаем через JOIN с subscriptions, так как user_id убрали из usage_history
-    cursor.execute('''
+    cursor = conn.execute('''
         SELECT DISTINCT uh.subscription_id 
         FROM usage_history uh
         JOIN subscriptions s ON uh.subscription_id = s.id
         WHERE s.user_id = ? AND uh.week_start_date = ?
     ''', (user_id, week_start_date))
-    result = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return result
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_usage_series(user_id, since):
+    """
+    Оценки всех подписок пользователя начиная с недели since (для trends.py).
+
+    Returns:
+        Список строк (subscription_id, номер недели от since, usage_score)
+    """
+    conn = _user_connection(user_id)
+    return conn.execute('''
+        SELECT uh.subscription_id,
+               CAST(julianday(uh.week_start_date) - julianday(:since) AS INTEGER) / 7,
+               uh.usage_score
+        FROM subscriptions s
+        JOIN usage_history uh ON uh.subscription_id = s.id
+        WHERE s.user_id = :user_id AND uh.week_start_date >= :since
+    ''', {'user_id': user_id, 'since': since}).fetchall()
 
 
 def get_unused_subscriptions(user_id, weeks_threshold=3):
@@ -201,28 +710,529 @@ def get_unused_subscriptions(user_id, weeks_threshold=3):
         weeks_threshold: Количество недель неиспользования для уведомления
     
     Returns:
-        Список кортежей (sub_id, service_name, price, last_usage_week, weeks_unused)
+        Список кортежей (sub_id, service_name, price, currency, last_usage_week, weeks_unused)
     """
-    conn = create_connection()
-    cursor = conn.cursor()
+    conn = _user_connection(user_id)
     
     # Получаем все подписки пользователя (кроме ЖКХ) с информацией о последнем использовании
-    cursor.execute('''
-        SELECT s.id, s.service_name, s.price, 
-               MAX(uh.week_start_date) as last_usage_week,
-               CASE 
-                   WHEN MAX(uh.week_start_date) IS NOT NULL THEN
-                       CAST((julianday('now') - julianday(MAX(uh.week_start_date))) / 7 AS INTEGER)
-                   ELSE
-                       CAST((julianday('now') - julianday(s.date_added)) / 7 AS INTEGER)
-               END as weeks_unused
+    return conn.execute('''
+        SELECT s.id, s.service_name, s.price, s.currency,
+               st.last_week as last_usage_week,
+               CAST((julianday('now') - julianday(COALESCE(st.last_week, s.date_added))) / 7 AS INTEGER)
+                   as weeks_unused
         FROM subscriptions s
-        LEFT JOIN usage_history uh ON s.id = uh.subscription_id
+        LEFT JOIN usage_stats st ON s.id = st.subscription_id
         WHERE s.user_id = ? AND s.category != 'Коммуналка / ЖКХ'
-        GROUP BY s.id, s.service_name, s.price, s.date_added
-        HAVING weeks_unused >= ?
-    ''', (user_id, weeks_threshold))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
\ No newline at end of file
+          AND weeks_unused >= ?
+    ''', (user_id, weeks_threshold)).fetchall()
+
+
+def iter_unused_subscriptions(weeks_threshold=3, page_size=1000):
+    """
+    Неиспользуемые подписки всех пользователей за один проход по индексу.
+
+    Генератор выдаёт пары (user_id, [(sub_id, service_name, price, currency, last_usage_week, weeks_unused), ...])
+    в порядке возрастания user_id. Строки читаются страницами по page_size
+    (keyset-пагинация по (user_id, id)), поэтому между страницами не держится
+    открытая транзакция чтения и память не зависит от числа пользователей.
+    """
+    # Пользователь целиком лежит в одном шарде, поэтому потоки шардов сливаются по (user_id, id)
+    rows = heapq.merge(
+        *(_iter_unused_rows(path, weeks_threshold, page_size) for path in shard_paths()),
+        key=lambda row: (row[0], row[1]),
+    )
+    for user_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        yield user_id, [row[1:] for row in group]
+
+
+def _iter_unused_rows(path, weeks_threshold, page_size):
+    conn = create_connection(path)
+    # Одна точка отсчёта для всех страниц
+    now = conn.execute("SELECT julianday('now')").fetchone()[0]
+    last_user_id, last_sub_id = 0, 0
+    while True:
+        conn = create_connection(path)  # генератор может продолжаться в другом потоке пула
+        page = conn.execute('''
+            SELECT s.user_id, s.id, s.service_name, s.price, s.currency,
+                   st.last_week as last_usage_week,
+                   CAST((? - julianday(COALESCE(st.last_week, s.date_added))) / 7 AS INTEGER)
+                       as weeks_unused
+            FROM subscriptions s
+            LEFT JOIN usage_stats st ON s.id = st.subscription_id
+            WHERE (s.user_id, s.id) > (?, ?) AND s.category != 'Коммуналка / ЖКХ'
+              AND weeks_unused >= ?
+            ORDER BY s.user_id, s.id
+            LIMIT ?
+        ''', (now, last_user_id, last_sub_id, weeks_threshold, page_size)).fetchall()
+        yield from page
+        if len(page) < page_size:
+            return
+        last_user_id, last_sub_id = page[-1][0], page[-1][1]
+
+
+def _import_chunk(conn, chunk):
+    """Вставить порцию записей импорта в шард (в транзакции вызывающего). Возвращает число оценок"""
+    conn.executemany('''
+        INSERT INTO subscriptions (user_id, service_name, price, currency, category, importance)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [record[:6] for record in chunk])
+    # Пока транзакция держит блокировку записи, AUTOINCREMENT выдаёт id подряд
+    last_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'subscriptions'").fetchone()[0]
+    first_id = last_id - len(chunk) + 1
+
+    history = [
+        (first_id + i, week_start_date, usage_score)
+        for i, record in enumerate(chunk)
+        for week_start_date, usage_score in record[6]
+    ]
+    conn.executemany('''
+        INSERT INTO usage_history (subscription_id, week_start_date, usage_score)
+        VALUES (?, ?, ?)
+        ON CONFLICT(subscription_id, week_start_date) DO UPDATE SET usage_score = excluded.usage_score
+    ''', history)
+    if history:
+        rebuild_usage_stats(range(first_id, last_id + 1), conn=conn)
+    return len(history)
+
+
+def import_subscriptions(records, chunk_size=500):
+    """
+    Массовый импорт подписок с историей использования одной транзакцией.
+
+    records: итерируемое кортежей (user_id, service_name, price, currency, category, importance, usage),
+    где usage - список пар (week_start_date, usage_score). Записи читаются порциями
+    по chunk_size и вставляются через executemany, поэтому память не зависит от
+    объёма импорта. Любая ошибка (в том числе в records) откатывает импорт целиком.
+    Если записи попадают в несколько шардов, транзакции шардов фиксируются
+    одна за другой в конце импорта.
+
+    Returns:
+        Кортеж (число подписок, число оценок)
+    """
+    records = iter(records)
+    user_ids = set()
+    subs_count = usage_count = 0
+    connections = {}  # шард -> соединение с открытой транзакцией
+    try:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            by_shard = {}
+            for record in chunk:
+                by_shard.setdefault(get_user_shard(record[0]), []).append(record)
+            for path, shard_chunk in by_shard.items():
+                conn = connections.get(path)
+                if conn is None:
+                    conn = connections[path] = create_connection(path)
+                    conn.execute('BEGIN IMMEDIATE')
+                usage_count += _import_chunk(conn, shard_chunk)
+
+            user_ids.update(record[0] for record in chunk)
+            subs_count += len(chunk)
+        for conn in connections.values():
+            conn.commit()
+    except Exception:
+        for conn in connections.values():
+            conn.rollback()
+        raise
+
+    for user_id in user_ids:
+        _notify_write(user_id)
+    return subs_count, usage_count
+
+
+def iter_subscriptions_export(user_id=None, page_size=500, since=None):
+    """
+    Подписки с историей оценок для выгрузки: одного пользователя или всех.
+
+    Генератор кортежей (user_id, service_name, price, currency, category, importance, usage),
+    price - в валюте платежа currency, usage - список пар (week_start_date, usage_score) по возрастанию недели
+    (с недели since, если она задана).
+    Подписки читаются страницами по page_size (keyset-пагинация по (user_id, id)),
+    история - одним запросом на страницу.
+    """
+    if user_id is not None:
+        rows = _iter_export_rows(get_user_shard(user_id), user_id, page_size, since)
+    else:
+        rows = heapq.merge(
+            *(_iter_export_rows(path, None, page_size, since) for path in shard_paths()),
+            key=lambda row: (row[0], row[1]),
+        )
+    for row_user_id, _, name, price, currency_code, category, importance, usage in rows:
+        yield row_user_id, name, price, currency_code, category, importance, usage
+
+
+def _iter_export_rows(path, user_id, page_size, since=None):
+    # Оба варианта идут по индексу idx_subscriptions_user_id
+    if user_id is None:
+        where_clause = 'WHERE (user_id, id) > (:last_user_id, :last_sub_id)'
+    else:
+        where_clause = 'WHERE user_id = :user_id AND id > :last_sub_id'
+
+    last_user_id, last_sub_id = 0, 0
+    while True:
+        conn = create_connection(path)  # генератор может продолжаться в другом потоке пула
+        page = conn.execute(f'''
+            SELECT user_id, id, service_name, price, currency, category, importance
+            FROM subscriptions
+            {where_clause}
+            ORDER BY user_id, id
+            LIMIT :limit
+        ''', {'user_id': user_id, 'last_user_id': last_user_id, 'last_sub_id': last_sub_id,
+              'limit': page_size}).fetchall()
+
+        usage = {}
+        for sub_id, week_start_date, usage_score in conn.execute('''
+            SELECT subscription_id, week_start_date, usage_score
+            FROM usage_history
+            WHERE subscription_id IN (SELECT value FROM json_each(?)) AND week_start_date >= ?
+            ORDER BY subscription_id, week_start_date
+        ''', (json.dumps([row[1] for row in page]), since or '')):
+            usage.setdefault(sub_id, []).append((week_start_date, usage_score))
+
+        for row_user_id, sub_id, *fields in page:
+            yield row_user_id, sub_id, *fields, usage.get(sub_id, [])
+        if len(page) < page_size:
+            return
+        last_user_id, last_sub_id = page[-1][0], page[-1][1]
+
+
+def _merge_pages(per_shard, limit):
+    """Первые limit ID из отсортированных порций шардов"""
+    return sorted(set().union(*per_shard))[:limit]
+
+
+def get_users_with_subs_page(after_user_id=0, limit=500):
+    """Следующая порция ID пользователей с подписками (по возрастанию, после after_user_id)"""
+    return _merge_pages(_fan_out(lambda path: [row[0] for row in create_connection(path).execute('''
+        SELECT DISTINCT user_id FROM subscriptions
+        WHERE user_id > ?
+        ORDER BY user_id
+        LIMIT ?
+    ''', (after_user_id, limit))]), limit)
+
+
+def get_survey_users_page(timezone, send_hour, slot, slots, default_timezone, default_hour,
+                          after_user_id=0, limit=500):
+    """
+    Порция ID пользователей с подписками, которым опрос отправляется в группе
+    (часовой пояс, час отправки) и слоте user_id % slots == slot.
+
+    Пользователи без своих настроек относятся к группе (default_timezone, default_hour).
+    """
+    return _merge_pages(_fan_out(lambda path: [row[0] for row in create_connection(path).execute('''
+        SELECT DISTINCT s.user_id
+        FROM subscriptions s
+        LEFT JOIN user_settings u ON u.user_id = s.user_id
+        WHERE s.user_id > ?
+          AND s.user_id % ? = ?
+          AND COALESCE(u.timezone, ?) = ?
+          AND COALESCE(u.send_hour, ?) = ?
+        ORDER BY s.user_id
+        LIMIT ?
+    ''', (after_user_id, slots, slot, default_timezone, timezone, default_hour, send_hour, limit))]), limit)
+
+
+def get_survey_groups(default_timezone, default_hour):
+    """Различные пары (часовой пояс, час отправки опроса), включая значения по умолчанию"""
+    per_shard = _fan_out(lambda path: create_connection(path).execute(
+        'SELECT DISTINCT COALESCE(timezone, ?), COALESCE(send_hour, ?) FROM user_settings',
+        (default_timezone, default_hour)
+    ).fetchall())
+    return sorted(set().union(*per_shard) | {(default_timezone, default_hour)})
+
+
+def start_broadcast_job(job_id):
+    """
+    Создать задание рассылки или получить уже существующее.
+
+    Returns:
+        Кортеж (status, cursor): 'running' или 'done' и последний обработанный user_id
+    """
+    conn = create_connection()
+    with _write_transaction(conn):
+        conn.execute('INSERT OR IGNORE INTO broadcast_jobs (job_id) VALUES (?)', (job_id,))
+        return conn.execute(
+            'SELECT status, cursor FROM broadcast_jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+
+
+def save_broadcast_cursor(job_id, cursor):
+    """Сохранить последний полностью обработанный user_id задания"""
+    conn = create_connection()
+    with conn:
+        conn.execute('UPDATE broadcast_jobs SET cursor = ? WHERE job_id = ?', (cursor, job_id))
+
+
+def finish_broadcast_job(job_id):
+    """Отметить задание рассылки завершённым. Возвращает число доставок по статусам"""
+    conn = create_connection()
+    with _write_transaction(conn):
+        conn.execute('''
+            UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        ''', (job_id,))
+        return dict(conn.execute('''
+            SELECT status, COUNT(*) FROM broadcast_deliveries
+            WHERE job_id = ?
+            GROUP BY status
+        ''', (job_id,)).fetchall())
+
+
+def get_unfinished_broadcast_jobs(prefix):
+    """ID незавершённых заданий рассылки с указанным префиксом"""
+    conn = create_connection()
+    return [row[0] for row in conn.execute('''
+        SELECT job_id FROM broadcast_jobs
+        WHERE status = 'running' AND job_id LIKE ? || '%'
+        ORDER BY started_at
+    ''', (prefix,))]
+
+
+def claim_broadcast_deliveries(job_id, user_ids):
+    """
+    Зарезервировать отправку задания пользователям.
+
+    Возвращает только тех, кому задание ещё не отправлялось; им ставится статус 'pending'.
+    """
+    conn = create_connection()
+    claimed = []
+    with conn:
+        for user_id in user_ids:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO broadcast_deliveries (job_id, user_id, status)
+                VALUES (?, ?, 'pending')
+            ''', (job_id, user_id))
+            if cursor.rowcount:
+                claimed.append(user_id)
+    return claimed
+
+
+def mark_broadcast_delivery(job_id, user_id, status):
+    """Записать итог доставки: 'sent', 'failed' или 'skipped'"""
+    conn = create_connection()
+    with conn:
+        conn.execute('''
+            UPDATE broadcast_deliveries SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND user_id = ?
+        ''', (status, job_id, user_id))
+
+
+def get_user_settings(user_id):
+    """Настройки пользователя: кортеж (timezone, send_hour), None - значение по умолчанию"""
+    conn = _user_connection(user_id)
+    return conn.execute(
+        'SELECT timezone, send_hour FROM user_settings WHERE user_id = ?', (user_id,)
+    ).fetchone() or (None, None)
+
+
+def save_user_settings(user_id, timezone, send_hour):
+    """Сохранить настройки пользователя (None - значение по умолчанию)"""
+    conn = _user_connection(user_id)
+    with conn:
+        conn.execute('''
+            INSERT INTO user_settings (user_id, timezone, send_hour) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET timezone = excluded.timezone, send_hour = excluded.send_hour
+        ''', (user_id, timezone, send_hour))
+
+
+def get_scheduler_runs():
+    """Время последнего запуска фоновых заданий: {имя задания: unix-время}"""
+    conn = create_connection()
+    return dict(conn.execute('SELECT job, last_run FROM scheduler_runs').fetchall())
+
+
+def save_scheduler_run(job, last_run):
+    """Запомнить время (unix) последнего выполненного запуска задания"""
+    conn = create_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO scheduler_runs (job, last_run) VALUES (?, ?)
+            ON CONFLICT(job) DO UPDATE SET last_run = excluded.last_run
+        ''', (job, last_run))
+
+
+def get_shard_users(path):
+    """ID пользователей с данными в шарде path"""
+    conn = create_connection(path)
+    return [row[0] for row in conn.execute('''
+        SELECT user_id FROM subscriptions
+        UNION
+        SELECT user_id FROM user_settings
+    ''')]
+
+
+def get_misplaced_users(path):
+    """Пользователи шарда path, которым по кольцу положен другой шард"""
+    ring = get_ring()
+    return [user_id for user_id in get_shard_users(path) if ring.get(user_id) != path]
+
+
+def pin_user(user_id, path):
+    """Закрепить пользователя за шардом до переноса. Возвращает 1, если закрепление добавлено"""
+    conn = create_connection()
+    with conn:
+        return conn.execute(
+            'INSERT OR IGNORE INTO user_shards (user_id, shard) VALUES (?, ?)', (user_id, path)
+        ).rowcount
+
+
+def get_pinned_users():
+    """Закреплённые пользователи: список (user_id, шард)"""
+    conn = create_connection()
+    return conn.execute('SELECT user_id, shard FROM user_shards ORDER BY user_id').fetchall()
+
+
+def move_user(user_id, source, target):
+    """
+    Перенести все данные пользователя из шарда source в target и снять закрепление.
+
+    Оба шарда блокируются на запись на время переноса одного пользователя.
+    Подписки получают в target новые ID из его диапазона (история и агрегаты
+    переносятся под новыми ID), поэтому ID остаются уникальными между шардами.
+    Копия, оставшаяся в target после сбоя между коммитами, сначала удаляется,
+    поэтому повторный перенос безопасен.
+    """
+    if source != target:
+        src = create_connection(source)
+        dst = create_connection(target)
+        dst.execute('BEGIN IMMEDIATE')
+        src.execute('BEGIN IMMEDIATE')
+        try:
+            subs = src.execute('''
+                SELECT id, user_id, service_name, price, currency, category, importance, date_added
+                FROM subscriptions WHERE user_id = ?
+                ORDER BY id
+            ''', (user_id,)).fetchall()
+            ids = json.dumps([sub[0] for sub in subs])
+            history = src.execute('''
+                SELECT subscription_id, week_start_date, usage_score, date_recorded
+                FROM usage_history WHERE subscription_id IN (SELECT value FROM json_each(?))
+            ''', (ids,)).fetchall()
+            stats = src.execute('''
+                SELECT subscription_id, score_sum, score_count, recent_avg, last_week
+                FROM usage_stats WHERE subscription_id IN (SELECT value FROM json_each(?))
+            ''', (ids,)).fetchall()
+            settings = src.execute(
+                'SELECT user_id, timezone, send_hour FROM user_settings WHERE user_id = ?', (user_id,)
+            ).fetchall()
+
+            # Остатки прерванного переноса этого же пользователя
+            leftover = json.dumps([row[0] for row in dst.execute(
+                'SELECT id FROM subscriptions WHERE user_id = ?', (user_id,)
+            )])
+            dst.execute('DELETE FROM usage_history WHERE subscription_id IN (SELECT value FROM json_each(?))',
+                        (leftover,))
+            dst.execute('DELETE FROM usage_stats WHERE subscription_id IN (SELECT value FROM json_each(?))',
+                        (leftover,))
+            dst.execute('DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+
+            dst.executemany('''
+                INSERT INTO subscriptions
+                    (user_id, service_name, price, currency, category, importance, date_added)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [sub[1:] for sub in subs])
+            # Пока транзакция держит блокировку записи, AUTOINCREMENT выдаёт id подряд
+            new_ids = {}
+            if subs:
+                last_id = dst.execute("SELECT seq FROM sqlite_sequence WHERE name = 'subscriptions'").fetchone()[0]
+                new_ids = {sub[0]: last_id - len(subs) + 1 + i for i, sub in enumerate(subs)}
+
+            dst.executemany('''
+                INSERT INTO usage_history (subscription_id, week_start_date, usage_score, date_recorded)
+                VALUES (?, ?, ?, ?)
+            ''', [(new_ids[row[0]], *row[1:]) for row in history])
+            dst.executemany('INSERT INTO usage_stats VALUES (?, ?, ?, ?, ?)',
+                            [(new_ids[row[0]], *row[1:]) for row in stats])
+            dst.executemany('INSERT OR REPLACE INTO user_settings VALUES (?, ?, ?)', settings)
+
+            src.execute('DELETE FROM usage_history WHERE subscription_id IN (SELECT value FROM json_each(?))', (ids,))
+            src.execute('DELETE FROM usage_stats WHERE subscription_id IN (SELECT value FROM json_each(?))', (ids,))
+            src.execute('DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+            src.execute('DELETE FROM user_settings WHERE user_id = ?', (user_id,))
+            # Сначала фиксируется копия: при сбое между коммитами данные есть в обоих шардах
+            dst.commit()
+            src.commit()
+        except Exception:
+            dst.rollback()
+            src.rollback()
+            raise
+
+    conn = create_connection()
+    with conn:
+        conn.execute('DELETE FROM user_shards WHERE user_id = ?', (user_id,))
+    _notify_write(user_id)
+
+
+def get_fsm_record(key):
+    """
+    Состояние диалога по ключу хранилища FSM.
+
+    Returns:
+        Кортеж (state, data_json) или None, если записи нет или её TTL истёк
+    """
+    conn = create_connection()
+    return conn.execute(
+        'SELECT state, data FROM fsm_storage WHERE key = ? AND expires_at > ?',
+        (key, time.time())
+    ).fetchone()
+
+
+def save_fsm_records(records, ttl):
+    """
+    Записать пачку изменений состояний диалогов одной транзакцией.
+
+    records: словари с ключами key, state, data (JSON) и флагами has_state, has_data -
+    какие из полей были изменены. Неизменённое поле сохраняет прежнее значение,
+    если запись ещё не истекла. Срок жизни записи продлевается на ttl секунд,
+    пустые записи (после state.clear()) удаляются.
+    """
+    now = time.time()
+    params = [dict(record, now=now, expires_at=now + ttl) for record in records]
+    conn = create_connection()
+    with conn:
+        conn.executemany('''
+            INSERT INTO fsm_storage (key, state, data, expires_at)
+            VALUES (:key, :state, :data, :expires_at)
+            ON CONFLICT(key) DO UPDATE SET
+                state = CASE WHEN :has_state OR fsm_storage.expires_at <= :now
+                             THEN excluded.state ELSE fsm_storage.state END,
+                data = CASE WHEN :has_data OR fsm_storage.expires_at <= :now
+                            THEN excluded.data ELSE fsm_storage.data END,
+                expires_at = excluded.expires_at
+        ''', params)
+        conn.executemany(
+            "DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'",
+            [(record['key'],) for record in records]
+        )
+
+
+def delete_expired_fsm_records():
+    """Удалить состояния брошенных диалогов. Возвращает число удалённых записей"""
+    conn = create_connection()
+    with conn:
+        return conn.execute('DELETE FROM fsm_storage WHERE expires_at <= ?', (time.time(),)).rowcount
+
+
+def _instrument():
+    """
+    Обернуть публичные функции модуля замером времени (bot_db_call_seconds)
+    и журналом медленных вызовов.
+
+    Генераторы не оборачиваются: их время распределено между итерациями.
+    """
+    skip = {
+        'create_connection', 'close_connections', 'add_write_listener', 'clear_subs_cache', 'get_subs_cache_stats',
+        'shard_paths', 'get_ring', 'get_user_shard',
+    }
+    for name, func in list(globals().items()):
+        if (name.startswith('_') or name in skip or not inspect.isfunction(func)
+                or func.__module__ != __name__ or inspect.isgeneratorfunction(func)):
+            continue
+        globals()[name] = metrics.timed(db_call_seconds, name, slow_ms=DB_SLOW_QUERY_MS)(func)
+
+
+_instrument()
+metrics.gauge('bot_subs_cache', "Кэш подписок пользователей", ['stat'],
+              lambda: {(name,): value for name, value in get_subs_cache_stats().items()})
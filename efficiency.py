@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Пороги стоимости за единицу удовольствия (в базовой валюте, currency.BASE_CURRENCY)
+MEDIUM_COST = 30
+HIGH_COST = 50
+VERY_HIGH_COST = 100
+
+# Уровни эффективности (индексы в таблицах ниже)
+TIER_NO_DATA = 0     # нет оценок использования
+TIER_UNDEFINED = 1   # стоимость не определена (нулевая важность или использование)
+TIER_OPTIMAL = 2     # <= MEDIUM_COST
+TIER_MEDIUM = 3      # (MEDIUM_COST, HIGH_COST]
+TIER_HIGH = 4        # (HIGH_COST, VERY_HIGH_COST]
+TIER_VERY_HIGH = 5   # > VERY_HIGH_COST
+
+# Какую долю цены можно сэкономить на подписке каждого уровня
+SAVINGS_SHARE = np.array([0.0, 0.0, 0.0, 0.2, 0.5, 1.0])
+# Цвет столбца на графике для каждого уровня
+TIER_COLORS = np.array(['gray', 'gray', 'green', 'orange', 'red', 'red'])
+
+# Столбцы пачки подписок: один элемент массива - одна подписка
+Batch = namedtuple('Batch', 'names price importance avg_usage')
+# Результат оценки: стоимость за единицу удовольствия (NaN, если не определена), уровень и экономия
+Scores = namedtuple('Scores', 'cost tier savings')
+
+
+def batch_from_rows(rows):
+    """
+    Столбцовая пачка из строк get_all_subs.
+
+    rows: кортежи (id, name, price, category, importance, avg_usage)
+    или старый формат (name, price, category, importance) без данных об использовании.
+    Отсутствующая оценка использования становится NaN.
+    """
+    names = []
+    price = np.empty(len(rows))
+    importance = np.empty(len(rows))
+    avg_usage = np.empty(len(rows))
+    for i, sub in enumerate(rows):
+        if len(sub) == 6:
+            _, name, price[i], _, importance[i], usage = sub
+        else:
+            # Старый формат без использования
+            name, price[i], _, importance[i] = sub
+            usage = None
+        names.append(name)
+        avg_usage[i] = np.nan if usage is None else float(usage)
+    return Batch(names, price, importance, avg_usage)
+
+
+def score(price, importance, avg_usage):
+    """
+    Векторный расчёт эффективности за один проход.
+
+    Стоимость за единицу удовольствия = цена / (важность * частота использования).
+    avg_usage: NaN означает, что данных об использовании нет.
+    """
+    price = np.asarray(price, dtype=float)
+    importance = np.asarray(importance, dtype=float)
+    avg_usage = np.asarray(avg_usage, dtype=float)
+
+    has_data = ~np.isnan(avg_usage)
+    defined = has_data & (importance > 0) & (avg_usage > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = np.where(defined, price / (importance * avg_usage), np.nan)
+
+    tier = np.select(
+        [~has_data, ~defined, cost > VERY_HIGH_COST, cost > HIGH_COST, cost > MEDIUM_COST],
+        [TIER_NO_DATA, TIER_UNDEFINED, TIER_VERY_HIGH, TIER_HIGH, TIER_MEDIUM],
+        default=TIER_OPTIMAL,
+    )
+    savings = price * SAVINGS_SHARE[tier]
+    return Scores(cost, tier, savings)
+
+
+def score_batch(batch):
+    """Оценка пачки, собранной batch_from_rows"""
+    return score(batch.price, batch.importance, batch.avg_usage)
+
+
+def score_users(rows_by_user):
+    """
+    Оценка подписок многих пользователей одним векторным проходом (для пакетных отчётов).
+
+    rows_by_user: словарь {user_id: строки get_all_subs(..., include_usage=True)}
+
+    Returns:
+        Словарь {user_id: потенциальная экономия в месяц}
+    """
+    user_ids = list(rows_by_user)
+    batches = [batch_from_rows(rows_by_user[user_id]) for user_id in user_ids]
+    if not batches:
+        return {}
+
+    owner = np.repeat(np.arange(len(user_ids)), [len(batch.names) for batch in batches])
+    scores = score(
+        np.concatenate([batch.price for batch in batches]),
+        np.concatenate([batch.importance for batch in batches]),
+        np.concatenate([batch.avg_usage for batch in batches]),
+    )
+    totals = np.bincount(owner, weights=scores.savings, minlength=len(user_ids))
+    return dict(zip(user_ids, totals.tolist()))
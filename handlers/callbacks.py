@@ -1,10 +1,12 @@
-from aiogram import Dispatcher, F
+from aiogram import Dispatcher
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery
 
-import database as db
+import async_db as adb
+import callback_codec as codec
 import keyboards
-from services.survey import send_weekly_usage_survey
+from services.survey import SurveySession, survey_page_start, update_survey_markup
 from aiogram import Bot
 
 # Глобальная переменная для бота (будет установлена в main.py)
@@ -18,63 +20,119 @@ def set_bot(bot: Bot):
 from states import UsageRatingState, ChangeImportanceState
 
 
+def decode_callback(callback: CallbackQuery):
+    """
+    Фильтр: разобрать callback_data один раз и передать действие обработчику
+    (аргумент callback_action). Неизвестные данные не обрабатываются.
+    """
+    try:
+        return {'callback_action': codec.unpack(callback.data or '')}
+    except ValueError:
+        return False
+
+
 def register_callbacks_handlers(dp: Dispatcher):
     """Регистрация обработчиков callback-запросов"""
-    
-    @dp.callback_query(F.data.startswith("del_"))
-    async def confirm_delete(callback: CallbackQuery):
+
+    # Таблица обработчиков: тип действия (callback_codec) -> обработчик(callback, state, action)
+    handlers = {}
+
+    def on(action_type):
+        def decorator(func):
+            handlers[action_type] = func
+            return func
+        return decorator
+
+    @dp.callback_query(decode_callback)
+    async def dispatch_callback(callback: CallbackQuery, state: FSMContext, callback_action):
+        """Вызов обработчика по типу действия: один поиск в словаре вместо цепочки фильтров по префиксам"""
+        handler = handlers.get(type(callback_action))
+        if handler is None:
+            await callback.answer()
+            return
+        await handler(callback, state, callback_action)
+
+    @on(codec.DeleteSub)
+    async def confirm_delete(callback: CallbackQuery, state: FSMContext, action: codec.DeleteSub):
         """Удаление подписки"""
-        sub_id = int(callback.data.split("_")[1])
-        db.delete_sub_by_id(sub_id)
+        await adb.delete_sub_by_id(callback.from_user.id, action.sub_id)
         await callback.answer("Удалено!")  # Всплывающее уведомление
         await callback.message.edit_text("✅ Платёж успешно удален из базы.")
 
-    @dp.callback_query(F.data.startswith("rate_"))
-    async def start_rating_usage(callback: CallbackQuery, state: FSMContext):
+    @on(codec.RateSub)
+    async def start_rating_usage(callback: CallbackQuery, state: FSMContext, action: codec.RateSub):
         """Начало процесса оценки использования"""
-        parts = callback.data.split("_")
-        sub_id = int(parts[1])
-        week_start_str = parts[2]
+        sub_id, week_start = action
+        chat_id = callback.message.chat.id
+        message_id = callback.message.message_id
         
-        # Получаем информацию о подписке
-        conn = db.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT service_name FROM subscriptions WHERE id = ?',
-            (sub_id,)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        # Страница опроса загружается из БД один раз на сообщение, дальше берётся из FSM
+        session = SurveySession.from_dict((await state.get_data()).get('survey'))
+        if (session is None or not session.is_message(chat_id, message_id)
+                or session.week_start != week_start.isoformat() or not session.get_name(sub_id)):
+            # Та же страница, что показана в сообщении; без клавиатуры - страница с этой подпиской
+            after_id = survey_page_start(callback.message.reply_markup)
+            session = await SurveySession.load(callback.from_user.id, week_start, after_id=after_id or 0)
+            if session and not session.get_name(sub_id):
+                session = await SurveySession.load(callback.from_user.id, week_start, after_id=sub_id - 1)
+            if session:
+                session.chat_id, session.message_id = chat_id, message_id
         
-        if not result:
+        service_name = session.get_name(sub_id) if session else None
+        if not service_name:
             await callback.answer("Подписка не найдена", show_alert=True)
             return
         
-        service_name = result[0]
-        
-        # Сохраняем данные исходного сообщения с опросом для обновления
-        await state.update_data(
-            sub_id=sub_id, 
-            week_start=week_start_str,
-            survey_chat_id=callback.message.chat.id,
-            survey_message_id=callback.message.message_id
-        )
+        # Сообщение с опросом не меняем: после оценки в нём обновится только кнопка
+        await state.update_data(sub_id=sub_id, survey=session.to_dict())
         
-        await callback.message.edit_text(
-            f"Оцените использование <b>{service_name}</b> на этой неделе:\n\n"
-            "Введите число от 1 до 10:",
-            parse_mode="HTML"
-        )
         await callback.message.answer(
-            "Используйте клавиатуру ниже или введите число:",
+            f"Оцените использование <b>{service_name}</b> на этой неделе:\n\n"
+            "Используйте клавиатуру ниже или введите число от 1 до 10:",
+            parse_mode="HTML",
             reply_markup=keyboards.get_usage_rating_kb()
         )
         await state.set_state(UsageRatingState.waiting_for_rating)
         await callback.answer()
 
-    @dp.callback_query(F.data.startswith("finish_survey_"))
-    async def finish_survey(callback: CallbackQuery):
+    @on(codec.Page)
+    async def turn_page(callback: CallbackQuery, state: FSMContext, action: codec.Page):
+        """Переход на соседнюю страницу списка подписок или опроса"""
+        list_name = keyboards.PAGE_LISTS[action.list_id] if action.list_id < len(keyboards.PAGE_LISTS) else None
+        cursor = keyboards.page_cursor(action)
+        user_id = callback.from_user.id
+
+        if list_name == 'rate' and action.week_start:
+            session = await SurveySession.load(user_id, action.week_start, **cursor)
+            if session is None:
+                await callback.answer("У вас нет подписок для оценки.", show_alert=True)
+                return
+            session.chat_id, session.message_id = callback.message.chat.id, callback.message.message_id
+            await state.update_data(survey=session.to_dict())
+            await update_survey_markup(_bot or callback.bot, session)
+        elif list_name in keyboards.SUBS_LISTS:
+            subs, has_prev, has_next = await adb.get_subs_page(user_id, limit=keyboards.SUBS_PAGE_SIZE, **cursor)
+            if not subs:
+                await callback.message.edit_text("У вас пока нет активных подписок.")
+            else:
+                try:
+                    await callback.message.edit_reply_markup(
+                        reply_markup=keyboards.get_subs_page_kb(list_name, subs, has_prev, has_next)
+                    )
+                except TelegramBadRequest as e:
+                    # "message is not modified" - страница не изменилась
+                    if 'not modified' not in str(e):
+                        raise
+        await callback.answer()
+
+    @on(codec.FinishSurvey)
+    async def finish_survey(callback: CallbackQuery, state: FSMContext, action: codec.FinishSurvey):
         """Завершение опроса"""
+        # Сессия опроса больше не нужна, остальные данные диалога не трогаем
+        data = await state.get_data()
+        if data.pop('survey', None) is not None:
+            await state.set_data(data)
+        
         await callback.message.edit_text(
             "✅ <b>Опрос завершен!</b>\n\n"
             "Все ваши оценки сохранены. Вы можете проверить аналитику в разделе '💡 Советы по оптимизации'.",
@@ -82,20 +140,13 @@ def register_callbacks_handlers(dp: Dispatcher):
         )
         await callback.answer("Опрос завершен!")
 
-    @dp.callback_query(F.data.startswith("change_imp_"))
-    async def start_change_importance(callback: CallbackQuery, state: FSMContext):
+    @on(codec.ChangeImportance)
+    async def start_change_importance(callback: CallbackQuery, state: FSMContext, action: codec.ChangeImportance):
         """Начало процесса изменения важности"""
-        sub_id = int(callback.data.split("_")[2])
+        sub_id = action.sub_id
         
         # Получаем информацию о подписке
-        conn = db.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT service_name, importance FROM subscriptions WHERE id = ?',
-            (sub_id,)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        result = await adb.get_sub_info(callback.from_user.id, sub_id)
         
         if not result:
             await callback.answer("Подписка не найдена", show_alert=True)
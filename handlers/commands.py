@@ -1,11 +1,19 @@
 # handlers/commands.py
+import asyncio
+import logging
+import os
+import tempfile
+
 from aiogram import Bot, Dispatcher
-from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
 
-import database as db
+import async_db as adb
 import keyboards
-from services.survey import send_weekly_usage_survey
+from services.survey import send_weekly_usage_survey, SURVEY_TIMEZONE, SURVEY_SEND_HOUR
+from services.scheduler import parse_timezone, format_timezone
+from services import report, transfer
+from services.charts import ChartQueueFull
 
 # Глобальная переменная для бота (будет установлена в main.py)
 _bot: Bot = None
@@ -23,7 +31,7 @@ def register_commands_handlers(dp: Dispatcher):
     @dp.message(Command("start"))
     async def cmd_start(message: Message):
         """Приветствие"""
-        db.init_db()  # Гарантируем, что БД создана
+        await adb.init_db()  # Гарантируем, что БД создана
         await message.answer(
             f"Привет, {message.from_user.first_name}!\n"
             "Я помогу управлять регулярными платежами.\n"
@@ -36,12 +44,21 @@ def register_commands_handlers(dp: Dispatcher):
         help_text = (
             "<b>Как работает этот бот:</b>\n\n"
             "1️⃣ <b>Добавление:</b> Нажми '➕ Добавить ежемесячный платёж'. Бот спросит название, цену, "
-            "категорию и твою личную оценку полезности (от 1 до 10).\n\n"
+            "категорию и твою личную оценку полезности (от 1 до 10). Цену можно указать в другой валюте: "
+            "<code>9.99 USD</code>, <code>€5</code> - суммы и графики пересчитываются в рубли по курсу.\n\n"
             "2️⃣ <b>Аналитика:</b> Я построю график расходов по категориям и посчитаю, сколько ты тратишь в месяц и в год.\n\n"
             "3️⃣ <b>Оптимизация:</b> На основе твоих оценок я вычислю 'стоимость единицы удовольствия'. "
             "Если сервис дорогой, но ты оценил его полезность низко — я предложу его отключить.\n\n"
             "4️⃣ <b>Еженедельные опросы:</b> Каждую неделю бот будет спрашивать, как часто вы использовали каждую подписку.\n\n"
-            "5️⃣ <b>Команда /survey:</b> Вызовите опрос вручную в любое время.\n\n"
+            "5️⃣ <b>Команда /survey:</b> Вызовите опрос вручную в любое время.\n"
+            "Время опроса настраивается командой /schedule: часовой пояс и час, например "
+            "<code>/schedule Europe/Moscow 9</code> или <code>/schedule +5 20</code>.\n\n"
+            "6️⃣ <b>Импорт и выгрузка:</b> Пришлите файл .csv или .jsonl, чтобы добавить много платежей сразу. "
+            "Столбцы: service_name, price, currency, category, importance, usage "
+            "(оценки по неделям: <code>2025-01-06:7;2025-01-13:5</code>). "
+            "Команда /export (или /export jsonl) выгрузит ваши платежи в том же формате.\n\n"
+            "7️⃣ <b>Отчёт:</b> Команда /report пришлёт PDF с расходами по категориям, динамикой "
+            "стоимости за единицу удовольствия и прогнозом; /report год - то же за год.\n\n"
         )
         await message.answer(help_text, parse_mode="HTML")
 
@@ -51,3 +68,79 @@ def register_commands_handlers(dp: Dispatcher):
         if _bot:
             await send_weekly_usage_survey(_bot, message.from_user.id)
 
+    @dp.message(Command("schedule"))
+    async def cmd_schedule(message: Message, command: CommandObject):
+        """Часовой пояс и час еженедельного опроса"""
+        user_id = message.from_user.id
+        timezone, send_hour = await adb.get_user_settings(user_id)
+        args = (command.args or '').split()
+
+        for arg in args:
+            if arg.lower() in ('reset', 'сброс'):
+                timezone, send_hour = None, None
+            elif arg.isdigit():
+                if not 0 <= int(arg) <= 23:
+                    await message.answer("Час должен быть от 0 до 23.")
+                    return
+                send_hour = int(arg)
+            else:
+                try:
+                    timezone = parse_timezone(arg)
+                except ValueError:
+                    await message.answer(
+                        f"Не знаю часовой пояс {arg}. Укажите его как Europe/Moscow или смещение от UTC: +3"
+                    )
+                    return
+        if args:
+            await adb.save_user_settings(user_id, timezone, send_hour)
+
+        await message.answer(
+            f"🕙 Еженедельный опрос приходит в {send_hour if send_hour is not None else SURVEY_SEND_HOUR}:00 "
+            f"по часовому поясу {format_timezone(timezone or SURVEY_TIMEZONE) or 'сервера'}.\n"
+            "Изменить: /schedule [часовой пояс] [час], например <code>/schedule Asia/Yekaterinburg 9</code>; "
+            "вернуть по умолчанию: /schedule сброс",
+            parse_mode="HTML"
+        )
+
+    @dp.message(Command("export"))
+    async def cmd_export(message: Message, command: CommandObject):
+        """Выгрузка платежей пользователя в CSV или JSONL"""
+        fmt = (command.args or 'csv').strip().lower()
+        if fmt not in transfer.FORMATS:
+            await message.answer("Использование: /export csv или /export jsonl")
+            return
+
+        # Файл пишется на диск построчно в потоке БД и отправляется с диска
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"payments.{fmt}")
+            count = await adb.run(transfer.export_file, path, fmt, message.from_user.id)
+            if not count:
+                await message.answer("У вас пока нет платежей для выгрузки.")
+                return
+            await message.answer_document(FSInputFile(path), caption=f"📤 Платежей в файле: {count}")
+
+    @dp.message(Command("report"))
+    async def cmd_report(message: Message, command: CommandObject):
+        """PDF-отчёт за месяц или год"""
+        arg = (command.args or 'month').strip().lower()
+        period = {'месяц': 'month', 'год': 'year'}.get(arg, arg)
+        if period not in report.PERIODS:
+            await message.answer("Использование: /report или /report год")
+            return
+
+        # Отчёт строится в пуле процессов графиков прямо в файл и отправляется с диска
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "report.pdf")
+            try:
+                count = await report.render_report(path, message.from_user.id, period)
+            except ChartQueueFull:
+                await message.answer("Сейчас слишком много запросов на построение графиков, попробуйте через минуту.")
+                return
+            except asyncio.TimeoutError:
+                logging.error(f"Превышено время построения отчёта для пользователя {message.from_user.id}")
+                await message.answer("Не удалось построить отчёт, попробуйте позже.")
+                return
+            if not count:
+                await message.answer("У вас пока нет платежей для отчёта.")
+                return
+            await message.answer_document(FSInputFile(path), caption=f"📄 Отчёт за {report.PERIODS[period][1]}")
@@ -1,14 +1,23 @@
+import asyncio
+import logging
+import os
+import tempfile
+
 from aiogram import Dispatcher, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, BufferedInputFile
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import config
-import database as db
+import async_db as adb
+import currency
+import trends
 import utils
 import keyboards
 from states import AddSubState, UsageRatingState, ChangeImportanceState
-from services.survey import send_weekly_usage_survey
+from services.survey import SurveySession, update_survey_markup
+from services.charts import renderer, chart_cache, ChartQueueFull
+from services import transfer
 from aiogram import Bot
 
 # Глобальная переменная для бота (будет установлена в main.py)
@@ -21,6 +30,28 @@ def set_bot(bot: Bot):
     _bot = bot
 
 
+async def _send_chart(message: Message, kind, rows, filename, caption):
+    """Отправить график из кэша: по file_id, если он уже загружался, иначе PNG"""
+    entry = await renderer.render_cached(kind, rows, message.from_user.id)
+    if entry is None:
+        return
+
+    if entry.file_id:
+        try:
+            await message.answer_photo(entry.file_id, caption=caption)
+            return
+        except TelegramBadRequest:
+            # file_id больше не действителен - перерисовываем
+            chart_cache.discard(entry)
+            entry = await renderer.render_cached(kind, rows, message.from_user.id)
+            if entry is None:
+                return
+
+    sent = await message.answer_photo(BufferedInputFile(entry.png, filename=filename), caption=caption)
+    if sent.photo:
+        chart_cache.remember_file_id(entry, sent.photo[-1].file_id)
+
+
 def register_messages_handlers(dp: Dispatcher):
     """Регистрация обработчиков сообщений"""
     
@@ -34,17 +65,28 @@ def register_messages_handlers(dp: Dispatcher):
     @dp.message(AddSubState.waiting_for_name)
     async def process_name(message: Message, state: FSMContext):
         await state.update_data(name=message.text)
-        await message.answer("Сколько вы платите в месяц (в рублях)?")
+        await message.answer(
+            f"Сколько вы платите в месяц? Например: 299 (в {currency.SYMBOL}), 9.99 USD или €5"
+        )
         await state.set_state(AddSubState.waiting_for_price)
 
     @dp.message(AddSubState.waiting_for_price)
     async def process_price(message: Message, state: FSMContext):
-        # Проверка на число
-        if not message.text.isdigit():
-            await message.answer("Пожалуйста, введите число.")
+        # Число и необязательная валюта
+        try:
+            price, code = currency.parse_price(message.text)
+        except ValueError:
+            await message.answer("Пожалуйста, введите число, например 299 или 9.99 USD.")
+            return
+        if not price > 0:
+            await message.answer("Цена должна быть больше нуля.")
+            return
+        rates = await adb.get_fx_rates()
+        if code not in rates:
+            await message.answer(f"Курс {code} не загружен. Доступные валюты: {', '.join(sorted(rates))}")
             return
 
-        await state.update_data(price=float(message.text))
+        await state.update_data(price=price, currency=code)
         await message.answer("Выберите категорию:", reply_markup=keyboards.get_categories_kb())
         await state.set_state(AddSubState.waiting_for_category)
 
@@ -68,12 +110,13 @@ def register_messages_handlers(dp: Dispatcher):
 
         data = await state.get_data()
         # Сохраняем в БД
-        db.add_subscription(
+        await adb.add_subscription(
             user_id=message.from_user.id,
             name=data['name'],
             price=data['price'],
             category=data['category'],
-            importance=int(message.text)
+            importance=int(message.text),
+            currency_code=data.get('currency', currency.BASE_CURRENCY)
         )
 
         await message.answer("✅ Подписка успешно сохранена!", reply_markup=keyboards.get_main_kb())
@@ -91,16 +134,12 @@ def register_messages_handlers(dp: Dispatcher):
         sub_id = data['sub_id']
         
         # Обновляем важность в БД
-        conn = db.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE subscriptions SET importance = ? WHERE id = ?',
-            (new_importance, sub_id)
-        )
-        cursor.execute('SELECT service_name FROM subscriptions WHERE id = ?', (sub_id,))
-        service_name = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
+        service_name = await adb.update_importance(message.from_user.id, sub_id, new_importance)
+        if service_name is None:
+            # Подписку удалили, пока пользователь вводил важность
+            await message.answer("Подписка не найдена", reply_markup=keyboards.get_main_kb())
+            await state.clear()
+            return
         
         await message.answer(
             f"✅ Важность подписки <b>{service_name}</b> изменена на {new_importance}/10",
@@ -113,15 +152,19 @@ def register_messages_handlers(dp: Dispatcher):
 
     @dp.message(F.text == "📋 Список платежей")
     async def show_list(message: Message):
-        subs = db.get_all_subs(message.from_user.id, include_id=False, exclude_zkh=False, include_usage=False)
+        subs = await adb.get_all_subs(message.from_user.id, include_id=False, exclude_zkh=False, include_usage=False,
+                                      include_currency=True)
         if not subs:
             await message.answer("Список пуст.")
             return
 
         response = "<b>Ваши подписки:</b>\n\n"
         for sub in subs:
-            # sub = (name, price, category, importance)
-            response += f"🔹 <b>{sub[0]}</b> | {sub[1]}₽\n   Категория: {sub[2]} | Важность: {sub[3]}/10\n\n"
+            # sub = (name, price в базовой валюте, category, importance, цена в валюте платежа, валюта)
+            price = currency.format_price(sub[4], sub[5])
+            if sub[5] != currency.BASE_CURRENCY:
+                price += f" ≈ {currency.format_price(round(sub[1]))}"
+            response += f"🔹 <b>{sub[0]}</b> | {price}\n   Категория: {sub[2]} | Важность: {sub[3]}/10\n\n"
 
         await message.answer(response, parse_mode="HTML")
 
@@ -132,46 +175,61 @@ def register_messages_handlers(dp: Dispatcher):
         user_id = message.from_user.id
 
         # Текстовый отчет
-        subs = db.get_all_subs(user_id, include_id=False, exclude_zkh=False, include_usage=False)
+        subs = await adb.get_all_subs(user_id, include_id=False, exclude_zkh=False, include_usage=False)
         if not subs:
             await message.answer("Сначала добавьте данные.")
             return
 
         monthly, yearly = utils.calculate_monthly_forecast(subs)
         text = (f"💰 <b>Финансовая сводка:</b>\n"
-                f"В месяц: {monthly} руб.\n"
-                f"В год: {yearly} руб.\n")
+                f"В месяц: {currency.format_price(monthly)}\n"
+                f"В год: {currency.format_price(yearly)}\n")
         await message.answer(text, parse_mode="HTML")
 
         # Первый график (Круговой)
-        chart_data = db.get_stats_by_category(user_id)
-        pie_buf = utils.generate_pie_chart(chart_data)
+        chart_data = await adb.get_stats_by_category(user_id)
+
+        # Второй график (Столбчатый) - стоимость за единицу удовольствия.
+        # Использование - как в советах: экспоненциальное среднее последних недель
+        subs_with_usage = await adb.get_all_subs(user_id, include_id=True, exclude_zkh=False, include_usage=True)
+        usage_trends = await adb.run(trends.get_user_trends, user_id)
+        subs_with_usage = trends.recent_usage(usage_trends, subs_with_usage)
+
+        # Оба графика рисуются параллельно в пуле процессов, не блокируя остальных пользователей.
+        # Неизменившиеся данные берутся из кэша, отправка идёт по file_id
+        try:
+            await asyncio.gather(
+                renderer.render_cached('pie', chart_data, user_id),
+                renderer.render_cached('bar', subs_with_usage, user_id)
+            )
+        except ChartQueueFull:
+            await message.answer("Сейчас слишком много запросов на построение графиков, попробуйте через минуту.")
+            return
+        except asyncio.TimeoutError:
+            logging.error(f"Превышено время построения графиков для пользователя {user_id}")
+            await message.answer("Не удалось построить графики, попробуйте позже.")
+            return
 
-        # Второй график (Столбчатый) - стоимость за единицу удовольствия
-        subs_with_usage = db.get_all_subs(user_id, include_id=True, exclude_zkh=False, include_usage=True)
-        bar_buf = utils.generate_bar_chart(subs_with_usage)
         await message.answer("📊 Ваша финансовая статистика:")
 
-        if pie_buf:
-            await message.answer_photo(BufferedInputFile(pie_buf.read(), filename="pie.png"),
-                                       caption="Расходы по категориям")
-        if bar_buf:
-            await message.answer_photo(BufferedInputFile(bar_buf.read(), filename="bar.png"),
-                                       caption="Стоимость за единицу удовольствия")
+        await _send_chart(message, 'pie', chart_data, "pie.png", "Расходы по категориям")
+        await _send_chart(message, 'bar', subs_with_usage, "bar.png", "Стоимость за единицу удовольствия")
 
     # --- Рекомендации (Оптимизация) ---
 
     @dp.message(F.text == "💡 Советы по оптимизации")
     async def show_advice(message: Message):
-        subs_with_usage = db.get_all_subs(message.from_user.id, include_id=True, exclude_zkh=False, include_usage=True)
+        subs_with_usage = await adb.get_all_subs(message.from_user.id, include_id=True, exclude_zkh=False, include_usage=True)
         if not subs_with_usage:
             await message.answer("Нет данных для анализа.")
             return
 
-        advice_text, wasted_money = utils.analyze_efficiency(subs_with_usage)
+        # Советы учитывают последние недели и снижение использования, а не среднюю за всё время
+        usage_trends = await adb.run(trends.get_user_trends, message.from_user.id)
+        advice_text, wasted_money = utils.analyze_efficiency(subs_with_usage, usage_trends)
 
         header = "<b>Анализ эффективности:</b>\n\n"
-        footer = f"\n\n💸 Потенциальная экономия: <b>{wasted_money:.0f} руб./мес</b>" if wasted_money > 0 else ""
+        footer = f"\n\n💸 Потенциальная экономия: <b>{wasted_money:.0f}{currency.SYMBOL}/мес</b>" if wasted_money > 0 else ""
 
         await message.answer(header + advice_text + footer, parse_mode="HTML")
 
@@ -179,39 +237,30 @@ def register_messages_handlers(dp: Dispatcher):
 
     @dp.message(F.text == "✏️ Изменить важность платежа")
     async def select_sub_to_change_importance(message: Message):
-        subs = db.get_all_subs(message.from_user.id, include_id=True, exclude_zkh=False, include_usage=False)
+        # Клавиатура строится по одной странице подписок, остальные - кнопками навигации
+        subs, has_prev, has_next = await adb.get_subs_page(message.from_user.id, limit=keyboards.SUBS_PAGE_SIZE)
         if not subs:
             await message.answer("У вас пока нет активных подписок.")
             return
 
-        # Создаем инлайн-кнопки для каждой подписки
-        builder = InlineKeyboardBuilder()
-        for sub in subs:
-            # sub = (id, name, price, category, importance)
-            sub_id, name, price, category, importance = sub[0], sub[1], sub[2], sub[3], sub[4]
-            builder.button(text=f"{name} ({price}₽) - важность: {importance}/10", callback_data=f"change_imp_{sub_id}")
-
-        builder.adjust(1)
-        await message.answer("Выберите подписку для изменения важности:", reply_markup=builder.as_markup())
+        await message.answer(
+            "Выберите подписку для изменения важности:",
+            reply_markup=keyboards.get_subs_page_kb('imp', subs, has_prev, has_next)
+        )
 
     # --- Удаление подписки ---
 
     @dp.message(F.text == "🗑 Удалить платёж")
     async def select_sub_to_delete(message: Message):
-        subs = db.get_all_subs(message.from_user.id, include_id=True, exclude_zkh=False, include_usage=False)
+        subs, has_prev, has_next = await adb.get_subs_page(message.from_user.id, limit=keyboards.SUBS_PAGE_SIZE)
         if not subs:
             await message.answer("У вас пока нет активных подписок.")
             return
 
-        # Создаем инлайн-кнопки для каждой подписки
-        builder = InlineKeyboardBuilder()
-        for sub in subs:
-            # sub = (id, name, price, category, importance)
-            sub_id, name, price = sub[0], sub[1], sub[2]
-            builder.button(text=f"❌ {name} ({price}₽)", callback_data=f"del_{sub_id}")
-
-        builder.adjust(1)
-        await message.answer("Выберите подписку для удаления:", reply_markup=builder.as_markup())
+        await message.answer(
+            "Выберите подписку для удаления:",
+            reply_markup=keyboards.get_subs_page_kb('del', subs, has_prev, has_next)
+        )
 
     # --- Обработка оценки использования ---
 
@@ -227,65 +276,58 @@ def register_messages_handlers(dp: Dispatcher):
         rating = int(message.text)
         data = await state.get_data()
         sub_id = data['sub_id']
-        week_start_str = data['week_start']
-        survey_chat_id = data.get('survey_chat_id')
-        survey_message_id = data.get('survey_message_id')
+        session = SurveySession.from_dict(data.get('survey'))
+        if session is None:
+            # Диалог начат до обновления бота - сессии опроса нет
+            await message.answer("Опрос устарел, откройте его заново: /survey", reply_markup=keyboards.get_main_kb())
+            await state.clear()
+            return
         
         # Сохраняем оценку
-        week_start_date = datetime.strptime(week_start_str, "%Y-%m-%d").date()
-        db.save_usage_score(sub_id, message.from_user.id, week_start_date, rating)
-        
-        # Получаем название сервиса для подтверждения
-        conn = db.create_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT service_name FROM subscriptions WHERE id = ?', (sub_id,))
-        service_name = cursor.fetchone()[0]
-        conn.close()
+        week_start_date = datetime.strptime(session.week_start, "%Y-%m-%d").date()
+        await adb.save_usage_score(sub_id, message.from_user.id, week_start_date, rating)
         
         # Показываем подтверждение
         await message.answer(
-            f"✅ Оценка для <b>{service_name}</b> сохранена: {rating}/10",
+            f"✅ Оценка для <b>{session.get_name(sub_id)}</b> сохранена: {rating}/10",
             parse_mode="HTML"
         )
         
-        # Обновляем сообщение с опросом, если оно было сохранено
-        if survey_chat_id and survey_message_id and _bot:
-            await send_weekly_usage_survey(
-                _bot,
-                message.from_user.id,
-                chat_id=survey_chat_id,
-                message_id=survey_message_id
-            )
+        # В сообщении с опросом меняется только кнопка оценённой подписки
+        if session.rate(sub_id, rating) and _bot:
+            await update_survey_markup(_bot, session)
         
-        await state.clear()
-
-    @dp.message(ChangeImportanceState.waiting_for_importance)
-    async def process_change_importance(message: Message, state: FSMContext):
-        """Обработка изменения важности"""
-        if not message.text.isdigit() or not (1 <= int(message.text) <= 10):
-            await message.answer("Пожалуйста, введите число от 1 до 10.", reply_markup=keyboards.get_usage_rating_kb())
+        # Выходим из состояния, но сессию опроса оставляем для следующих оценок
+        await state.set_state(None)
+        await state.set_data({'survey': session.to_dict()})
+
+    # --- Импорт платежей из файла ---
+
+    @dp.message(F.document)
+    async def import_document(message: Message):
+        """Импорт платежей из CSV/JSONL-файла (формат описан в /help)"""
+        document = message.document
+        fmt = transfer.detect_format(document.file_name)
+        if fmt is None:
+            await message.answer("Чтобы импортировать платежи, пришлите файл .csv или .jsonl (формат - в /help).")
             return
-        
-        new_importance = int(message.text)
-        data = await state.get_data()
-        sub_id = data['sub_id']
-        
-        # Обновляем важность в БД
-        conn = db.create_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE subscriptions SET importance = ? WHERE id = ?',
-            (new_importance, sub_id)
-        )
-        cursor.execute('SELECT service_name FROM subscriptions WHERE id = ?', (sub_id,))
-        service_name = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
-        
+        if document.file_size and document.file_size > transfer.IMPORT_MAX_FILE_SIZE:
+            await message.answer(f"Файл слишком большой, максимум {transfer.IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ.")
+            return
+
+        # Файл скачивается на диск и разбирается построчно в потоке БД
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"import.{fmt}")
+            await _bot.download(document, destination=path)
+            try:
+                subs_count, usage_count = await adb.run(
+                    transfer.import_file, path, fmt, message.from_user.id, transfer.IMPORT_MAX_ROWS
+                )
+            except transfer.TransferError as e:
+                await message.answer(f"❌ Файл не импортирован: {e}")
+                return
+
         await message.answer(
-            f"✅ Важность подписки <b>{service_name}</b> изменена на {new_importance}/10",
-            parse_mode="HTML",
+            f"✅ Импортировано платежей: {subs_count}, оценок использования: {usage_count}",
             reply_markup=keyboards.get_main_kb()
         )
-        await state.clear()
-
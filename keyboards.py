@@ -1,5 +1,20 @@
-from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 import config
+import callback_codec as codec
+import currency
+
+# Сколько подписок показывать на одной странице инлайн-клавиатуры
+SUBS_PAGE_SIZE = getattr(config, 'SUBS_PAGE_SIZE', 8)
+
+# Списки с постраничной навигацией; номер в кортеже - list_id в codec.Page
+PAGE_LISTS = ('del', 'imp', 'rate')
+
+# Списки подписок: список -> (текст кнопки по строке get_subs_page, действие кнопки по id подписки)
+SUBS_LISTS = {
+    'del': (lambda sub: f"❌ {sub[1]} ({currency.format_price(sub[2], sub[5])})", codec.DeleteSub),
+    'imp': (lambda sub: f"{sub[1]} ({currency.format_price(sub[2], sub[5])}) - важность: {sub[4]}/10",
+            codec.ChangeImportance),
+}
 
 
 def get_main_kb():
@@ -32,3 +47,37 @@ def get_usage_rating_kb():
     kb.adjust(5)  # 5 кнопок в ряд
     return kb.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
+
+
+def add_page_nav(builder, list_name, rows, has_prev, has_next, week_start=None):
+    """
+    Добавить ряд кнопок ◀️/▶️ под списком.
+
+    Курсор - id первой (назад) или последней (вперёд) подписки страницы,
+    поэтому следующая страница выбирается запросом по индексу, а не смещением.
+    """
+    list_id = PAGE_LISTS.index(list_name)
+    buttons = []
+    if has_prev:
+        buttons.append(("◀️ Назад", codec.Page(list_id, False, rows[0][0], week_start)))
+    if has_next:
+        buttons.append(("Вперёд ▶️", codec.Page(list_id, True, rows[-1][0], week_start)))
+    for text, action in buttons:
+        builder.button(text=text, callback_data=codec.pack(action))
+    return len(buttons)
+
+
+def page_cursor(page):
+    """Аргументы get_subs_page (after_id или before_id) для действия codec.Page"""
+    return {'after_id': page.cursor} if page.forward else {'before_id': page.cursor}
+
+
+def get_subs_page_kb(list_name, rows, has_prev, has_next):
+    """Инлайн-клавиатура страницы списка подписок (SUBS_LISTS) с навигацией"""
+    text, action = SUBS_LISTS[list_name]
+    builder = InlineKeyboardBuilder()
+    for sub in rows:
+        builder.button(text=text(sub), callback_data=codec.pack(action(sub[0])))
+    nav = add_page_nav(builder, list_name, rows, has_prev, has_next)
+    builder.adjust(*[1] * len(rows), nav or 1)
+    return builder.as_markup()
@@ -1,46 +1,223 @@
+import argparse
 import asyncio
 import logging
+import multiprocessing
+import signal
+import sys
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 import config
-import database as db
+import async_db as adb
 from handlers import register_commands_handlers, register_messages_handlers, register_callbacks_handlers
 from handlers.commands import set_bot as set_bot_commands
 from handlers.messages import set_bot as set_bot_messages
 from handlers.callbacks import set_bot as set_bot_callbacks
-from services.survey import weekly_survey_scheduler
+from services.scheduler import Scheduler
+from services.survey import setup_survey_jobs
+from services.charts import renderer, CHART_PREWARM
+from services.fsm_storage import create_storage, FSM_STORAGE, SQLiteStorage
+from services import monitoring
+
+# Настройки webhook-режима
+WEBHOOK_HOST = getattr(config, 'WEBHOOK_HOST', '127.0.0.1')    # адрес, на котором слушает бот
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8080)           # порт первого процесса, следующие: +1, +2, ...
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', None)             # внешний адрес (обратный прокси), например https://example.com
+WEBHOOK_SECRET = getattr(config, 'WEBHOOK_SECRET', None)       # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SHUTDOWN_TIMEOUT = getattr(config, 'WEBHOOK_SHUTDOWN_TIMEOUT', 10)
+# Адрес Bot API (например, локальный сервер или заглушка для нагрузочного теста)
+TELEGRAM_API_URL = getattr(config, 'TELEGRAM_API_URL', None)
 
 # Настройка логирования (чтобы видеть ошибки в консоли)
 logging.basicConfig(level=logging.INFO)
 
+
+def create_bot():
+    """Экземпляр бота; при TELEGRAM_API_URL запросы идут на указанный сервер Bot API"""
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(token=config.BOT_TOKEN, session=session)
+
+
 # Инициализация бота
-bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher()
+bot = create_bot()
+# Состояния диалогов: в памяти процесса или в БД (нескольким процессам нужен config.FSM_STORAGE = 'sqlite')
+dp = Dispatcher(storage=create_storage())
 
+# Фоновые задачи (планировщик опросов) выполняет только главный процесс
+_is_primary = True
 
-async def main():
-    """Главная функция запуска бота"""
-    print("Бот запущен")
-    
-    # Инициализация БД
-    db.init_db()
-    
+
+def setup_dispatcher():
+    """Регистрация обработчиков и хуков запуска (общая для polling и webhook)"""
     # Устанавливаем бота в handlers для использования в функциях
     set_bot_commands(bot)
     set_bot_messages(bot)
     set_bot_callbacks(bot)
-    
+
     # Регистрация всех обработчиков
     register_commands_handlers(dp)
     register_messages_handlers(dp)
     register_callbacks_handlers(dp)
-    
+
+    # Замеры времени обработчиков и запросов к Telegram
+    monitoring.setup(dp, bot)
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+
+async def on_startup():
+    """Инициализация перед получением обновлений"""
+    # Инициализация БД
+    await adb.init_db()
+
     # Запускаем планировщик еженедельных опросов в фоне
-    asyncio.create_task(weekly_survey_scheduler(bot))
-    
+    if _is_primary:
+        asyncio.create_task(run_scheduler())
+
+    # Прогреваем процессы отрисовки графиков, когда бот уже принимает сообщения
+    if CHART_PREWARM:
+        asyncio.create_task(renderer.prewarm())
+
+    if monitoring.METRICS_LOG_INTERVAL:
+        asyncio.create_task(monitoring.log_summary_loop())
+
+
+async def run_scheduler():
+    """Планировщик фоновых заданий (опрос, проверка неиспользуемых подписок)"""
+    scheduler = Scheduler()
+    await setup_survey_jobs(scheduler, bot)
+    await scheduler.run()
+
+
+async def on_shutdown():
+    """Освобождение ресурсов при остановке"""
+    renderer.shutdown()
+    await adb.flush_writes()
+    adb.shutdown()
+
+
+async def main():
+    """Главная функция запуска бота"""
+    print("Бот запущен")
+    setup_dispatcher()
+
+    # Страница метрик для Prometheus
+    metrics_runner = None
+    if monitoring.METRICS_PORT:
+        metrics_runner = await monitoring.start_metrics_server()
+
     # Запуск бота
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+def run_webhook(host=WEBHOOK_HOST, port=WEBHOOK_PORT, primary=True, metrics_port=monitoring.METRICS_PORT,
+                shared=False):
+    """
+    Запуск бота в режиме webhook на aiohttp-сервере.
+
+    Главный процесс (primary) регистрирует webhook в Telegram и запускает планировщик.
+    shared - процесс один из нескольких (run_webhook_workers): состояния диалогов
+    записываются в БД сразу, без буфера.
+    Страница метрик (если задан metrics_port) поднимается отдельным сервером,
+    чтобы не быть доступной по публичному адресу webhook.
+    SIGINT/SIGTERM обрабатывает aiohttp: сервер перестаёт принимать запросы,
+    ждёт завершения текущих до WEBHOOK_SHUTDOWN_TIMEOUT секунд и вызывает on_shutdown.
+    """
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    global _is_primary
+    _is_primary = primary
+    if shared and isinstance(dp.storage, SQLiteStorage):
+        dp.storage.flush_interval = 0
+    setup_dispatcher()
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    if metrics_port:
+        async def metrics_server(_app):
+            runner = await monitoring.start_metrics_server(port=metrics_port)
+            yield
+            await runner.cleanup()
+        app.cleanup_ctx.append(metrics_server)
+
+    if primary and WEBHOOK_URL:
+        async def register_webhook(_app):
+            await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+            logging.info(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH}")
+        app.on_startup.append(register_webhook)
+
+    print(f"Бот запущен (webhook) на {host}:{port}{WEBHOOK_PATH}")
+    web.run_app(app, host=host, port=port, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT, print=None)
+
+
+def run_webhook_workers(workers, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    """
+    Запустить несколько процессов бота за обратным прокси.
+
+    Процесс i слушает порт port + i; прокси распределяет между ними запросы Telegram.
+    Метрики у каждого процесса свои: процесс i отдаёт их на METRICS_PORT + i.
+    Шаги одного диалога попадают в разные процессы, поэтому без общего
+    хранилища FSM (config.FSM_STORAGE = 'sqlite') запуск прерывается.
+    """
+    # Общее хранилище пишет изменения сразу (shared=True): с буфером записи
+    # следующий шаг диалога, пришедший в другой процесс в течение
+    # FSM_FLUSH_INTERVAL, прочитал бы из БД прежнее состояние
+    if FSM_STORAGE != 'sqlite':
+        sys.exit(f"Для --workers {workers} нужно общее хранилище диалогов: "
+                 f"config.FSM_STORAGE = 'sqlite' (сейчас {FSM_STORAGE!r})")
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_webhook, name=f'bot-worker-{i}', args=(
+            host, port + i, i == 0, monitoring.METRICS_PORT and monitoring.METRICS_PORT + i, True))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop_workers(signum, frame):
+        # Менеджер процессов (systemd, docker) останавливает только родителя -
+        # передаём SIGTERM процессам бота, каждый из них завершается корректно
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C получают все процессы группы, дожидаемся их корректной остановки
+        for process in processes:
+            process.join()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Финансовый ассистент регулярных платежей")
+    parser.add_argument('mode', nargs='?', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--host', default=WEBHOOK_HOST)
+    parser.add_argument('--port', type=int, default=WEBHOOK_PORT)
+    parser.add_argument('--workers', type=int, default=1, help='число процессов в режиме webhook')
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.mode == 'webhook':
+        if args.workers > 1:
+            run_webhook_workers(args.workers, args.host, args.port)
+        else:
+            run_webhook(args.host, args.port)
+    else:
+        asyncio.run(main())
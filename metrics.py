@@ -0,0 +1,201 @@
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм времени (секунды): от 0.5 мс до 30 с
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Все метрики процесса: имя -> Histogram или Gauge
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    """
+    Потокобезопасная гистограмма длительностей с метками.
+
+    Для каждого набора значений меток хранит число наблюдений по корзинам,
+    их сумму и количество - как histogram в Prometheus. Квантили оцениваются
+    по корзинам линейной интерполяцией (см. quantile).
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # значения меток -> [счётчики корзин (+Inf последней), сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Замерить длительность блока with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        """Копия данных: {значения меток: (счётчики корзин, сумма, количество)}"""
+        with self._lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+
+
+class Gauge:
+    """Значения, которые вычисляются при чтении: callback() -> {значения меток: число}"""
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Гистограмма из реестра (создаётся при первом обращении)"""
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = Histogram(name, documentation, labelnames, buckets)
+        return metric
+
+
+def gauge(name, documentation, labelnames, callback):
+    """Зарегистрировать вычисляемое значение (например, статистику кэша)"""
+    with _registry_lock:
+        metric = _registry[name] = Gauge(name, documentation, labelnames, callback)
+        return metric
+
+
+def quantile(buckets, counts, q):
+    """Оценка квантиля q по счётчикам корзин; None, если наблюдений нет"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            if index == len(buckets):
+                return buckets[-1]  # выше последней границы - точнее оценить нельзя
+            lower = buckets[index - 1] if index else 0.0
+            return lower + (buckets[index] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+def timed(hist, *labels, slow_ms=None):
+    """
+    Декоратор: время каждого вызова функции (обычной или корутины) в гистограмму.
+
+    Вызовы дольше slow_ms миллисекунд дополнительно пишутся в лог с аргументами.
+    """
+    def decorator(func):
+        def record(started, args, kwargs):
+            elapsed = time.perf_counter() - started
+            hist.observe(elapsed, *labels)
+            if slow_ms is not None and elapsed * 1000 >= slow_ms:
+                arguments = ', '.join([repr(arg) for arg in args] + [f"{k}={v!r}" for k, v in kwargs.items()])
+                logging.warning(f"Медленный вызов {func.__name__}({arguments[:200]}): {elapsed * 1000:.1f} мс")
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(started, args, kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(started, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        if isinstance(metric, Gauge):
+            lines.append(f"# TYPE {metric.name} gauge")
+            for labels, value in metric.callback().items():
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, labels)} {value}")
+            continue
+
+        lines.append(f"# TYPE {metric.name} histogram")
+        for labels, (counts, total, count) in sorted(metric.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*metric.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(metric.labelnames, labels, [('le', bound)])
+                lines.append(f"{metric.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{metric.name}_sum{_format_labels(metric.labelnames, labels)} {total}")
+            lines.append(f"{metric.name}_count{_format_labels(metric.labelnames, labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def summarize(previous=None, top=15):
+    """
+    Сводка по гистограммам за период с предыдущей сводки.
+
+    previous - снимок, возвращённый прошлым вызовом (None - с начала работы).
+
+    Returns:
+        Кортеж (строки сводки, снимок для следующего вызова); строки отсортированы
+        по суммарному времени: "метрика{метки}: n=..., p50=..., p95=..., p99=... мс"
+    """
+    previous = previous or {}
+    current = {}
+    rows = []
+    with _registry_lock:
+        histograms = [metric for metric in _registry.values() if isinstance(metric, Histogram)]
+    for metric in histograms:
+        for labels, (counts, total, count) in metric.snapshot().items():
+            key = (metric.name, labels)
+            current[key] = (counts, total, count)
+            old_counts, old_total, old_count = previous.get(key, ([0] * len(counts), 0.0, 0))
+            delta = [new - old for new, old in zip(counts, old_counts)]
+            if count == old_count:
+                continue
+            percentiles = ', '.join(
+                f"p{int(q * 100)}={quantile(metric.buckets, delta, q) * 1000:.1f}" for q in QUANTILES
+            )
+            name = f"{metric.name}{_format_labels(metric.labelnames, labels)}"
+            rows.append((total - old_total, f"{name}: n={count - old_count}, {percentiles} мс"))
+
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return [line for _, line in rows[:top]], current
@@ -0,0 +1,202 @@
+import logging
+
+# Миграции схемы БД. Номер применённой версии хранится в PRAGMA user_version.
+# Новые миграции добавляются только в конец списка, уже выпущенные не меняются.
+MIGRATIONS = [
+    (1, "Таблицы подписок и истории использования", [
+        '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            service_name TEXT NOT NULL,
+            price REAL NOT NULL,
+            category TEXT NOT NULL,
+            importance INTEGER DEFAULT 5,
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS usage_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id INTEGER NOT NULL,
+            week_start_date DATE NOT NULL,
+            usage_score INTEGER NOT NULL CHECK(usage_score >= 1 AND usage_score <= 10),
+            date_recorded TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions(id) ON DELETE CASCADE,
+            UNIQUE(subscription_id, week_start_date)
+        )
+        ''',
+    ]),
+    (2, "Индексы для запросов по пользователю и истории", [
+        # Списки, удаление, опрос, DISTINCT user_id и JOIN по пользователю
+        'CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id, id)',
+        # Покрывающий индекс для get_stats_by_category и фильтра по категории
+        'CREATE INDEX IF NOT EXISTS idx_subscriptions_user_category ON subscriptions(user_id, category, price)',
+        # Покрывающий индекс для AVG/MAX по истории подписки (аналитика, неиспользуемые подписки)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_usage_history_sub_week
+        ON usage_history(subscription_id, week_start_date, usage_score)
+        ''',
+    ]),
+    (3, "Состояние рассылок: курсор задания и журнал доставки", [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (4, "Агрегаты использования по подпискам", [
+        '''
+        CREATE TABLE IF NOT EXISTS usage_stats (
+            subscription_id INTEGER PRIMARY KEY,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            score_count INTEGER NOT NULL DEFAULT 0,
+            recent_avg REAL,
+            last_week DATE
+        )
+        ''',
+        # Заполняем по уже накопленной истории (recent_avg - среднее за 4 последние оценённые недели)
+        '''
+        INSERT OR REPLACE INTO usage_stats (subscription_id, score_sum, score_count, recent_avg, last_week)
+        SELECT subscription_id,
+               SUM(usage_score),
+               COUNT(*),
+               AVG(CASE WHEN week_rank <= 4 THEN usage_score END),
+               MAX(week_start_date)
+        FROM (
+            SELECT subscription_id, usage_score, week_start_date,
+                   ROW_NUMBER() OVER (PARTITION BY subscription_id ORDER BY week_start_date DESC) AS week_rank
+            FROM usage_history
+        )
+        GROUP BY subscription_id
+        ''',
+    ]),
+    (5, "Хранилище состояний диалогов (FSM)", [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        # Для удаления брошенных диалогов по TTL
+        'CREATE INDEX IF NOT EXISTS idx_fsm_storage_expires ON fsm_storage(expires_at)',
+    ]),
+    (6, "Настройки пользователей и время запуска фоновых заданий", [
+        # NULL - значение по умолчанию из config
+        '''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            timezone TEXT,
+            send_hour INTEGER CHECK(send_hour >= 0 AND send_hour <= 23)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            job TEXT PRIMARY KEY,
+            last_run REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (7, "Закрепление пользователей за шардами на время переноса", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (8, "Валюта платежей и курсы валют", [
+        # Все уже сохранённые цены - в рублях
+        "ALTER TABLE subscriptions ADD COLUMN currency TEXT NOT NULL DEFAULT 'RUB'",
+        # Сколько рублей (базовой валюты) за единицу валюты; используется таблица главного файла БД
+        '''
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            currency TEXT PRIMARY KEY,
+            rate REAL NOT NULL CHECK(rate > 0),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, "Версии данных пользователей для проверки кэша подписок", [
+        # Номер увеличивается триггерами при любом изменении строк, из которых собирается
+        # кэш подписок (database._load_user_subs), в каком бы процессе ни шла запись
+        '''
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        ''',
+        *(f'''
+        CREATE TRIGGER IF NOT EXISTS subscriptions_version_{event.lower()}
+        AFTER {event} ON subscriptions
+        BEGIN
+            INSERT INTO user_versions (user_id, version) VALUES ({row}.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+        END
+        ''' for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))),
+        *(f'''
+        CREATE TRIGGER IF NOT EXISTS usage_stats_version_{event.lower()}
+        AFTER {event} ON usage_stats
+        BEGIN
+            INSERT INTO user_versions (user_id, version)
+            SELECT user_id, 1 FROM subscriptions WHERE id = {row}.subscription_id
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+        END
+        ''' for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """Текущая версия схемы"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn, target=LATEST_VERSION):
+    """
+    Применить недостающие миграции до версии target.
+
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    user_version, поэтому повторный запуск (в том числе из нескольких процессов
+    одновременно) безопасен.
+    """
+    for version, description, statements in MIGRATIONS:
+        if version > target:
+            break
+        if get_version(conn) >= version:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Другой процесс мог применить миграцию, пока мы ждали блокировку
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.info(f"Применена миграция БД {version}: {description}")
+
+    # Обновляем статистику планировщика запросов (дёшево, если ничего не менялось)
+    conn.execute('PRAGMA optimize')
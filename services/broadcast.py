@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+)
+
+import config
+import async_db as adb
+from cache import LRUCache
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+BROADCAST_GLOBAL_RATE = getattr(config, 'BROADCAST_GLOBAL_RATE', 25)
+BROADCAST_PER_CHAT_RATE = getattr(config, 'BROADCAST_PER_CHAT_RATE', 1)
+# Сколько отправок выполняется одновременно
+BROADCAST_CONCURRENCY = getattr(config, 'BROADCAST_CONCURRENCY', 8)
+# Размер порции получателей, после которой сохраняется курсор задания
+BROADCAST_BATCH = getattr(config, 'BROADCAST_BATCH', 200)
+# Сколько раз повторять отправку после 429 или сетевой ошибки
+BROADCAST_MAX_RETRIES = getattr(config, 'BROADCAST_MAX_RETRIES', 3)
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не больше rate операций в секунду, всплески до capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Дождаться и забрать один токен (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (после ответа 429 Too Many Requests)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class Broadcaster:
+    """
+    Рассылка сообщений с учётом лимитов Telegram.
+
+    deliver() отправляет одно сообщение через общий и поканальный token bucket,
+    повторяя попытку после RetryAfter. run_job() рассылает задание всем получателям
+    порциями, сохраняя курсор в БД: после перезапуска задание продолжается с места
+    остановки, а журнал доставки гарантирует не больше одной отправки на пользователя.
+    """
+
+    def __init__(self, global_rate=BROADCAST_GLOBAL_RATE, per_chat_rate=BROADCAST_PER_CHAT_RATE,
+                 concurrency=BROADCAST_CONCURRENCY, max_retries=BROADCAST_MAX_RETRIES):
+        self._global = TokenBucket(global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._chats = LRUCache(maxsize=10000, ttl=60)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._slots_limit = concurrency
+        self.max_retries = max_retries
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._per_chat_rate, capacity=1)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def deliver(self, chat_id, send):
+        """
+        Выполнить отправку send() в чат chat_id с соблюдением лимитов.
+
+        Returns:
+            'sent', 'skipped' (бот заблокирован, чат не найден) или 'failed'
+        """
+        async with self._slots:
+            for attempt in range(self.max_retries + 1):
+                await self._chat_bucket(chat_id).acquire()
+                await self._global.acquire()
+                try:
+                    if await send() is False:
+                        return 'skipped'  # отправлять оказалось нечего
+                    return 'sent'
+                except TelegramRetryAfter as e:
+                    # Лимит превышен для всего бота - притормаживаем все отправки
+                    logging.warning(f"Telegram просит подождать {e.retry_after} с (чат {chat_id})")
+                    self._global.pause(e.retry_after)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    logging.info(f"Сообщение пользователю {chat_id} не доставлено: {e}")
+                    return 'skipped'
+                except TelegramNetworkError as e:
+                    logging.warning(f"Сетевая ошибка при отправке пользователю {chat_id}: {e}")
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    logging.error(f"Ошибка при отправке пользователю {chat_id}: {e}")
+                    return 'failed'
+            return 'failed'
+
+    async def deliver_stream(self, messages):
+        """
+        Отправить поток сообщений по мере их появления.
+
+        messages - асинхронный итератор пар (chat_id, send). Одновременно в работе
+        не больше concurrency отправок; следующий элемент читается, когда освобождается место.
+
+        Returns:
+            Словарь {статус доставки: количество}
+        """
+        summary = {}
+        slots = asyncio.Semaphore(self._slots_limit)
+        tasks = set()
+
+        async def deliver_one(chat_id, send):
+            try:
+                result = await self.deliver(chat_id, send)
+                summary[result] = summary.get(result, 0) + 1
+            finally:
+                slots.release()
+
+        async for chat_id, send in messages:
+            await slots.acquire()
+            task = asyncio.create_task(deliver_one(chat_id, send))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        return summary
+
+    async def run_job(self, job_id, send_to_user, batch_size=BROADCAST_BATCH, pages=None):
+        """
+        Разослать задание job_id всем пользователям с подписками.
+
+        send_to_user(user_id) - корутина, выполняющая отправку одному пользователю
+        (может вернуть False, если отправлять нечего).
+        pages(after_user_id, limit) - корутина, возвращающая следующую порцию
+        получателей по возрастанию ID (по умолчанию - все пользователи с подписками).
+        Повторный вызов для завершённого задания ничего не делает, для незавершённого -
+        продолжает с сохранённого курсора. Пользователи, отправка которым была начата,
+        но не подтверждена до перезапуска, повторно не получают сообщение.
+
+        Returns:
+            Словарь {статус доставки: количество} или None, если задание уже выполнено
+        """
+        status, cursor = await adb.start_broadcast_job(job_id)
+        if status == 'done':
+            logging.info(f"Рассылка {job_id} уже выполнена, пропускаем")
+            return None
+        if cursor:
+            logging.info(f"Продолжаем рассылку {job_id} после пользователя {cursor}")
+
+        async def deliver_one(user_id):
+            result = await self.deliver(user_id, lambda: send_to_user(user_id))
+            await adb.mark_broadcast_delivery(job_id, user_id, result)
+
+        pages = pages or adb.get_users_with_subs_page
+        while True:
+            user_ids = await pages(cursor, batch_size)
+            if not user_ids:
+                break
+            claimed = await adb.claim_broadcast_deliveries(job_id, user_ids)
+            await asyncio.gather(*(deliver_one(user_id) for user_id in claimed))
+            cursor = user_ids[-1]
+            await adb.save_broadcast_cursor(job_id, cursor)
+
+        summary = await adb.finish_broadcast_job(job_id)
+        logging.info(f"Рассылка {job_id} завершена: {summary}")
+        return summary
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import database as db
+import metrics
+import utils
+from cache import LRUCache
+
+# Количество процессов, рисующих графики
+CHART_WORKERS = getattr(config, 'CHART_WORKERS', 2)
+# Сколько запросов на отрисовку может ждать одновременно (включая выполняющиеся)
+CHART_MAX_QUEUE = getattr(config, 'CHART_MAX_QUEUE', 32)
+# Ограничение времени на один график, секунд
+CHART_TIMEOUT = getattr(config, 'CHART_TIMEOUT', 15)
+# Ограничения кэша готовых графиков
+CHART_CACHE_ENTRIES = getattr(config, 'CHART_CACHE_ENTRIES', 512)
+CHART_CACHE_BYTES = getattr(config, 'CHART_CACHE_BYTES', 64 * 1024 * 1024)
+
+
+# Прогревать ли процессы отрисовки сразу после запуска бота
+CHART_PREWARM = getattr(config, 'CHART_PREWARM', True)
+
+
+# Время ожидания свободного процесса и время отрисовки (от отправки в пул до результата)
+chart_wait_seconds = metrics.histogram(
+    'bot_chart_wait_seconds', "Ожидание свободного процесса отрисовки", ['chart'])
+chart_render_seconds = metrics.histogram(
+    'bot_chart_render_seconds', "Отрисовка графика в пуле процессов", ['chart'])
+
+
+class ChartQueueFull(Exception):
+    """Очередь отрисовки переполнена, запрос отклонён"""
+
+
+def _warm_up():
+    """Выполняется в процессе пула: загрузка matplotlib до первого запроса"""
+    utils.warm_up()
+
+
+def _render_pie(data):
+    """Выполняется в процессе пула: круговая диаграмма в виде PNG-байтов"""
+    buf = utils.generate_pie_chart(data)
+    return buf.getvalue() if buf else None
+
+
+def _render_bar(subscriptions_with_usage):
+    """Выполняется в процессе пула: гистограмма эффективности в виде PNG-байтов"""
+    buf = utils.generate_bar_chart(subscriptions_with_usage)
+    return buf.getvalue() if buf else None
+
+
+class ChartEntry:
+    """Готовый график: PNG-байты или file_id уже загруженной в Telegram картинки"""
+    __slots__ = ('key', 'user_id', 'png', 'file_id')
+
+    def __init__(self, key, user_id, png):
+        self.key = key
+        self.user_id = user_id
+        self.png = png
+        self.file_id = None
+
+
+class ChartCache:
+    """
+    Кэш графиков, адресуемый по содержимому: ключ - хэш входных строк.
+
+    Вытесняет самые старые записи по числу и суммарному размеру PNG.
+    Записи пользователя сбрасываются при любом изменении его данных в database.py.
+    После первой отправки PNG заменяется на file_id, и повторный показ
+    не загружает картинку в Telegram заново.
+    """
+
+    def __init__(self, max_entries=CHART_CACHE_ENTRIES, max_bytes=CHART_CACHE_BYTES):
+        self._entries = LRUCache(
+            maxsize=max_entries,
+            max_bytes=max_bytes,
+            sizeof=lambda entry: len(entry.png or b''),
+            on_evict=self._forget,
+        )
+        self._user_keys = {}  # user_id -> ключи его графиков
+        # Берётся раньше блокировки LRUCache (и повторно в _forget при вытеснении)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(kind, rows):
+        """Ключ графика: тип + хэш входных данных"""
+        digest = hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+        return f"{kind}:{digest}"
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, user_id, png):
+        entry = ChartEntry(key, user_id, png)
+        with self._lock:
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._entries.set(key, entry)
+        return entry
+
+    def remember_file_id(self, entry, file_id):
+        """Запомнить file_id отправленной картинки и освободить память под PNG"""
+        with self._lock:
+            # Пока картинка отправлялась, данные пользователя могли измениться:
+            # сброшенный график не возвращается в кэш
+            if self._entries.get(entry.key) is not entry:
+                return
+            entry.file_id = file_id
+            entry.png = None
+            self._entries.set(entry.key, entry)
+
+    def discard(self, entry):
+        with self._lock:
+            self._entries.pop(entry.key)
+
+    def invalidate_user(self, user_id):
+        """Сбросить все графики пользователя"""
+        with self._lock:
+            for key in self._user_keys.pop(user_id, ()):
+                self._entries.pop(key)
+
+    def _forget(self, key, entry):
+        with self._lock:
+            keys = self._user_keys.get(entry.user_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._user_keys[entry.user_id]
+
+    def stats(self):
+        return self._entries.stats()
+
+
+chart_cache = ChartCache()
+db.add_write_listener(chart_cache.invalidate_user)
+metrics.gauge('bot_chart_cache', "Кэш готовых графиков", ['stat'],
+              lambda: {(name,): value for name, value in chart_cache.stats().items()})
+
+_RENDERERS = {
+    'pie': _render_pie,
+    'bar': _render_bar,
+}
+
+
+class ChartRenderer:
+    """
+    Отрисовка графиков в пуле процессов.
+
+    - не больше workers графиков рисуется одновременно;
+    - не больше max_queue запросов ждут в очереди, остальные сразу получают ChartQueueFull;
+    - каждый график ограничен по времени timeout (asyncio.TimeoutError).
+    """
+
+    def __init__(self, workers=CHART_WORKERS, max_queue=CHART_MAX_QUEUE, timeout=CHART_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = None
+        self._busy = asyncio.Semaphore(workers)
+        self._pending = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения с БД родителя
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                # Отчёты (services/report.py) читают БД: пути задаются один раз на процесс
+                initializer=db.use_paths,
+                initargs=(db.DB_NAME, tuple(db.DB_SHARDS)),
+            )
+        return self._pool
+
+    async def render(self, func, *args, timeout=None):
+        """
+        Выполнить функцию отрисовки func(*args) в пуле и вернуть её результат.
+        timeout - ограничение времени вместо общего (для долгих задач вроде PDF-отчёта).
+        """
+        if self._pending >= self.max_queue:
+            raise ChartQueueFull()
+
+        chart = func.__name__.removeprefix('_render_')
+        self._pending += 1
+        try:
+            with chart_wait_seconds.time(chart):
+                await self._busy.acquire()
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                future = self._get_pool().submit(func, *args)
+            except BrokenProcessPool:
+                self._busy.release()
+                self._reset_pool()
+                raise
+
+            # Слот освобождается, только когда процесс действительно закончил работу,
+            # даже если ожидающий уже получил таймаут
+            def release(_):
+                try:
+                    loop.call_soon_threadsafe(self._busy.release)
+                except RuntimeError:
+                    pass  # цикл событий уже закрыт
+
+            future.add_done_callback(release)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+            except BrokenProcessPool:
+                self._reset_pool()
+                raise
+            finally:
+                chart_render_seconds.observe(time.perf_counter() - started, chart)
+        finally:
+            self._pending -= 1
+
+    async def render_cached(self, kind, rows, user_id):
+        """
+        График из кэша или свежеотрисованный.
+
+        Возвращает ChartEntry (с png или file_id) либо None, если строить нечего.
+        """
+        key = chart_cache.make_key(kind, rows)
+        entry = chart_cache.get(key)
+        if entry is None:
+            png = await self.render(_RENDERERS[kind], rows)
+            if png is None:
+                return None
+            entry = chart_cache.put(key, user_id, png)
+        return entry
+
+    async def prewarm(self):
+        """Запустить процессы пула и загрузить в них matplotlib в фоне"""
+        try:
+            await asyncio.gather(*(self.render(_warm_up) for _ in range(self.workers)))
+            logging.info("Процессы отрисовки графиков прогреты")
+        except Exception as e:
+            logging.warning(f"Не удалось прогреть процессы отрисовки: {e}")
+
+    def _reset_pool(self):
+        logging.error("Пул отрисовки графиков аварийно завершился, будет создан заново")
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """Остановить процессы отрисовки"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+renderer = ChartRenderer()
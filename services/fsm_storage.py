@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import config
+import async_db as adb
+
+# Где хранятся состояния диалогов: 'memory' (в процессе) или 'sqlite' (в файле БД, общий для процессов)
+FSM_STORAGE = getattr(config, 'FSM_STORAGE', 'memory')
+# Через сколько секунд без изменений брошенный диалог удаляется
+FSM_TTL = getattr(config, 'FSM_TTL', 24 * 3600)
+# Сколько секунд копить изменения перед записью в БД (0 - писать сразу;
+# при нескольких процессах webhook изменения всегда пишутся сразу)
+FSM_FLUSH_INTERVAL = getattr(config, 'FSM_FLUSH_INTERVAL', 0.05)
+# Как часто удалять истёкшие записи
+FSM_CLEANUP_INTERVAL = getattr(config, 'FSM_CLEANUP_INTERVAL', 3600)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_storage файла БД.
+
+    Состояние переживает перезапуск и видно всем процессам бота. Изменения
+    копятся в памяти FSM_FLUSH_INTERVAL секунд и записываются одной транзакцией;
+    до записи процесс читает их из буфера, а другие процессы их ещё не видят
+    (поэтому при нескольких процессах main.run_webhook пишет сразу,
+    flush_interval = 0). Записи, которые не менялись дольше ttl секунд,
+    считаются брошенными и удаляются.
+    """
+
+    def __init__(self, ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL, cleanup_interval=FSM_CLEANUP_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        # key -> {'state': ..., 'data': ...}: изменения, ещё не записанные в БД
+        # (при каждом изменении словарь заменяется новым, см. _flush)
+        self._pending = {}
+        self._flush_task = None
+        self._last_cleanup = time.monotonic()
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await self._put(self._key_builder.build(key), state=state)
+
+    async def get_state(self, key):
+        state, _ = await self._get(self._key_builder.build(key))
+        return state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        await self._put(self._key_builder.build(key), data=json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key):
+        _, data = await self._get(self._key_builder.build(key))
+        return json.loads(data)
+
+    async def close(self):
+        """Записать накопленные изменения"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+
+    async def _get(self, key):
+        """(state, data_json) с учётом незаписанных изменений"""
+        pending = self._pending.get(key)
+        if pending is not None and 'state' in pending and 'data' in pending:
+            return pending['state'], pending['data']
+
+        record = await adb.get_fsm_record(key) or (None, '{}')
+        # Изменения могли появиться, пока шёл запрос
+        pending = self._pending.get(key) or {}
+        return pending.get('state', record[0]), pending.get('data', record[1])
+
+    async def _put(self, key, **fields):
+        self._pending[key] = {**self._pending.get(key, {}), **fields}
+        if not self.flush_interval:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self._flush()
+        except Exception as e:
+            logging.error(f"Не удалось сохранить состояния диалогов: {e}")
+            # Изменения остались в буфере, повторим при следующей записи
+
+    async def _flush(self):
+        """Записать все накопленные изменения одной транзакцией"""
+        if not self._pending:
+            return
+        batch = dict(self._pending)
+        await adb.save_fsm_records([
+            {
+                'key': key,
+                'state': fields.get('state'),
+                'data': fields.get('data', '{}'),
+                'has_state': 'state' in fields,
+                'has_data': 'data' in fields,
+            }
+            for key, fields in batch.items()
+        ], self.ttl)
+        # Убираем из буфера записанное, если за время записи ключ не менялся
+        for key, fields in batch.items():
+            if self._pending.get(key) is fields:
+                del self._pending[key]
+
+        if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = time.monotonic()
+            removed = await adb.delete_expired_fsm_records()
+            if removed:
+                logging.info(f"Удалено брошенных диалогов: {removed}")
+
+
+def create_storage():
+    """Хранилище FSM, выбранное в config.FSM_STORAGE"""
+    if FSM_STORAGE == 'sqlite':
+        return SQLiteStorage()
+    if FSM_STORAGE != 'memory':
+        logging.warning(f"Неизвестное хранилище FSM {FSM_STORAGE!r}, используется память процесса")
+    return MemoryStorage()
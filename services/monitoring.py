@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+import config
+import metrics
+
+# Адрес страницы /metrics на отдельном сервере, не на публичном сервере webhook
+# (с --workers процесс i слушает METRICS_PORT + i); None - не запускать
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', None)
+METRICS_PATH = getattr(config, 'METRICS_PATH', '/metrics')
+# Как часто писать в лог сводку p50/p95/p99, секунд (0 - не писать)
+METRICS_LOG_INTERVAL = getattr(config, 'METRICS_LOG_INTERVAL', 300)
+# Обработчики дольше стольких миллисекунд пишутся в лог (None - не писать)
+HANDLER_SLOW_MS = getattr(config, 'HANDLER_SLOW_MS', 1000)
+
+handler_seconds = metrics.histogram(
+    'bot_handler_seconds', "Время выполнения обработчиков aiogram", ['handler', 'status'])
+telegram_api_seconds = metrics.histogram(
+    'bot_telegram_api_seconds', "Время запросов к Bot API", ['method', 'status'])
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Замеряет время каждого обработчика (inner-middleware: вызывается, только
+    когда обработчик найден, и знает его имя).
+    """
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        # Кнопки обрабатываются через таблицу handlers/callbacks.py - замер по типу действия
+        if 'callback_action' in data:
+            name = f"{name}:{type(data['callback_action']).__name__}"
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_seconds.observe(elapsed, name, status)
+            if HANDLER_SLOW_MS is not None and elapsed * 1000 >= HANDLER_SLOW_MS:
+                logging.warning(f"Медленный обработчик {name}: {elapsed * 1000:.1f} мс")
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Замеряет время запросов бота к Telegram (включая загрузку графиков и файлов)"""
+
+    async def __call__(self, make_request, bot, method):
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            telegram_api_seconds.observe(time.perf_counter() - started, method.__api_method__, status)
+
+
+def setup(dp, bot):
+    """Подключить замеры к диспетчеру и сессии бота"""
+    middleware = HandlerTimingMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    bot.session.middleware(TelegramTimingMiddleware())
+
+
+async def metrics_handler(request):
+    return web.Response(text=metrics.render_prometheus(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-store'})
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT, path=METRICS_PATH):
+    """Отдельный aiohttp-сервер со страницей метрик. Возвращает AppRunner"""
+    app = web.Application()
+    app.router.add_get(path, metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики доступны на http://{host}:{port}{path}")
+    return runner
+
+
+async def log_summary_loop(interval=METRICS_LOG_INTERVAL):
+    """Раз в interval секунд писать в лог квантили за прошедший период"""
+    previous = None
+    while True:
+        await asyncio.sleep(interval)
+        lines, previous = metrics.summarize(previous)
+        if lines:
+            logging.info(f"Метрики за {interval} с:\n" + '\n'.join(lines))
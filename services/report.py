@@ -0,0 +1,233 @@
+"""
+PDF-отчёт по подпискам пользователя за месяц или год.
+
+Страницы отчёта:
+    1. расходы по категориям;
+    2..N. стоимость за единицу удовольствия по неделям, REPORT_SUBS_PER_PAGE подписок на страницу;
+    N+1. прогноз расходов на год и возможная экономия (по экспоненциальному
+         среднему оценок trends.py, как в советах бота).
+
+Подписки и история оценок читаются генератором database.iter_subscriptions_export
+(страницами из БД), каждая страница PDF пишется в файл сразу после отрисовки,
+поэтому память ограничена одной страницей отчёта, а не длиной истории.
+В боте отчёт строится в пуле процессов графиков (services/charts.py).
+
+Запуск без бота:
+    python -m services.report user 123 report.pdf [--period year]
+    python -m services.report batch reports/ [--period year] [--workers 4]
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import config
+import currency
+import database as db
+import efficiency
+import trends
+import utils
+
+# Периоды отчёта: название -> (за сколько недель история, подпись)
+PERIODS = {
+    'month': (5, 'месяц'),
+    'year': (52, 'год'),
+}
+# Сколько подписок на одной странице динамики
+REPORT_SUBS_PER_PAGE = getattr(config, 'REPORT_SUBS_PER_PAGE', 8)
+# Ограничение времени на один отчёт в боте, секунд
+REPORT_TIMEOUT = getattr(config, 'REPORT_TIMEOUT', 120)
+# На сколько месяцев вперёд прогноз
+FORECAST_MONTHS = 12
+
+
+def _report_subs(user_id, since):
+    """
+    Подписки пользователя с оценками за период.
+
+    Генератор кортежей (id, name, price, currency, category, importance, недели, оценки);
+    цена - в валюте платежа.
+    """
+    for sub_id, name, price, code, category, importance, usage in db.iter_subscriptions_export(
+            user_id, page_size=REPORT_SUBS_PER_PAGE, since=since):
+        weeks = [datetime.strptime(week, "%Y-%m-%d").date() for week, _ in usage]
+        yield sub_id, name, price, code, category, importance, weeks, [score for _, score in usage]
+
+
+def users_savings(user_ids, today=None):
+    """
+    Возможная экономия в месяц для порции пользователей: {user_id: сумма}.
+
+    Оценки заменяются экспоненциальным средним trends.py (как в советах бота),
+    а подписки всех пользователей порции оцениваются одним векторным проходом
+    efficiency.score_users.
+    """
+    rows_by_user = {}
+    for user_id in user_ids:
+        rows = db.get_all_subs(user_id, include_id=True, include_usage=True)
+        rows_by_user[user_id] = trends.recent_usage(trends.get_user_trends(user_id, today=today), rows)
+    return efficiency.score_users(rows_by_user)
+
+
+def write_report(path, user_id, period='month', today=None, savings=None):
+    """
+    Построить отчёт пользователя в PDF-файл path.
+
+    savings: возможная экономия в месяц, если она уже посчитана (batch_reports
+    считает её сразу для порции пользователей через users_savings); иначе
+    считается по страницам отчёта тем же способом.
+
+    Returns:
+        Число подписок в отчёте (0 - подписок нет, файл не создаётся)
+    """
+    weeks_back, period_name = PERIODS[period]
+    today = today or date.today()
+    since = today - timedelta(days=today.weekday(), weeks=weeks_back - 1)
+
+    categories = db.get_stats_by_category(user_id)
+    if not categories:
+        return 0
+
+    count = 0
+    monthly = 0.0
+    rates = db.get_fx_rates()
+    # Экономия считается по той же динамике использования, что и советы бота
+    usage_trends = None
+    if savings is None:
+        savings = 0.0
+        usage_trends = trends.get_user_trends(user_id, today=today)
+    subs = _report_subs(user_id, since)
+    title = f"Отчёт за {period_name}: {since:%d.%m.%Y} - {today:%d.%m.%Y}"
+    with utils.open_pdf(path) as pdf:
+        pdf.savefig(utils.report_category_page(categories, title))
+
+        # Страница за страницей: из генератора берётся только то, что попадёт на неё
+        for page, chunk in enumerate(iter(lambda: list(itertools.islice(subs, REPORT_SUBS_PER_PAGE)), []), 1):
+            series, no_data = [], []
+            # Цены страницы пересчитываются в базовую валюту одним векторным проходом
+            price = currency.to_base([sub[2] for sub in chunk], [sub[3] for sub in chunk], rates)
+            for sub_price, (_, name, _, _, _, sub_importance, weeks, scores) in zip(price, chunk):
+                if not scores:
+                    no_data.append(name)
+                    continue
+                # Стоимость за единицу удовольствия по каждой неделе (NaN - не определена)
+                cost = efficiency.score(sub_price, sub_importance, np.array(scores, dtype=float)).cost
+                series.append((name, weeks, cost))
+
+            monthly += float(price.sum())
+            if usage_trends is not None:
+                importance = np.array([sub[5] for sub in chunk], dtype=float)
+                recent, _, _ = trends.lookup(usage_trends, [sub[0] for sub in chunk])
+                savings += float(efficiency.score(price, importance, recent).savings.sum())
+            count += len(chunk)
+            pdf.savefig(utils.report_trend_page(
+                series, f"Стоимость за единицу удовольствия по неделям ({page})", no_data
+            ))
+
+        pdf.savefig(utils.report_forecast_page(monthly, savings, FORECAST_MONTHS, "Прогноз расходов"))
+        info = pdf.infodict()
+        info['Title'] = title
+    return count
+
+
+def _render_report(path, user_id, period):
+    """Выполняется в процессе пула: отчёт в файл path, возвращает число подписок"""
+    return write_report(path, user_id, period)
+
+
+async def render_report(path, user_id, period='month'):
+    """
+    Построить отчёт в пуле процессов графиков.
+
+    Raises:
+        ChartQueueFull, asyncio.TimeoutError - как при отрисовке графиков
+    """
+    from services.charts import renderer
+    return await renderer.render(
+        _render_report, path, user_id, period, timeout=REPORT_TIMEOUT
+    )
+
+
+def batch_reports(directory, period='month', workers=None, progress=None):
+    """
+    Отчёты всех пользователей с подписками в directory/<user_id>.pdf.
+
+    Пользователи читаются порциями, экономия для порции считается в этом
+    процессе (users_savings), в пул одновременно отдаётся не больше
+    2 * workers отчётов. Возвращает (число отчётов, число ошибок).
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(directory, exist_ok=True)
+    done = failed = 0
+    pending = {}
+
+    def collect(futures):
+        nonlocal done, failed
+        for future in futures:
+            user_id = pending.pop(future)
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                logging.error(f"Не удалось построить отчёт пользователя {user_id}: {e}")
+            if progress:
+                progress(done + failed)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=db.use_paths, initargs=(db.DB_NAME, tuple(db.DB_SHARDS))) as pool:
+        after_user_id = 0
+        while True:
+            user_ids = db.get_users_with_subs_page(after_user_id)
+            if not user_ids:
+                break
+            savings = users_savings(user_ids)
+            for user_id in user_ids:
+                if len(pending) >= 2 * workers:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                path = os.path.join(directory, f"{user_id}.pdf")
+                future = pool.submit(write_report, path, user_id, period, savings=savings[user_id])
+                pending[future] = user_id
+            after_user_id = user_ids[-1]
+        collect(wait(pending).done)
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    user = subparsers.add_parser('user', help="отчёт одного пользователя")
+    user.add_argument('user_id', type=int)
+    user.add_argument('path')
+    batch = subparsers.add_parser('batch', help="отчёты всех пользователей в каталог")
+    batch.add_argument('directory')
+    batch.add_argument('--workers', type=int)
+    for subparser in (user, batch):
+        subparser.add_argument('--period', choices=PERIODS, default='month')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db.init_db()
+    if args.command == 'user':
+        count = write_report(args.path, args.user_id, args.period)
+        if not count:
+            print("У пользователя нет подписок", file=sys.stderr)
+            sys.exit(1)
+        print(f"Подписок в отчёте: {count}")
+    else:
+        done, failed = batch_reports(
+            args.directory, args.period, args.workers,
+            lambda count: count % 100 or print(f"Готово отчётов: {count}"),
+        )
+        print(f"Отчётов: {done}, ошибок: {failed}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import config
+import async_db as adb
+
+# Самая долгая пауза без пересчёта времени запуска: после перевода часов
+# или изменения настроек пользователей расписание уточняется не позже чем через неё
+SCHEDULER_MAX_SLEEP = getattr(config, 'SCHEDULER_MAX_SLEEP', 3600)
+# Пропущенный запуск (бот был остановлен) выполняется, если опоздание не больше стольких секунд
+SCHEDULER_MAX_DELAY = getattr(config, 'SCHEDULER_MAX_DELAY', 24 * 3600)
+
+# Смещение от UTC: "+3", "-5", "UTC+3", "GMT-5"
+_OFFSET_RE = re.compile(r'^(?:UTC|GMT)?([+-])(\d{1,2})$', re.IGNORECASE)
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def get_timezone(name):
+    """Часовой пояс по имени IANA; пустое имя - часовой пояс сервера"""
+    if not name:
+        return datetime.now().astimezone().tzinfo
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logging.warning(f"Неизвестный часовой пояс {name!r}, используется часовой пояс сервера")
+        return datetime.now().astimezone().tzinfo
+
+
+def parse_timezone(value):
+    """
+    Имя часового пояса IANA из ввода пользователя ("Europe/Moscow", "+3", "UTC-5").
+
+    Raises:
+        ValueError: часовой пояс не найден
+    """
+    value = value.strip()
+    match = _OFFSET_RE.match(value)
+    if match:
+        sign, hours = match.groups()
+        if int(hours) > 14:
+            raise ValueError(value)
+        if int(hours) == 0:
+            return 'UTC'
+        # В базе IANA знак у зон Etc/GMT обратный: UTC+3 - это Etc/GMT-3
+        return f"Etc/GMT{'-' if sign == '+' else '+'}{int(hours)}"
+    try:
+        ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(value) from None
+    return value
+
+
+def format_timezone(name):
+    """Имя часового пояса для пользователя: Etc/GMT-3 показывается как UTC+3"""
+    if name.startswith('Etc/GMT') and len(name) > len('Etc/GMT'):
+        offset = name[len('Etc/GMT'):]
+        return f"UTC{'+' if offset[0] == '-' else '-'}{offset[1:]}"
+    return name
+
+
+def next_weekly(after, tz, weekday, hour, offset=timedelta(0)):
+    """
+    Ближайший после after момент "день недели weekday, hour:00 по местному времени tz"
+    плюс offset. Возвращает время в UTC.
+    """
+    local = after.astimezone(tz)
+    monday = local.date() - timedelta(days=local.weekday())
+    # Начинаем с прошлой недели: с учётом offset её запуск ещё может быть впереди
+    for week in range(-1, 2):
+        day = monday + timedelta(days=weekday, weeks=week)
+        candidate = (datetime.combine(day, time(hour), tzinfo=tz) + offset).astimezone(timezone.utc)
+        if candidate > after:
+            return candidate
+    raise AssertionError("запуск не найден")  # недостижимо: через неделю запуск всегда впереди
+
+
+class Job:
+    """
+    Фоновое задание планировщика.
+
+    next_run(after) - корутина, возвращающая ближайшее время запуска (UTC) позже after;
+    action(run_at) - корутина, выполняющая запуск, запланированный на run_at.
+    """
+
+    def __init__(self, name, next_run, action, max_delay=SCHEDULER_MAX_DELAY):
+        self.name = name
+        self.next_run = next_run
+        self.action = action
+        self.max_delay = timedelta(seconds=max_delay)
+
+
+class Scheduler:
+    """
+    Планировщик фоновых заданий.
+
+    Вычисляет ближайший запуск среди всех заданий и спит до него (но не дольше
+    SCHEDULER_MAX_SLEEP). Время последнего выполненного запуска каждого задания
+    хранится в БД, поэтому после перезапуска задание не выполняется повторно,
+    а запуски, пропущенные пока бот был остановлен, выполняются сразу, если
+    опоздание не больше max_delay задания.
+    """
+
+    def __init__(self, max_sleep=SCHEDULER_MAX_SLEEP):
+        self.max_sleep = max_sleep
+        self._jobs = {}
+        self._last_runs = {}
+
+    def add(self, job):
+        self._jobs[job.name] = job
+
+    async def _due(self, now):
+        """Пара (время, задание) ближайшего запуска"""
+        nearest = None
+        for job in self._jobs.values():
+            after = max(self._last_runs[job.name], now - job.max_delay)
+            try:
+                run_at = await job.next_run(after)
+            except Exception as e:
+                logging.error(f"Не удалось вычислить время запуска задания {job.name}: {e}")
+                continue
+            if nearest is None or run_at < nearest[0]:
+                nearest = (run_at, job)
+        return nearest
+
+    async def run(self):
+        now = utcnow()
+        stored = await adb.get_scheduler_runs()
+        for name in self._jobs:
+            if name in stored:
+                self._last_runs[name] = datetime.fromtimestamp(stored[name], timezone.utc)
+            else:
+                # Новое задание начинает отсчёт с момента первого запуска бота
+                self._last_runs[name] = now
+                await adb.save_scheduler_run(name, now.timestamp())
+
+        while True:
+            now = utcnow()
+            nearest = await self._due(now)
+            if nearest is None:
+                await asyncio.sleep(self.max_sleep)
+                continue
+            run_at, job = nearest
+            if run_at > now:
+                await asyncio.sleep(min((run_at - now).total_seconds(), self.max_sleep))
+                continue
+
+            if now - run_at > timedelta(minutes=1):
+                logging.info(f"Выполняется пропущенный запуск {job.name} за {run_at:%Y-%m-%d %H:%M} UTC")
+            try:
+                await job.action(run_at)
+            except Exception as e:
+                logging.error(f"Ошибка в задании {job.name}: {e}")
+            # Запуск считается выполненным и при ошибке, иначе задание повторялось бы без конца
+            self._last_runs[job.name] = run_at
+            try:
+                await adb.save_scheduler_run(job.name, run_at.timestamp())
+            except Exception as e:
+                logging.error(f"Не удалось сохранить время запуска {job.name}: {e}")
@@ -1,19 +1,198 @@
+import functools
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import config
-import database as db
+import async_db as adb
+import callback_codec as codec
+import currency
+import keyboards
+from services.broadcast import broadcaster
+from services.scheduler import Job, get_timezone, next_weekly
+
+# Префикс заданий рассылки еженедельного опроса (за ним следует дата понедельника)
+SURVEY_JOB_PREFIX = "weekly_survey:"
+
+# Когда отправляется опрос: день недели (0 - понедельник) и час по местному времени пользователя.
+# Пользователь меняет часовой пояс и час командой /schedule; без настроек - значения отсюда
+# (SURVEY_TIMEZONE = None - часовой пояс сервера).
+SURVEY_WEEKDAY = getattr(config, 'SURVEY_WEEKDAY', 0)
+SURVEY_SEND_HOUR = getattr(config, 'SURVEY_SEND_HOUR', 10)
+SURVEY_TIMEZONE = getattr(config, 'SURVEY_TIMEZONE', None) or ''
+# Рассылка одной группы растягивается на столько минут, получатели делятся на столько частей
+SURVEY_SPREAD_MINUTES = getattr(config, 'SURVEY_SPREAD_MINUTES', 60)
+SURVEY_SPREAD_SLOTS = getattr(config, 'SURVEY_SPREAD_SLOTS', 12)
+
+
+def get_week_start(today=None):
+    """Начало текущей недели (понедельник)"""
+    today = today or datetime.now().date()
+    return today - timedelta(days=today.weekday())
+
+
+def survey_text(week_start):
+    """Текст сообщения с опросом за неделю, начинающуюся week_start"""
+    return (
+        "📊 <b>Еженедельный опрос о частоте использования подписок</b>\n\n"
+        "Оцените, насколько активно вы пользовались каждой подпиской на этой неделе "
+        f"(с {week_start.strftime('%d.%m')}):\n\n"
+        "Шкала от 1 до 10:\n"
+        "1-2 - почти не пользовался\n"
+        "3-4 - редко пользовался\n"
+        "5-6 - пользовался умеренно\n"
+        "7-8 - пользовался часто\n"
+        "9-10 - пользовался очень активно\n\n"
+        "Выберите подписку для оценки:"
+    )
+
+
+class SurveySession:
+    """
+    Страница опроса одного пользователя за неделю.
+
+    Хранит подписки текущей страницы и уже выставленные оценки, поэтому после
+    новой оценки клавиатура пересобирается без запросов к БД и в сообщении
+    меняется только она. Между сообщениями пользователя сессия лежит в данных
+    FSM (to_dict/from_dict) вместе с адресом сообщения опроса.
+    """
+
+    def __init__(self, week_start, items, chat_id=None, message_id=None, has_prev=False, has_next=False):
+        self.week_start = week_start  # строка 'YYYY-MM-DD'
+        self.items = items            # списки [sub_id, name, цена с валютой, оценка или None]
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.has_prev = has_prev      # есть ли подписки до и после страницы
+        self.has_next = has_next
+
+    @classmethod
+    async def load(cls, user_id, week_start=None, after_id=0, before_id=None):
+        """Собрать страницу опроса из БД или None, если оценивать нечего"""
+        week_start = week_start or get_week_start()
+        # Подписки пользователя, кроме ЖКХ, вместе с оценками за неделю - один запрос на страницу
+        subs, has_prev, has_next = await adb.get_subs_page(
+            user_id, after_id=after_id, before_id=before_id, limit=keyboards.SUBS_PAGE_SIZE,
+            exclude_zkh=True, week_start_date=week_start,
+        )
+        if not subs:
+            return None
+        items = [
+            [sub_id, name, currency.format_price(price, code), rating]
+            for sub_id, name, price, _, _, code, rating in subs
+        ]
+        return cls(week_start.strftime("%Y-%m-%d"), items, has_prev=has_prev, has_next=has_next)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data) if data else None
+
+    def to_dict(self):
+        return {
+            'week_start': self.week_start,
+            'items': self.items,
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'has_prev': self.has_prev,
+            'has_next': self.has_next,
+        }
+
+    def is_message(self, chat_id, message_id):
+        """Относится ли сессия к этому сообщению с опросом"""
+        return self.chat_id == chat_id and self.message_id == message_id
+
+    def get_name(self, sub_id):
+        """Название подписки со страницы опроса или None"""
+        for item in self.items:
+            if item[0] == sub_id:
+                return item[1]
+        return None
+
+    def rate(self, sub_id, rating):
+        """Отметить оценку. Возвращает True, если клавиатура изменилась"""
+        for item in self.items:
+            if item[0] == sub_id:
+                changed = item[3] != rating
+                item[3] = rating
+                return changed
+        return False
+
+    def text(self):
+        return survey_text(datetime.strptime(self.week_start, "%Y-%m-%d"))
+
+    def markup(self):
+        """Клавиатура опроса: кнопка на каждую подписку страницы, навигация и кнопка завершения"""
+        week_start = date.fromisoformat(self.week_start)
+        builder = InlineKeyboardBuilder()
+        for sub_id, name, price, rating in self.items:
+            if rating is not None:
+                text = f"✅ {name} ({price}) - {rating}/10"
+            else:
+                text = f"{name} ({price})"
+            builder.button(text=text, callback_data=codec.pack(codec.RateSub(sub_id, week_start)))
+
+        nav = keyboards.add_page_nav(builder, 'rate', self.items, self.has_prev, self.has_next, week_start)
+
+        # Всегда добавляем кнопку "Завершить опрос"
+        builder.button(
+            text="✅ Завершить опрос",
+            callback_data=codec.pack(codec.FinishSurvey(week_start))
+        )
+
+        builder.adjust(*[1] * len(self.items), *([nav] if nav else []), 1)
+        return builder.as_markup()
+
+
+def survey_page_start(markup):
+    """
+    Курсор страницы опроса, показанной в сообщении: after_id для SurveySession.load
+    по первой кнопке оценки клавиатуры или None.
+    """
+    for row in markup.inline_keyboard if markup else ():
+        for button in row:
+            try:
+                action = codec.unpack(button.callback_data or '')
+            except ValueError:
+                continue
+            if isinstance(action, codec.RateSub):
+                return action.sub_id - 1
+    return None
+
+
+async def build_weekly_survey(user_id: int, week_start=None):
+    """
+    Собрать текст и клавиатуру еженедельного опроса.
+
+    Returns:
+        Кортеж (message_text, reply_markup) или None, если оценивать нечего
+    """
+    session = await SurveySession.load(user_id, week_start)
+    if not session:
+        return None
+    return session.text(), session.markup()
+
+
+async def update_survey_markup(bot: Bot, session: SurveySession):
+    """Заменить в сообщении с опросом только клавиатуру"""
+    try:
+        await bot.edit_message_reply_markup(
+            chat_id=session.chat_id,
+            message_id=session.message_id,
+            reply_markup=session.markup()
+        )
+    except TelegramBadRequest as e:
+        # "message is not modified" - клавиатура уже актуальна
+        if 'not modified' not in str(e):
+            logging.error(f"Не удалось обновить опрос: {e}")
 
 
 async def send_weekly_usage_survey(bot: Bot, user_id: int, chat_id=None, message_id=None):
     """Отправить или обновить еженедельный опрос о частоте использования подписок"""
     try:
-        # Получаем все подписки пользователя (кроме ЖКХ)
-        subs = db.get_all_subs(user_id, include_id=True, exclude_zkh=True, include_usage=False)
+        survey = await build_weekly_survey(user_id)
         
-        if not subs:
+        if not survey:
             if chat_id and message_id:
                 try:
                     await bot.edit_message_text(
@@ -25,51 +204,7 @@ async def send_weekly_usage_survey(bot: Bot, user_id: int, chat_id=None, message
                     pass
             return  # У пользователя нет подписок для опроса
         
-        # Определяем начало текущей недели (понедельник)
-        today = datetime.now().date()
-        days_since_monday = today.weekday()
-        week_start = today - timedelta(days=days_since_monday)
-        week_start_str = week_start.strftime("%Y-%m-%d")
-        
-        # Получаем список уже оцененных подписок для отображения
-        rated_sub_ids = db.get_rated_subscriptions_for_week(user_id, week_start)
-        
-        message_text = (
-            "📊 <b>Еженедельный опрос о частоте использования подписок</b>\n\n"
-            "Оцените, насколько активно вы пользовались каждой подпиской на этой неделе "
-            f"(с {week_start.strftime('%d.%m')}):\n\n"
-            "Шкала от 1 до 10:\n"
-            "1-2 - почти не пользовался\n"
-            "3-4 - редко пользовался\n"
-            "5-6 - пользовался умеренно\n"
-            "7-8 - пользовался часто\n"
-            "9-10 - пользовался очень активно\n\n"
-            "Выберите подписку для оценки:"
-        )
-        
-        # Создаем инлайн-кнопки для каждой подписки
-        builder = InlineKeyboardBuilder()
-        for sub_id, name, price, category, importance in subs:
-            if sub_id in rated_sub_ids:
-                # Получаем оценку для отображения
-                rating = db.check_subscription_rated(sub_id, week_start)
-                builder.button(
-                    text=f"✅ {name} ({price}₽) - {rating}/10",
-                    callback_data=f"rate_{sub_id}_{week_start_str}"
-                )
-            else:
-                builder.button(
-                    text=f"{name} ({price}₽)",
-                    callback_data=f"rate_{sub_id}_{week_start_str}"
-                )
-        
-        # Всегда добавляем кнопку "Завершить опрос"
-        builder.button(
-            text="✅ Завершить опрос",
-            callback_data=f"finish_survey_{week_start_str}"
-        )
-        
-        builder.adjust(1)
+        message_text, markup = survey
         
         if chat_id and message_id:
             # Обновляем существующее сообщение
@@ -79,7 +214,7 @@ async def send_weekly_usage_survey(bot: Bot, user_id: int, chat_id=None, message
                     chat_id=chat_id,
                     message_id=message_id,
                     parse_mode="HTML",
-                    reply_markup=builder.as_markup()
+                    reply_markup=markup
                 )
             except Exception as e:
                 logging.error(f"Не удалось обновить сообщение: {e}")
@@ -88,7 +223,7 @@ async def send_weekly_usage_survey(bot: Bot, user_id: int, chat_id=None, message
                     user_id,
                     message_text,
                     parse_mode="HTML",
-                    reply_markup=builder.as_markup()
+                    reply_markup=markup
                 )
         else:
             # Отправляем новое сообщение
@@ -96,89 +231,162 @@ async def send_weekly_usage_survey(bot: Bot, user_id: int, chat_id=None, message
                 user_id,
                 message_text,
                 parse_mode="HTML",
-                reply_markup=builder.as_markup()
+                reply_markup=markup
             )
     except Exception as e:
         logging.error(f"Ошибка при отправке опроса пользователю {user_id}: {e}")
 
 
+async def broadcast_weekly_survey(bot: Bot, week_start=None, group=None):
+    """
+    Разослать еженедельный опрос пользователям с подписками.
+
+    group - кортеж (часовой пояс, час, слот): только пользователи этой группы
+    настроек и части user_id % SURVEY_SPREAD_SLOTS == слот; None - все пользователи.
+
+    Задание называется по неделе и группе, поэтому повторный запуск ничего
+    не отправляет, а прерванная рассылка продолжается с места остановки.
+    """
+    week_start = week_start or get_week_start()
+    job_id = f"{SURVEY_JOB_PREFIX}{week_start.isoformat()}"
+    pages = None
+    if group is not None:
+        timezone_name, hour, slot = group
+        job_id += f":{timezone_name}:{hour}:{slot}"
+        pages = functools.partial(
+            adb.get_survey_users_page, timezone_name, hour, slot, SURVEY_SPREAD_SLOTS,
+            SURVEY_TIMEZONE, SURVEY_SEND_HOUR,
+        )
+
+    async def send(user_id):
+        survey = await build_weekly_survey(user_id, week_start)
+        if not survey:
+            return False
+        message_text, markup = survey
+        await bot.send_message(user_id, message_text, parse_mode="HTML", reply_markup=markup)
+
+    return await broadcaster.run_job(job_id, send, pages=pages)
+
+
+async def resume_weekly_survey_broadcasts(bot: Bot):
+    """Продолжить рассылки опроса, прерванные перезапуском бота"""
+    for job_id in await adb.get_unfinished_broadcast_jobs(SURVEY_JOB_PREFIX):
+        # weekly_survey:<понедельник>[:<часовой пояс>:<час>:<слот>]
+        week, *group = job_id[len(SURVEY_JOB_PREFIX):].split(':')
+        week_start = datetime.strptime(week, "%Y-%m-%d").date()
+        if group:
+            timezone_name, hour, slot = group
+            group = (timezone_name, int(hour), int(slot))
+        await broadcast_weekly_survey(bot, week_start, group or None)
+
+
+def format_unused_notification(unused_subs):
+    """Текст уведомления о неиспользуемых подписках"""
+    message_text = (
+        "⚠️ <b>Уведомление о неиспользуемых подписках</b>\n\n"
+        "Следующие подписки не использовались более 3 недель:\n\n"
+    )
+    
+    for sub in unused_subs:
+        sub_id, name, price, code, last_week, weeks_unused = sub
+        price = currency.format_price(price, code)
+        weeks_unused = int(weeks_unused) if weeks_unused else 0
+        
+        if last_week:
+            message_text += (
+                f"❌ <b>{name}</b> ({price})\n"
+                f"   Последнее использование: {weeks_unused} недель назад\n\n"
+            )
+        else:
+            message_text += (
+                f"❌ <b>{name}</b> ({price})\n"
+                f"   Никогда не использовалась ({weeks_unused} недель с момента добавления)\n\n"
+            )
+    
+    message_text += "💡 Рекомендуем отменить эти подписки для экономии средств."
+    return message_text
+
+
 async def check_unused_subscriptions(bot: Bot):
     """Проверка подписок, неиспользуемых более 3 недель, и отправка уведомлений"""
+    async def notifications():
+        # Один проход по подпискам всех пользователей; уведомление отправляется,
+        # как только собраны подписки очередного пользователя
+        async for user_id, unused_subs in adb.iter_unused_subscriptions(weeks_threshold=3):
+            message_text = format_unused_notification(unused_subs)
+            yield user_id, functools.partial(bot.send_message, user_id, message_text, parse_mode="HTML")
+
     try:
-        # Получаем всех пользователей с подписками
-        conn = db.create_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT DISTINCT user_id FROM subscriptions')
-        user_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        for user_id in user_ids:
-            unused_subs = db.get_unused_subscriptions(user_id, weeks_threshold=3)
-            
-            if unused_subs:
-                message_text = (
-                    "⚠️ <b>Уведомление о неиспользуемых подписках</b>\n\n"
-                    "Следующие подписки не использовались более 3 недель:\n\n"
-                )
-                
-                for sub in unused_subs:
-                    sub_id, name, price, last_week, weeks_unused = sub
-                    weeks_unused = int(weeks_unused) if weeks_unused else 0
-                    
-                    if last_week:
-                        message_text += (
-                            f"❌ <b>{name}</b> ({price}₽)\n"
-                            f"   Последнее использование: {weeks_unused} недель назад\n\n"
-                        )
-                    else:
-                        message_text += (
-                            f"❌ <b>{name}</b> ({price}₽)\n"
-                            f"   Никогда не использовалась ({weeks_unused} недель с момента добавления)\n\n"
-                        )
-                
-                message_text += "💡 Рекомендуем отменить эти подписки для экономии средств."
-                
-                try:
-                    await bot.send_message(user_id, message_text, parse_mode="HTML")
-                except Exception as e:
-                    logging.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
-        
+        summary = await broadcaster.deliver_stream(notifications())
+        logging.info(f"Уведомления о неиспользуемых подписках: {summary}")
     except Exception as e:
         logging.error(f"Ошибка при проверке неиспользуемых подписок: {e}")
 
 
-async def weekly_survey_scheduler(bot: Bot):
-    """Планировщик еженедельных опросов и проверки неиспользуемых подписок"""
-    import asyncio
-    
-    while True:
-        try:
-            # Проверяем каждый день в 10:00
-            now = datetime.now()
-            if now.hour == 10 and now.minute < 5:  # Окно в 5 минут
-                # Определяем, понедельник ли сегодня
-                if now.weekday() == 0:  # 0 = понедельник
-                    # Получаем всех пользователей с подписками
-                    conn = db.create_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT DISTINCT user_id FROM subscriptions')
-                    user_ids = [row[0] for row in cursor.fetchall()]
-                    conn.close()
-                    
-                    # Отправляем опрос каждому пользователю
-                    for user_id in user_ids:
-                        await send_weekly_usage_survey(bot, user_id)
-                        await asyncio.sleep(1)  # Небольшая задержка между отправками
-                    
-                    logging.info(f"Отправлены еженедельные опросы {len(user_ids)} пользователям")
-                    
-                    # Проверяем неиспользуемые подписки
-                    await check_unused_subscriptions(bot)
-                    logging.info("Проверка неиспользуемых подписок завершена")
-            
-            # Проверяем каждую минуту
-            await asyncio.sleep(60)
-        except Exception as e:
-            logging.error(f"Ошибка в планировщике опросов: {e}")
-            await asyncio.sleep(60)
+def _slot_offsets():
+    step = timedelta(minutes=SURVEY_SPREAD_MINUTES) / SURVEY_SPREAD_SLOTS
+    return [step * slot for slot in range(SURVEY_SPREAD_SLOTS)]
+
+
+async def _survey_runs(after):
+    """Ближайшие после after запуски слотов рассылки: список (время UTC, (пояс, час, слот))"""
+    runs = []
+    for timezone_name, hour in await adb.get_survey_groups(SURVEY_TIMEZONE, SURVEY_SEND_HOUR):
+        tz = get_timezone(timezone_name)
+        for slot, offset in enumerate(_slot_offsets()):
+            runs.append((next_weekly(after, tz, SURVEY_WEEKDAY, hour, offset), (timezone_name, hour, slot)))
+    return runs
+
+
+async def next_survey_run(after):
+    return min(run_at for run_at, _ in await _survey_runs(after))
+
 
+def create_survey_job(bot: Bot):
+    """
+    Задание рассылки еженедельного опроса.
+
+    Каждая группа пользователей с одинаковыми часовым поясом и часом отправки
+    получает опрос в свой день недели и час по местному времени; получатели
+    группы разбиты на SURVEY_SPREAD_SLOTS частей, которые отправляются равномерно
+    в течение SURVEY_SPREAD_MINUTES минут, а не все одновременно.
+    """
+    async def action(run_at):
+        # Все слоты всех групп, запланированные на это время
+        for slot_run_at, group in await _survey_runs(run_at - timedelta(microseconds=1)):
+            if slot_run_at != run_at:
+                continue
+            timezone_name, hour, slot = group
+            # Неделя опроса - по местному времени пользователей группы
+            local_start = (run_at - _slot_offsets()[slot]).astimezone(get_timezone(timezone_name))
+            summary = await broadcast_weekly_survey(bot, get_week_start(local_start.date()), group)
+            if summary is not None:
+                logging.info(f"Отправлены еженедельные опросы ({timezone_name or 'сервер'}, "
+                             f"{hour}:00, часть {slot + 1}/{SURVEY_SPREAD_SLOTS}): {summary}")
+
+    return Job('weekly_survey', next_survey_run, action)
+
+
+def create_unused_check_job(bot: Bot):
+    """Задание еженедельной проверки неиспользуемых подписок (после рассылки опроса по умолчанию)"""
+    tz = get_timezone(SURVEY_TIMEZONE)
+    offset = timedelta(minutes=SURVEY_SPREAD_MINUTES)
+
+    async def next_run(after):
+        return next_weekly(after, tz, SURVEY_WEEKDAY, SURVEY_SEND_HOUR, offset)
+
+    async def action(run_at):
+        await check_unused_subscriptions(bot)
+        logging.info("Проверка неиспользуемых подписок завершена")
+
+    return Job('unused_check', next_run, action)
+
+
+async def setup_survey_jobs(scheduler, bot: Bot):
+    """Добавить задания опроса в планировщик и досылать прерванные рассылки"""
+    scheduler.add(create_survey_job(bot))
+    scheduler.add(create_unused_check_job(bot))
+    try:
+        await resume_weekly_survey_broadcasts(bot)
+    except Exception as e:
+        logging.error(f"Не удалось продолжить прерванную рассылку опроса: {e}")
@@ -0,0 +1,229 @@
+"""
+Импорт и выгрузка подписок с историей использования в CSV или JSONL.
+
+Формат записи (одна подписка):
+    user_id       - владелец (в боте игнорируется, берётся отправитель файла)
+    service_name  - название
+    price         - цена в месяц, число > 0
+    currency      - валюта цены с загруженным курсом (по умолчанию currency.BASE_CURRENCY)
+    category      - категория из config.CATEGORIES
+    importance    - важность 1..10 (по умолчанию 5)
+    usage         - оценки использования: в CSV "2025-01-06:7;2025-01-13:5",
+                    в JSONL словарь {"2025-01-06": 7, ...}
+
+Файлы читаются и пишутся построчно, поэтому память не зависит от их размера.
+
+Запуск без бота:
+    python -m services.transfer import data.csv [--user-id 123]
+    python -m services.transfer export data.jsonl [--user-id 123]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import config
+import currency
+import database as db
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('user_id', 'service_name', 'price', 'currency', 'category', 'importance', 'usage')
+# Сколько подписок можно загрузить одним файлом через бота (в CLI без ограничения)
+IMPORT_MAX_ROWS = getattr(config, 'IMPORT_MAX_ROWS', 1000)
+IMPORT_MAX_FILE_SIZE = getattr(config, 'IMPORT_MAX_FILE_SIZE', 5 * 1024 * 1024)
+MAX_NAME_LENGTH = 100
+
+
+class TransferError(ValueError):
+    """Ошибка в импортируемом файле (с номером строки)"""
+
+
+def detect_format(filename):
+    """Формат по расширению файла или None"""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        return 'jsonl'
+    return extension if extension in FORMATS else None
+
+
+def _parse_usage(value):
+    """Оценки из CSV-строки "неделя:оценка;..." или JSON-словаря в список пар"""
+    if not value:
+        return []
+    if isinstance(value, dict):
+        return list(value.items())
+    pairs = []
+    for item in str(value).split(';'):
+        if item.strip():
+            week, _, score = item.partition(':')
+            pairs.append((week, score))
+    return pairs
+
+
+def _validate(raw, user_id=None):
+    """Проверить и привести запись к кортежу для database.import_subscriptions"""
+    if user_id is None:
+        try:
+            user_id = int(raw.get('user_id'))
+        except (TypeError, ValueError):
+            raise TransferError("не указан user_id")
+
+    name = str(raw.get('service_name') or '').strip()
+    if not name or len(name) > MAX_NAME_LENGTH:
+        raise TransferError(f"название должно быть от 1 до {MAX_NAME_LENGTH} символов")
+
+    try:
+        price = float(raw.get('price'))
+    except (TypeError, ValueError):
+        raise TransferError(f"цена не число: {raw.get('price')!r}")
+    if not 0 < price < 10 ** 9:
+        raise TransferError(f"цена должна быть больше нуля: {price}")
+
+    code = raw.get('currency')
+    try:
+        code = currency.normalize_code(code) if code not in (None, '') else currency.BASE_CURRENCY
+    except ValueError as e:
+        raise TransferError(str(e))
+    if code not in db.get_fx_rates():
+        raise TransferError(f"курс валюты {code} не загружен")
+
+    category = raw.get('category')
+    if category not in config.CATEGORIES:
+        raise TransferError(f"неизвестная категория: {category!r}")
+
+    importance = raw.get('importance')
+    try:
+        importance = 5 if importance in (None, '') else int(importance)
+    except (TypeError, ValueError):
+        raise TransferError(f"важность не число: {importance!r}")
+    if not 1 <= importance <= 10:
+        raise TransferError(f"важность должна быть от 1 до 10: {importance}")
+
+    usage = []
+    for week, score in _parse_usage(raw.get('usage')):
+        try:
+            week = date.fromisoformat(str(week).strip())
+            score = int(score)
+        except (TypeError, ValueError):
+            raise TransferError(f"неверная оценка использования: {week}:{score}")
+        if not 1 <= score <= 10:
+            raise TransferError(f"оценка использования должна быть от 1 до 10: {score}")
+        # Оценки хранятся по понедельникам
+        usage.append(((week - timedelta(days=week.weekday())).isoformat(), score))
+
+    return user_id, name, price, code, category, importance, usage
+
+
+def parse_records(lines, fmt, user_id=None, max_rows=None):
+    """
+    Генератор проверенных записей из текстовых строк файла.
+
+    user_id: если задан, все подписки принадлежат ему (столбец user_id не нужен).
+    Ошибка в любой записи - TransferError с номером строки.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        rows = ((reader.line_num, row) for row in reader)
+    elif fmt == 'jsonl':
+        rows = ((line_no, line) for line_no, line in enumerate(lines, 1) if line.strip())
+    else:
+        raise TransferError(f"неизвестный формат: {fmt}")
+
+    for count, (line_no, raw) in enumerate(rows, 1):
+        if max_rows is not None and count > max_rows:
+            raise TransferError(f"слишком много записей, максимум {max_rows}")
+        try:
+            if fmt == 'jsonl':
+                raw = json.loads(raw)
+                if not isinstance(raw, dict):
+                    raise TransferError("ожидается JSON-объект")
+            yield _validate(raw, user_id)
+        except (TransferError, json.JSONDecodeError) as e:
+            raise TransferError(f"строка {line_no}: {e}") from None
+
+
+def format_records(records, fmt):
+    """Генератор строк файла выгрузки из записей database.iter_subscriptions_export"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(FIELDS)
+        for user_id, name, price, code, category, importance, usage in records:
+            writer.writerow((
+                user_id, name, price, code, category, importance,
+                ';'.join(f"{week}:{score}" for week, score in usage),
+            ))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    elif fmt == 'jsonl':
+        for record in records:
+            item = dict(zip(FIELDS, record))
+            item['usage'] = dict(item['usage'])
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+    else:
+        raise TransferError(f"неизвестный формат: {fmt}")
+
+
+def import_file(path, fmt, user_id=None, max_rows=None):
+    """
+    Импортировать файл одной транзакцией.
+
+    Returns:
+        Кортеж (число подписок, число оценок)
+    """
+    # utf-8-sig: CSV из Excel начинается с BOM
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        try:
+            return db.import_subscriptions(parse_records(f, fmt, user_id, max_rows))
+        except UnicodeDecodeError:
+            raise TransferError("файл должен быть в кодировке UTF-8") from None
+        except csv.Error as e:
+            raise TransferError(f"неверный CSV: {e}") from None
+
+
+def export_file(path, fmt, user_id=None):
+    """Выгрузить подписки (одного пользователя или все) в файл. Возвращает число подписок"""
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.writelines(format_records(counted(db.iter_subscriptions_export(user_id)), fmt))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="файл (.csv или .jsonl)")
+    parser.add_argument('--format', choices=FORMATS, help="формат, если не следует из расширения")
+    parser.add_argument('--user-id', type=int, help="только этот пользователь (при импорте - владелец всех записей)")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("не удалось определить формат, укажите --format")
+
+    db.init_db()
+    try:
+        if args.command == 'import':
+            subs_count, usage_count = import_file(args.path, fmt, args.user_id)
+            print(f"Импортировано подписок: {subs_count}, оценок: {usage_count}")
+        else:
+            count = export_file(args.path, fmt, args.user_id)
+            print(f"Выгружено подписок: {count}")
+    except TransferError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
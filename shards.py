@@ -0,0 +1,133 @@
+"""
+Распределение пользователей по файлам БД (шардам).
+
+Файлы перечисляются в config: шард 0 - DB_NAME (в нём же общие таблицы:
+рассылки, состояния диалогов, планировщик), остальные - config.DB_SHARDS.
+Пользователь попадает в шард по консистентному хешу user_id, поэтому при
+добавлении шарда переезжает только примерно 1/K пользователей.
+
+Добавление шарда без остановки обслуживания:
+    1. python -m shards plan        - закрепить переезжающих пользователей
+                                      за текущими шардами (новый список шардов
+                                      уже в config, бот ещё работает со старым)
+    2. перезапустить бота с новым config.DB_SHARDS
+    3. python -m shards rebalance   - перенести данные закреплённых пользователей
+                                      по одному и снять закрепление (можно повторять)
+    python -m shards status         - пользователи по шардам и сколько ещё переносить
+
+Новые файлы добавляются только в конец DB_SHARDS: номер шарда задаёт диапазон
+ID его подписок, чтобы ID не пересекались при переносе между шардами.
+"""
+import argparse
+import bisect
+import hashlib
+import os
+
+import config
+
+# Дополнительные файлы БД (к DB_NAME), между которыми распределяются пользователи
+DB_SHARDS = list(getattr(config, 'DB_SHARDS', None) or [])
+# Точек на кольце на шард: чем больше, тем равномернее распределение
+SHARD_VNODES = getattr(config, 'SHARD_VNODES', 128)
+# ID подписок шарда i начинаются с i * SHARD_ID_RANGE
+SHARD_ID_RANGE = 1 << 40
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class ShardRing:
+    """
+    Кольцо консистентного хеширования: user_id -> путь к файлу шарда.
+
+    Точки шарда вычисляются по имени файла (без каталога), поэтому перенос
+    файлов в другой каталог не меняет распределение.
+    """
+
+    def __init__(self, paths, vnodes=SHARD_VNODES):
+        self.paths = tuple(paths)
+        points = sorted(
+            (_hash(f"{os.path.basename(path)}#{i}"), path)
+            for path in self.paths
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [path for _, path in points]
+
+    def get(self, user_id):
+        if len(self.paths) == 1:
+            return self.paths[0]
+        index = bisect.bisect(self._hashes, _hash(str(user_id))) % len(self._hashes)
+        return self._owners[index]
+
+
+def plan():
+    """Закрепить за текущими шардами пользователей, которым по кольцу положен другой шард"""
+    import database as db
+
+    pinned = 0
+    for path in db.shard_paths():
+        for user_id in db.get_misplaced_users(path):
+            pinned += db.pin_user(user_id, path)
+    return pinned
+
+
+def rebalance(progress=None):
+    """
+    Перенести данные пользователей в их шарды по кольцу.
+
+    Сначала закреплённые пользователи (после plan), затем оставшиеся не на
+    своём месте (например, записанные ботом со старым списком шардов).
+    Каждый пользователь переносится отдельной короткой транзакцией.
+    Возвращает число перенесённых пользователей.
+    """
+    import database as db
+
+    moved = 0
+    for user_id, path in db.get_pinned_users():
+        db.move_user(user_id, path, db.get_ring().get(user_id))
+        moved += 1
+        if progress:
+            progress(moved)
+    for path in db.shard_paths():
+        for user_id in db.get_misplaced_users(path):
+            db.move_user(user_id, path, db.get_ring().get(user_id))
+            moved += 1
+            if progress:
+                progress(moved)
+    return moved
+
+
+def status():
+    """Число пользователей в каждом шарде, из них не на своём месте; число закреплённых"""
+    import database as db
+
+    shards = {
+        path: (len(db.get_shard_users(path)), len(db.get_misplaced_users(path)))
+        for path in db.shard_paths()
+    }
+    return shards, len(db.get_pinned_users())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['plan', 'rebalance', 'status'])
+    args = parser.parse_args()
+
+    import database as db
+    db.init_db()
+    if args.command == 'plan':
+        print(f"Закреплено пользователей: {plan()}")
+    elif args.command == 'rebalance':
+        moved = rebalance(lambda count: count % 100 or print(f"Перенесено: {count}"))
+        print(f"Перенесено пользователей: {moved}")
+    else:
+        shards, pinned = status()
+        for path, (users, misplaced) in shards.items():
+            print(f"{path}: пользователей {users}, не на своём месте {misplaced}")
+        print(f"Закреплено: {pinned}")
+
+
+if __name__ == '__main__':
+    main()
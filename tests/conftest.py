@@ -0,0 +1,29 @@
+import pytest
+
+import database as db
+
+
+@pytest.fixture
+def test_db(tmp_path, monkeypatch):
+    """Пустая БД во временном каталоге; возвращает путь к файлу"""
+    path = str(tmp_path / 'finance_bot.db')
+    monkeypatch.setattr(db, 'DB_NAME', path)
+    db.close_connections()
+    db.clear_subs_cache()
+    db.init_db()
+    yield path
+    db.close_connections()
+
+
+@pytest.fixture
+def shard_db(tmp_path, monkeypatch):
+    """Пустая БД из двух шардов во временном каталоге; возвращает пути шардов"""
+    paths = [str(tmp_path / 'main.db'), str(tmp_path / 'shard1.db')]
+    monkeypatch.setattr(db, 'DB_NAME', paths[0])
+    monkeypatch.setattr(db, 'DB_SHARDS', paths[1:])
+    db.close_connections()
+    db.clear_subs_cache()
+    db.init_db()
+    yield paths
+    db.close_connections()
+    db.clear_subs_cache()
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import time
+
+import async_db as adb
+
+
+def test_wrappers_run_in_db_threads(test_db):
+    async def scenario():
+        await adb.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+        subs = await adb.get_all_subs(1)
+        thread = await adb.run(lambda: threading.current_thread().name)
+        return subs, thread
+
+    subs, thread = asyncio.run(scenario())
+    assert subs == [('Spotify', 199.0, 'Музыка', 7)]
+    assert thread.startswith('db')
+
+
+def test_pending_queries_are_bounded():
+    executor = adb.DBExecutor(workers=4, max_pending=2)
+    running = peak = 0
+    lock = threading.Lock()
+
+    def query():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+
+    async def scenario():
+        await asyncio.gather(*(executor.run(query) for _ in range(8)))
+
+    asyncio.run(scenario())
+    executor.shutdown()
+    assert peak == 2
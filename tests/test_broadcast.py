@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+import database as db
+from services.broadcast import Broadcaster, TokenBucket
+
+
+def test_token_bucket_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_deliver_retries_after_429_and_skips_blocked_chats():
+    broadcaster = Broadcaster(global_rate=1000, per_chat_rate=1000)
+    calls = []
+
+    async def flaky():
+        calls.append('flaky')
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method=None, message='Too Many Requests', retry_after=0)
+
+    async def blocked():
+        raise TelegramForbiddenError(method=None, message='bot was blocked by the user')
+
+    async def scenario():
+        return await broadcaster.deliver(1, flaky), await broadcaster.deliver(2, blocked)
+
+    assert asyncio.run(scenario()) == ('sent', 'skipped')
+    assert calls == ['flaky', 'flaky']
+
+
+def test_run_job_resumes_without_duplicates(test_db):
+    for user_id in range(1, 6):
+        db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+    # Прошлый запуск успел начать отправку пользователю 2 и упал
+    db.start_broadcast_job('job')
+    db.claim_broadcast_deliveries('job', [1, 2])
+    db.mark_broadcast_delivery('job', 1, 'sent')
+    db.save_broadcast_cursor('job', 1)
+
+    sent = []
+
+    async def send(user_id):
+        sent.append(user_id)
+        return user_id != 5  # пользователю 5 отправлять нечего
+
+    broadcaster = Broadcaster(global_rate=1000, per_chat_rate=1000)
+    summary = asyncio.run(broadcaster.run_job('job', send, batch_size=2))
+    assert sorted(sent) == [3, 4, 5]
+    assert summary == {'sent': 3, 'pending': 1, 'skipped': 1}
+    assert asyncio.run(broadcaster.run_job('job', send)) is None
+    assert db.get_unfinished_broadcast_jobs('jo') == []
@@ -0,0 +1,67 @@
+import database as db
+from cache import LRUCache
+from services.charts import ChartCache, chart_cache
+
+
+def test_lru_evicts_by_count_and_bytes():
+    evicted = []
+    cache = LRUCache(maxsize=3, max_bytes=10, sizeof=len, on_evict=lambda key, value: evicted.append(key))
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'  # 'a' становится самой свежей
+    cache.set('c', b'1234')           # 12 байт > 10: вытесняется 'b'
+    assert evicted == ['b']
+    cache.set('d', b'')
+    cache.set('e', b'')               # 4 записи > 3: вытесняется 'a'
+    assert evicted == ['b', 'a']
+    assert cache.stats() == {'hits': 1, 'misses': 0, 'evictions': 2, 'entries': 3, 'bytes': 4}
+
+
+def test_lru_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(ttl=5)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    now[0] += 5
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_chart_cache_keys_and_file_id():
+    cache = ChartCache()
+    key = cache.make_key('pie', [('Музыка', 199.0)])
+    assert key == cache.make_key('pie', [('Музыка', 199.0)])
+    assert key != cache.make_key('bar', [('Музыка', 199.0)])
+    assert key != cache.make_key('pie', [('Музыка', 299.0)])
+
+    entry = cache.put(key, 1, b'png')
+    cache.remember_file_id(entry, 'file-1')
+    assert cache.get(key).file_id == 'file-1'
+    assert cache.get(key).png is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_chart_cache_keeps_invalidated_entry_out():
+    cache = ChartCache()
+    entry = cache.put(cache.make_key('pie', 'user 1'), 1, b'png')
+    # Данные изменились, пока картинка отправлялась в Telegram
+    cache.invalidate_user(1)
+    cache.remember_file_id(entry, 'file-1')
+    assert cache.get(entry.key) is None
+
+    # Новый график с тем же ключом не заменяется устаревшей записью
+    fresh = cache.put(entry.key, 1, b'new png')
+    cache.remember_file_id(entry, 'file-1')
+    assert cache.get(entry.key) is fresh and fresh.png == b'new png'
+
+
+def test_chart_cache_invalidated_by_user_writes(test_db):
+    pie = chart_cache.put(chart_cache.make_key('pie', 'user 1'), 1, b'png')
+    other = chart_cache.put(chart_cache.make_key('pie', 'user 2'), 2, b'png')
+    try:
+        db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+        assert chart_cache.get(pie.key) is None
+        assert chart_cache.get(other.key) is other
+    finally:
+        chart_cache.invalidate_user(2)
@@ -0,0 +1,101 @@
+import asyncio
+import base64
+from datetime import date
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import callback_codec as codec
+import database as db
+from benchmarks.fake_api import RecordingSession, fake_update
+from handlers.callbacks import register_callbacks_handlers
+
+MONDAY = date(2025, 1, 6)
+
+
+def _raw(data):
+    """callback_data из байтов в обход pack (base64url без '=')"""
+    return base64.urlsafe_b64encode(bytes(data)).rstrip(b'=').decode('ascii')
+
+
+@pytest.mark.parametrize('item', [
+    codec.DeleteSub(5),
+    codec.DeleteSub(3 << 40),  # ID подписки из диапазона шарда
+    codec.RateSub(123, MONDAY),
+    codec.FinishSurvey(codec.EPOCH_MONDAY),
+    codec.ChangeImportance(0),
+    codec.Page(2, True, 1 << 41, MONDAY),
+    codec.Page(0, False, 17),
+])
+def test_round_trip(item):
+    data = codec.pack(item)
+    assert len(data.encode()) <= 64
+    assert codec.unpack(data) == item
+
+
+def test_packed_is_shorter_than_legacy():
+    assert codec.pack(codec.RateSub(123, MONDAY)) == 'Inu2Fg'
+
+
+@pytest.mark.parametrize('data, item', [
+    ('del_5', codec.DeleteSub(5)),
+    ('rate_5_2025-01-06', codec.RateSub(5, MONDAY)),
+    ('finish_survey_2025-01-06', codec.FinishSurvey(MONDAY)),
+    ('change_imp_7', codec.ChangeImportance(7)),
+    ('pg_rate_n_40_2025-01-06', codec.Page(2, True, 40, MONDAY)),
+    ('pg_del_p_3', codec.Page(0, False, 3)),
+])
+def test_legacy_format(data, item):
+    assert codec.unpack(data) == item
+
+
+@pytest.mark.parametrize('version', [0, 2, 7])
+def test_unknown_version_rejected(version):
+    with pytest.raises(ValueError, match='версия'):
+        codec.unpack(_raw([version << 5 | 1, 5]))
+
+
+@pytest.mark.parametrize('data', [
+    _raw([codec.VERSION << 5 | 31, 5]),     # незарегистрированное действие
+    _raw([codec.VERSION << 5 | 1, 5, 6]),   # лишние байты
+    _raw([codec.VERSION << 5 | 2, 5]),      # не хватает недели
+    _raw([codec.VERSION << 5 | 1, 0x80]),   # обрезанный varint
+    '',
+    'rate_x_2025-01-06',
+    'del_',
+])
+def test_malformed_rejected(data):
+    with pytest.raises(ValueError):
+        codec.unpack(data)
+
+
+def test_pack_rejects_invalid_values():
+    with pytest.raises(ValueError):
+        codec.pack(codec.RateSub(1, date(2025, 1, 7)))  # не понедельник
+    with pytest.raises(ValueError):
+        codec.pack(codec.DeleteSub(-1))
+
+
+def test_dispatcher_routes_packed_and_legacy_buttons(test_db):
+    for name in ('Spotify', 'Netflix'):
+        db.add_subscription(1, name, 199, 'Музыка', 7)
+    spotify, netflix = (sub[0] for sub in db.get_all_subs(1, include_id=True))
+
+    dp = Dispatcher()
+    register_callbacks_handlers(dp)
+
+    async def press(bot, update_id, data):
+        update = Update.model_validate(fake_update(update_id, 1, callback_data=data), context={'bot': bot})
+        await dp.feed_update(bot, update)
+
+    async def scenario():
+        bot = Bot(token='123456:test', session=RecordingSession())
+        await press(bot, 1, codec.pack(codec.DeleteSub(spotify)))
+        await press(bot, 2, f'del_{netflix}')
+        await press(bot, 3, 'garbage')
+        return bot.session.calls
+
+    calls = asyncio.run(scenario())
+    assert db.get_all_subs(1) == []
+    assert calls == {'answerCallbackQuery': 2, 'editMessageText': 2}
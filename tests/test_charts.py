@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+import pytest
+
+import utils
+from services.charts import ChartQueueFull, ChartRenderer, _render_pie
+
+PNG = b'\x89PNG'
+ROWS = [(1, 'Spotify', 199.0, 'Музыка', 7, 6.5), (2, 'Netflix', 599.0, 'Стриминг', 3, None)]
+
+
+def test_charts_render_png():
+    assert utils.generate_pie_chart([('Музыка', 199.0), ('Стриминг', 599.0)]).getvalue().startswith(PNG)
+    assert utils.generate_bar_chart(ROWS).getvalue().startswith(PNG)
+    assert utils.generate_pie_chart([]) is None
+    assert utils.generate_bar_chart([]) is None
+
+
+def test_renderer_pool_and_limits():
+    renderer = ChartRenderer(workers=1, max_queue=1, timeout=30)
+
+    async def scenario():
+        png = await renderer.render(_render_pie, [('Музыка', 199.0)])
+        renderer.timeout = 0.2
+        with pytest.raises(asyncio.TimeoutError):
+            await renderer.render(time.sleep, 1)
+        return png
+
+    try:
+        assert asyncio.run(scenario()).startswith(PNG)
+    finally:
+        renderer.shutdown()
+
+
+def test_renderer_rejects_when_queue_full():
+    renderer = ChartRenderer(workers=1, max_queue=0)
+    with pytest.raises(ChartQueueFull):
+        asyncio.run(renderer.render(_render_pie, []))
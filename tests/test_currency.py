@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import currency
+import database as db
+
+
+def test_parse_price_variants():
+    assert currency.parse_price('299') == (299.0, 'RUB')
+    assert currency.parse_price('9.99 USD') == (9.99, 'USD')
+    assert currency.parse_price('$9.99') == (9.99, 'USD')
+    assert currency.parse_price('5,50€') == (5.5, 'EUR')
+    assert currency.parse_price('150 руб.') == (150.0, 'RUB')
+    assert currency.parse_price('12 gbp') == (12.0, 'GBP')
+    for text in ('', 'abc', '$5€', '10 тугриков'):
+        with pytest.raises(ValueError):
+            currency.parse_price(text)
+
+
+def test_format_price():
+    assert currency.format_price(299) == '299₽'
+    assert currency.format_price(9.99, 'USD') == '9.99$'
+    assert currency.format_price(12.5, 'GBP') == '12.5 GBP'
+
+
+def test_to_base_looks_up_each_currency_once():
+    result = currency.to_base([100, 10, 2, 5], ['RUB', 'USD', 'EUR', 'GBP'], {'RUB': 1.0, 'USD': 90.0, 'EUR': 100.0})
+    assert result.tolist() == [100.0, 900.0, 200.0, 5.0]
+    assert currency.to_base([], [], {}).size == 0
+
+
+def test_read_rates_file(tmp_path):
+    csv_path = tmp_path / 'rates.csv'
+    csv_path.write_text('currency,rate\nusd,92.5\n€,100.2\n', encoding='utf-8')
+    assert currency.read_rates_file(str(csv_path)) == {'USD': 92.5, 'EUR': 100.2}
+
+    json_path = tmp_path / 'rates.json'
+    json_path.write_text(json.dumps({'USD': 0}), encoding='utf-8')
+    with pytest.raises(ValueError, match='больше нуля'):
+        currency.read_rates_file(str(json_path))
+
+
+def test_prices_converted_by_saved_rates(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    db.add_subscription(1, 'Netflix', 10, 'Развлечения', 5, 'USD')
+    db.save_fx_rates({'USD': 90.0})
+    assert db.get_fx_rates()['USD'] == 90.0
+    assert db.get_all_subs(1) == [('Spotify', 199, 'Музыка', 7), ('Netflix', 900, 'Развлечения', 5)]
+    assert db.get_all_subs(1, include_currency=True)[1] == ('Netflix', 900, 'Развлечения', 5, 10, 'USD')
+
+    # Новый курс сбрасывает закэшированные цены
+    db.save_fx_rates({'USD': 100.0})
+    assert dict(db.get_stats_by_category(1)) == {'Развлечения': 1000, 'Музыка': 199}
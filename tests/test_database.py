@@ -0,0 +1,42 @@
+import threading
+
+import database as db
+
+
+def test_connection_reused_per_thread(test_db):
+    conn = db.create_connection()
+    assert db.create_connection() is conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.create_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_connection_pragmas(test_db):
+    conn = db.create_connection()
+    assert conn.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    assert conn.execute('PRAGMA synchronous').fetchone() == (1,)  # NORMAL
+    assert conn.execute('PRAGMA busy_timeout').fetchone() == (5000,)
+
+
+def test_close_connections_reopens(test_db):
+    conn = db.create_connection()
+    db.close_connections()
+    assert db.create_connection() is not conn
+    assert db.get_users_with_subs() == []
+
+
+def test_subscription_helpers(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    (sub_id, *_), = db.get_all_subs(1, include_id=True)
+
+    assert db.get_sub_info(1, sub_id) == ('Spotify', 7)
+    assert db.update_importance(1, sub_id, 3) == 'Spotify'
+    assert db.get_sub_info(1, sub_id) == ('Spotify', 3)
+    assert db.get_users_with_subs() == [1]
+
+    db.delete_sub_by_id(1, sub_id)
+    assert db.get_sub_info(1, sub_id) is None
+    assert db.update_importance(1, sub_id, 5) is None
@@ -0,0 +1,63 @@
+import numpy as np
+
+import efficiency
+import utils
+
+
+def test_score_tiers_and_savings():
+    # Стоимость = цена / (важность * использование); граница уровня входит в нижний уровень
+    price = [100, 400, 500, 600, 1100, 300, 300]
+    importance = [10, 2, 2, 2, 1, 0, 5]
+    avg_usage = [1, 5, 5, 5, 10, 5, np.nan]
+    scores = efficiency.score(price, importance, avg_usage)
+
+    np.testing.assert_allclose(scores.cost, [10, 40, 50, 60, 110, np.nan, np.nan])
+    assert scores.tier.tolist() == [
+        efficiency.TIER_OPTIMAL, efficiency.TIER_MEDIUM, efficiency.TIER_MEDIUM, efficiency.TIER_HIGH,
+        efficiency.TIER_VERY_HIGH, efficiency.TIER_UNDEFINED, efficiency.TIER_NO_DATA,
+    ]
+    np.testing.assert_allclose(scores.savings, [0, 80, 100, 300, 1100, 0, 0])
+
+
+def test_score_batch_matches_rowwise_score():
+    rows = [
+        (1, 'Spotify', 199.0, 'Музыка', 7, 6.5),
+        (2, 'Netflix', 599.0, 'Кино', 3, None),
+        (3, 'Газ', 900.0, 'Коммуналка / ЖКХ', 10, 1.0),
+    ]
+    batch = efficiency.batch_from_rows(rows)
+    assert batch.names == ['Spotify', 'Netflix', 'Газ']
+    scores = efficiency.score_batch(batch)
+    for i, (_, _, price, _, importance, usage) in enumerate(rows):
+        single = efficiency.score(price, importance, np.nan if usage is None else usage)
+        np.testing.assert_equal(scores.cost[i], single.cost)
+        assert scores.tier[i] == single.tier
+
+
+def test_batch_from_rows_legacy_format():
+    batch = efficiency.batch_from_rows([('Spotify', 199.0, 'Музыка', 7)])
+    assert np.isnan(batch.avg_usage[0])
+    assert efficiency.score_batch(batch).tier.tolist() == [efficiency.TIER_NO_DATA]
+
+
+def test_score_users_sums_savings_per_user():
+    rows_by_user = {
+        10: [(1, 'Spotify', 200.0, 'Музыка', 1, 1.0), (2, 'Газ', 900.0, 'Коммуналка / ЖКХ', 10, 9.0)],
+        20: [],
+        30: [(3, 'Netflix', 600.0, 'Стриминг', 2, 5.0), (4, 'Кино', 300.0, 'Стриминг', 5, None)],
+    }
+    assert efficiency.score_users(rows_by_user) == {10: 200.0, 20: 0.0, 30: 300.0}
+    assert efficiency.score_users({}) == {}
+
+
+def test_analyze_efficiency_advice():
+    text, savings = utils.analyze_efficiency([
+        (1, 'Spotify', 200.0, 'Музыка', 1, 1.0),
+        (2, 'Netflix', 100.0, 'Стриминг', 10, 5.0),
+        (3, 'Кино', 300.0, 'Стриминг', 5, None),
+    ])
+    assert 'Spotify</b>: Очень высокая стоимость' in text
+    assert 'Netflix' not in text
+    assert 'Кино</b>: Нет данных' in text
+    assert savings == 200.0
+    assert utils.analyze_efficiency([(2, 'Netflix', 100.0, 'Стриминг', 10, 5.0)])[1] == 0
@@ -0,0 +1,54 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+import database as db
+from services.fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def _count_records():
+    return db.create_connection().execute('SELECT COUNT(*) FROM fsm_storage').fetchone()[0]
+
+
+def test_state_survives_restart(test_db):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=0.05)
+        await storage.set_state(KEY, 'AddSub:price')
+        await storage.update_data(KEY, {'name': 'Spotify'})
+        # До записи в БД изменения видны из буфера
+        assert _count_records() == 0
+        assert await storage.get_state(KEY) == 'AddSub:price'
+        assert await storage.get_data(KEY) == {'name': 'Spotify'}
+        await storage.close()
+
+        restarted = SQLiteStorage(flush_interval=0)
+        return await restarted.get_state(KEY), await restarted.get_data(KEY)
+
+    assert asyncio.run(scenario()) == ('AddSub:price', {'name': 'Spotify'})
+    assert _count_records() == 1
+
+
+def test_clear_removes_record(test_db):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=0)
+        await storage.set_state(KEY, 'AddSub:name')
+        await storage.set_data(KEY, {'name': 'Netflix'})
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        return await storage.get_state(KEY)
+
+    assert asyncio.run(scenario()) is None
+    assert _count_records() == 0
+
+
+def test_expired_records_are_ignored_and_purged(test_db):
+    async def scenario():
+        storage = SQLiteStorage(ttl=-1, flush_interval=0, cleanup_interval=0)
+        await storage.set_state(KEY, 'Rating:score')
+        return await storage.get_state(KEY)
+
+    # Запись сразу истекла: не читается и удаляется очисткой после записи
+    assert asyncio.run(scenario()) is None
+    assert _count_records() == 0
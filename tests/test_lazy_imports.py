@@ -0,0 +1,21 @@
+import asyncio
+import logging
+
+from benchmarks.import_time import measure
+from services.charts import ChartRenderer
+
+
+def test_bot_starts_without_matplotlib():
+    loaded = {name for name, _, _ in measure('main')}
+    assert 'handlers' in loaded
+    assert not any(name.split('.')[0] == 'matplotlib' for name in loaded)
+
+
+def test_prewarm_loads_pool_processes(caplog):
+    caplog.set_level(logging.INFO)
+    renderer = ChartRenderer(workers=1, timeout=30)
+    try:
+        asyncio.run(renderer.prewarm())
+        assert "Процессы отрисовки графиков прогреты" in caplog.text
+    finally:
+        renderer.shutdown()
@@ -0,0 +1,38 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Message
+
+from benchmarks.fake_api import RecordingSession
+from benchmarks.load_test import compare, run_scenario
+
+
+def test_run_scenario_counts_updates_and_api_calls():
+    dp = Dispatcher()
+
+    @dp.message(F.text)
+    async def echo(message: Message):
+        await message.answer(message.text)
+
+    async def scenario():
+        bot = Bot(token='123456:test', session=RecordingSession())
+        return await run_scenario(dp, bot, 'add', {1: [], 2: []}, concurrency=2)
+
+    result = asyncio.run(scenario())
+    assert (result['users'], result['updates'], result['errors']) == (2, 10, 0)
+    assert result['api_calls'] == {'sendMessage': 10}
+    assert set(result['latency_ms']) == {50, 95, 99}
+
+
+def test_compare_flags_regressions(capsys):
+    baseline = {'commit': 'abc', 'scenarios': {
+        'list': {'updates_per_sec': 100.0, 'latency_ms': {'95': 10.0}},
+        'add': {'updates_per_sec': 100.0, 'latency_ms': {'95': 10.0}},
+    }}
+    faster = {'scenarios': {'list': {'updates_per_sec': 110.0, 'latency_ms': {95: 9.0}}}}
+    assert not compare(faster, baseline, tolerance=0.2)
+
+    slower = {'scenarios': {'add': {'updates_per_sec': 70.0, 'latency_ms': {95: 11.0}},
+                            'survey': {'updates_per_sec': 1.0, 'latency_ms': {95: 1.0}}}}
+    assert compare(slower, baseline, tolerance=0.2)
+    assert "add: обновлений/с -30.0%, p95 +10.0%  <- регрессия" in capsys.readouterr().out
@@ -0,0 +1,56 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+import database as db
+from benchmarks.fake_api import RecordingSession, fake_update
+from handlers.messages import register_messages_handlers
+from states import ChangeImportanceState
+
+
+class TextSession(RecordingSession):
+    """Сессия, которая запоминает тексты отправленных сообщений"""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if method.__api_method__ == 'sendMessage':
+            self.texts.append(method.text)
+        return await super().make_request(bot, method, timeout)
+
+
+def _change_importance(sub_id, text):
+    """Пользователь 1 вводит новую важность подписки sub_id; возвращает ответы бота и состояние"""
+    dp = Dispatcher()
+    register_messages_handlers(dp)
+
+    async def scenario():
+        bot = Bot(token='123456:test', session=TextSession())
+        key = StorageKey(bot_id=bot.id, chat_id=1, user_id=1)
+        await dp.storage.set_state(key, ChangeImportanceState.waiting_for_importance)
+        await dp.storage.set_data(key, {'sub_id': sub_id})
+        update = Update.model_validate(fake_update(1, 1, text=text), context={'bot': bot})
+        await dp.feed_update(bot, update)
+        return bot.session.texts, await dp.storage.get_state(key)
+
+    return asyncio.run(scenario())
+
+
+def test_change_importance(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    (sub_id, *_), = db.get_all_subs(1, include_id=True)
+
+    assert _change_importance(sub_id, '3') == (['✅ Важность подписки <b>Spotify</b> изменена на 3/10'], None)
+    assert db.get_all_subs(1) == [('Spotify', 199, 'Музыка', 3)]
+
+
+def test_change_importance_of_deleted_subscription(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    (sub_id, *_), = db.get_all_subs(1, include_id=True)
+    db.delete_sub_by_id(1, sub_id)
+
+    assert _change_importance(sub_id, '3') == (['Подписка не найдена'], None)
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+
+import pytest
+
+import database as db
+import metrics
+
+
+def test_quantile_interpolates_inside_bucket():
+    buckets = (1, 2, 4)
+    assert metrics.quantile(buckets, [0, 10, 0, 0], 0.5) == 1.5
+    assert metrics.quantile(buckets, [5, 0, 5, 0], 0.99) == pytest.approx(3.96)
+    assert metrics.quantile(buckets, [0, 0, 0, 3], 0.5) == 4
+    assert metrics.quantile(buckets, [0, 0, 0, 0], 0.5) is None
+
+
+def test_render_prometheus_and_summary():
+    hist = metrics.histogram('test_render_seconds', "Тестовая гистограмма", ['kind'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        hist.observe(value, 'a"b')
+    text = metrics.render_prometheus()
+    assert '# TYPE test_render_seconds histogram' in text
+    assert 'test_render_seconds_bucket{kind="a\\"b",le="0.1"} 1' in text
+    assert 'test_render_seconds_bucket{kind="a\\"b",le="+Inf"} 4' in text
+    assert 'test_render_seconds_count{kind="a\\"b"} 4' in text
+
+    _, previous = metrics.summarize()
+    hist.observe(0.5, 'a"b')
+    lines, _ = metrics.summarize(previous)
+    assert [line for line in lines if line.startswith('test_render_seconds')] == [
+        'test_render_seconds{kind="a\\"b"}: n=1, p50=550.0, p95=955.0, p99=991.0 мс'
+    ]
+
+
+def test_timed_records_calls_and_logs_slow_ones(caplog):
+    hist = metrics.histogram('test_timed_seconds', "Тестовые вызовы", ['function'])
+
+    @metrics.timed(hist, 'sync', slow_ms=0)
+    def work(x, flag=False):
+        return x
+
+    @metrics.timed(hist, 'async')
+    async def async_work():
+        return 1
+
+    caplog.set_level(logging.WARNING)
+    assert work(1, flag=True) == 1
+    assert asyncio.run(async_work()) == 1
+    assert "Медленный вызов work(1, flag=True)" in caplog.text
+    assert {labels: count for labels, (_, _, count) in hist.snapshot().items()} == {('sync',): 1, ('async',): 1}
+
+
+def test_database_functions_are_instrumented(test_db):
+    hist = metrics.histogram('bot_db_call_seconds', '', ['function'])
+    before = hist.snapshot().get(('get_all_subs',), (None, 0, 0))[2]
+    db.get_all_subs(1)
+    assert hist.snapshot()[('get_all_subs',)][2] == before + 1
+    assert 'bot_subs_cache{stat="hits"}' in metrics.render_prometheus()
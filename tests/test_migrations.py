@@ -0,0 +1,69 @@
+import sqlite3
+
+import database as db
+import migrations
+
+
+def _baseline_db(path):
+    """БД первой версии бота: таблицы без индексов, PRAGMA user_version = 0"""
+    conn = sqlite3.connect(path)
+    for statement in migrations.MIGRATIONS[0][2]:
+        conn.execute(statement)
+    conn.executemany('INSERT INTO subscriptions (id, user_id, service_name, price, category, importance) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     [(1, 10, 'Spotify', 199, 'Музыка', 7), (2, 10, 'Газ', 900, 'Коммуналка / ЖКХ', 10),
+                      (3, 20, 'Netflix', 599, 'Стриминг', 4)])
+    conn.executemany('INSERT INTO usage_history (subscription_id, week_start_date, usage_score) VALUES (?, ?, ?)',
+                     [(1, f'2025-01-{day:02d}', score) for day, score in ((6, 2), (13, 4), (20, 6), (27, 8), (3, 10))]
+                     + [(3, '2025-01-06', 5)])
+    conn.commit()
+    conn.close()
+
+
+def _indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+
+
+def test_migrate_baseline_to_latest(tmp_path, monkeypatch):
+    path = str(tmp_path / 'finance_bot.db')
+    _baseline_db(path)
+    monkeypatch.setattr(db, 'DB_NAME', path)
+    db.close_connections()
+    try:
+        db.init_db()
+        conn = db.create_connection()
+        assert migrations.get_version(conn) == migrations.LATEST_VERSION
+        assert {'idx_subscriptions_user_id', 'idx_subscriptions_user_category',
+                'idx_usage_history_sub_week'} <= _indexes(conn)
+
+        # Данные сохранены
+        assert conn.execute('SELECT id, user_id FROM subscriptions ORDER BY id').fetchall() == [
+            (1, 10), (2, 10), (3, 20)]
+        # Агрегаты заполнены по накопленной истории (recent_avg - 4 последние недели)
+        assert conn.execute('SELECT * FROM usage_stats ORDER BY subscription_id').fetchall() == [
+            (1, 30, 5, 5.0, '2025-01-27'), (3, 5, 1, 5.0, '2025-01-06')]
+        # Старые подписки получили базовую валюту
+        assert conn.execute('SELECT id, currency FROM subscriptions ORDER BY id').fetchall() == [
+            (1, 'RUB'), (2, 'RUB'), (3, 'RUB')]
+        assert [sub[5] for sub in db.get_all_subs(10, include_id=True, include_usage=True)] == [6.0, None]
+
+        # Повторный запуск ничего не меняет
+        migrations.apply_migrations(conn)
+        assert migrations.get_version(conn) == migrations.LATEST_VERSION
+        db.add_subscription(20, 'Музыка', 199, 'Музыка', 5)
+        db.add_subscription(20, 'Музыка', 9.99, 'Музыка', 5, 'USD')
+        assert len(db.get_all_subs(20)) == 3
+        # Каждая запись поднимает версию данных пользователя
+        assert conn.execute('SELECT version FROM user_versions WHERE user_id = 20').fetchone() == (2,)
+    finally:
+        db.close_connections()
+
+
+def test_apply_up_to_target(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'new.db'))
+    migrations.apply_migrations(conn, target=1)
+    assert migrations.get_version(conn) == 1
+    assert _indexes(conn) == set()
+    migrations.apply_migrations(conn)
+    assert migrations.get_version(conn) == migrations.LATEST_VERSION
+    conn.close()
@@ -0,0 +1,58 @@
+from datetime import date
+
+import callback_codec as codec
+import database as db
+import keyboards
+from services.survey import SurveySession, survey_page_start
+
+
+def _add_subs(count):
+    for i in range(count):
+        db.add_subscription(1, f'Сервис {i}', 100 + i, 'Другое', 5)
+    db.add_subscription(1, 'Газ', 800, 'Коммуналка / ЖКХ', 10)
+    return [sub[0] for sub in db.get_all_subs(1, include_id=True)]
+
+
+def _names(rows):
+    return [row[1] for row in rows]
+
+
+def test_keyset_pages_in_both_directions(test_db):
+    ids = _add_subs(5)
+
+    rows, has_prev, has_next = db.get_subs_page(1, limit=2, exclude_zkh=True)
+    assert (_names(rows), has_prev, has_next) == (['Сервис 0', 'Сервис 1'], False, True)
+    rows, has_prev, has_next = db.get_subs_page(1, after_id=rows[-1][0], limit=2, exclude_zkh=True)
+    assert (_names(rows), has_prev, has_next) == (['Сервис 2', 'Сервис 3'], True, True)
+    rows, has_prev, has_next = db.get_subs_page(1, after_id=rows[-1][0], limit=2, exclude_zkh=True)
+    assert (_names(rows), has_prev, has_next) == (['Сервис 4'], True, False)
+    rows, has_prev, has_next = db.get_subs_page(1, before_id=rows[0][0], limit=2, exclude_zkh=True)
+    assert (_names(rows), has_prev, has_next) == (['Сервис 2', 'Сервис 3'], True, True)
+
+    # Без фильтра ЖКХ попадает на последнюю страницу
+    assert _names(db.get_subs_page(1, after_id=ids[3], limit=2)[0]) == ['Сервис 4', 'Газ']
+    # Страница опустела после удаления - показывается первая
+    assert _names(db.get_subs_page(1, after_id=ids[-1], limit=2)[0]) == ['Сервис 0', 'Сервис 1']
+
+
+def test_page_with_week_ratings_and_navigation_buttons(test_db):
+    ids = _add_subs(3)
+    db.save_usage_score(ids[1], 1, '2025-01-06', 9)
+
+    rows, has_prev, has_next = db.get_subs_page(1, after_id=ids[0], limit=2, week_start_date='2025-01-06')
+    assert [row[6] for row in rows] == [9, None]
+
+    markup = keyboards.get_subs_page_kb('del', rows, has_prev, has_next)
+    actions = [codec.unpack(button.callback_data) for row in markup.inline_keyboard for button in row]
+    assert actions == [codec.DeleteSub(ids[1]), codec.DeleteSub(ids[2]),
+                       codec.Page(0, False, ids[1]), codec.Page(0, True, ids[2])]
+    assert keyboards.page_cursor(actions[2]) == {'before_id': ids[1]}
+    assert keyboards.page_cursor(actions[3]) == {'after_id': ids[2]}
+
+
+def test_survey_page_restored_from_message_keyboard():
+    session = SurveySession('2025-01-06', [[5, 'Spotify', '199₽', None], [7, 'Netflix', '599₽', 8]], has_next=True)
+    markup = session.markup()
+    assert survey_page_start(markup) == 4
+    assert survey_page_start(None) is None
+    assert codec.unpack(markup.inline_keyboard[-2][0].callback_data) == codec.Page(2, True, 7, date(2025, 1, 6))
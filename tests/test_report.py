@@ -0,0 +1,103 @@
+import asyncio
+import re
+from datetime import date, timedelta
+
+import database as db
+import trends
+import utils
+from services import charts, report
+
+TODAY = date(2025, 2, 3)
+
+
+def _add_sub(name, price, importance, scores, first_week=date(2025, 1, 6)):
+    db.add_subscription(1, name, price, 'Другое', importance)
+    sub_id = db.get_all_subs(1, include_id=True)[-1][0]
+    for i, score in enumerate(scores):
+        db.save_usage_score(sub_id, 1, (first_week + timedelta(weeks=i)).isoformat(), score)
+
+
+def _pdf_pages(path):
+    with open(path, 'rb') as f:
+        return len(re.findall(rb'/Type /Page\b(?!s)', f.read()))
+
+
+def test_month_report_pages_and_forecast(test_db, tmp_path, monkeypatch):
+    _add_sub('Netflix', 1100, 1, [1] * 5)
+    _add_sub('Spotify', 199, 10, [10] * 5)
+    # Оценка до начала месяца не попадает на страницы динамики, но учитывается в экономии
+    _add_sub('YouTube', 400, 5, [1], first_week=date(2024, 12, 2))
+    monkeypatch.setattr(report, 'REPORT_SUBS_PER_PAGE', 2)
+
+    pages = {}
+    trend_page, forecast_page = utils.report_trend_page, utils.report_forecast_page
+
+    def capture_trend(series, title, no_data=()):
+        pages[title] = ([name for name, *_ in series], list(no_data))
+        return trend_page(series, title, no_data)
+
+    def capture_forecast(monthly, savings, months, title):
+        pages['forecast'] = (monthly, savings)
+        return forecast_page(monthly, savings, months, title)
+
+    monkeypatch.setattr(utils, 'report_trend_page', capture_trend)
+    monkeypatch.setattr(utils, 'report_forecast_page', capture_forecast)
+
+    path = str(tmp_path / 'report.pdf')
+    assert report.write_report(path, 1, 'month', today=TODAY) == 3
+    # Категории, две страницы динамики и прогноз
+    assert _pdf_pages(path) == 4
+    assert list(pages.values())[:2] == [(['Netflix', 'Spotify'], []), ([], ['YouTube'])]
+    # Экономия - как в совете бота: Netflix целиком, половина YouTube
+    assert pages['forecast'] == (1699.0, 1300.0)
+    _, savings = utils.analyze_efficiency(db.get_all_subs(1, include_id=True, include_usage=True),
+                                          trends.get_user_trends(1, today=TODAY))
+    assert savings == 1300.0
+    # Пакетные отчёты считают ту же экономию сразу для порции пользователей
+    assert report.users_savings([1], today=TODAY) == {1: 1300.0}
+
+
+def test_no_report_without_subscriptions(test_db, tmp_path):
+    path = tmp_path / 'report.pdf'
+    assert report.write_report(str(path), 1, today=TODAY) == 0
+    assert not path.exists()
+
+
+def test_export_since_limits_history(test_db):
+    _add_sub('Netflix', 1100, 1, [1, 2, 3])
+    (*_, usage), = db.iter_subscriptions_export(1, since='2025-01-13')
+    assert usage == [('2025-01-13', 2), ('2025-01-20', 3)]
+
+
+def test_precomputed_savings_used_as_is(test_db, tmp_path, monkeypatch):
+    _add_sub('Netflix', 1100, 1, [1] * 5)
+    forecasts, forecast_page = [], utils.report_forecast_page
+
+    def capture_forecast(monthly, savings, months, title):
+        forecasts.append(savings)
+        return forecast_page(monthly, savings, months, title)
+
+    monkeypatch.setattr(utils, 'report_forecast_page', capture_forecast)
+    monkeypatch.setattr(report.trends, 'get_user_trends', None)  # динамика не читается повторно
+    report.write_report(str(tmp_path / 'report.pdf'), 1, today=TODAY, savings=42.0)
+    assert forecasts == [42.0]
+
+
+def test_batch_reports_for_all_users(test_db, tmp_path):
+    for user_id in (1, 2):
+        db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+    assert report.batch_reports(str(tmp_path / 'reports'), workers=1) == (2, 0)
+    assert sorted(path.name for path in (tmp_path / 'reports').iterdir()) == ['1.pdf', '2.pdf']
+
+
+def test_render_report_in_chart_pool(test_db, tmp_path, monkeypatch):
+    # Процесс пула запускается через spawn и должен открыть тестовую БД, а не config.DB_NAME
+    renderer = charts.ChartRenderer(workers=1)
+    monkeypatch.setattr(charts, 'renderer', renderer)
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    path = tmp_path / 'report.pdf'
+    try:
+        assert asyncio.run(report.render_report(str(path), 1)) == 1
+    finally:
+        renderer.shutdown()
+    assert path.read_bytes().startswith(b'%PDF')
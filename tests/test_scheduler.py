@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import database as db
+from services import scheduler
+from services.scheduler import Job, Scheduler, format_timezone, next_weekly, parse_timezone
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_parse_and_format_timezone():
+    assert parse_timezone('Europe/Moscow') == 'Europe/Moscow'
+    assert parse_timezone('UTC+3') == 'Etc/GMT-3'
+    assert parse_timezone('-5') == 'Etc/GMT+5'
+    assert parse_timezone('+0') == 'UTC'
+    assert format_timezone('Etc/GMT-3') == 'UTC+3'
+    assert format_timezone('Etc/GMT+5') == 'UTC-5'
+    for value in ('+15', 'Mars/Olympus'):
+        with pytest.raises(ValueError):
+            parse_timezone(value)
+
+
+def test_next_weekly_uses_local_time():
+    # Понедельник 06.01.2025, 10:00 по Москве = 07:00 UTC
+    assert next_weekly(utc(2025, 1, 6, 6, 59), MOSCOW, 0, 10) == utc(2025, 1, 6, 7)
+    assert next_weekly(utc(2025, 1, 6, 7), MOSCOW, 0, 10) == utc(2025, 1, 13, 7)
+    # Слот со смещением ещё впереди, хотя начало рассылки прошло
+    assert next_weekly(utc(2025, 1, 6, 7, 10), MOSCOW, 0, 10, timedelta(minutes=30)) == utc(2025, 1, 6, 7, 30)
+    # Понедельник 01:00 по Москве - ещё воскресенье по UTC
+    assert next_weekly(utc(2025, 1, 12, 21), MOSCOW, 0, 1) == utc(2025, 1, 12, 22)
+
+
+def test_missed_run_executes_once_after_restart(test_db, monkeypatch):
+    now = utc(2025, 1, 10, 12)
+    monkeypatch.setattr(scheduler, 'utcnow', lambda: now)
+    db.save_scheduler_run('daily', utc(2025, 1, 7, 12).timestamp())
+    runs = []
+
+    async def next_run(after):
+        return datetime.combine(after.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+
+    async def action(run_at):
+        runs.append(run_at)
+
+    async def scenario():
+        instance = Scheduler(max_sleep=0.01)
+        instance.add(Job('daily', next_run, action, max_delay=24 * 3600))
+        task = asyncio.create_task(instance.run())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(scenario())
+    # Запуски 08.01 и 09.01 опоздали больше чем на max_delay, 11.01 ещё не наступил
+    assert runs == [utc(2025, 1, 10)]
+    assert db.get_scheduler_runs() == {'daily': utc(2025, 1, 10).timestamp()}
+
+
+def test_survey_users_are_grouped_by_settings_and_slot(test_db):
+    for user_id in range(1, 7):
+        db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+    db.save_user_settings(2, 'Asia/Tokyo', None)
+    db.save_user_settings(3, None, 9)
+
+    assert db.get_survey_groups('', 10) == [('', 9), ('', 10), ('Asia/Tokyo', 10)]
+    default_group = [db.get_survey_users_page('', 10, slot, 2, '', 10) for slot in (0, 1)]
+    assert default_group == [[4, 6], [1, 5]]
+    assert db.get_survey_users_page('Asia/Tokyo', 10, 0, 2, '', 10) == [2]
+    assert db.get_survey_users_page('', 9, 1, 2, '', 10) == [3]
+    assert db.get_survey_users_page('', 10, 1, 2, '', 10, after_user_id=1, limit=1) == [5]
@@ -0,0 +1,99 @@
+import database as db
+import shards
+from shards import SHARD_ID_RANGE
+
+
+def _user_on(path, skip=()):
+    """Первый user_id, который кольцо шардов отправляет в path"""
+    return next(user_id for user_id in range(1, 10000)
+                if user_id not in skip and db.get_ring().get(user_id) == path)
+
+
+def _ids(path, user_id=None):
+    query = 'SELECT id FROM subscriptions' + (' WHERE user_id = ?' if user_id else '')
+    return [row[0] for row in db.create_connection(path).execute(query, (user_id,) if user_id else ())]
+
+
+def test_users_are_routed_to_their_shards(shard_db):
+    main, shard = shard_db
+    users = [_user_on(main), _user_on(shard)]
+    for user_id in users:
+        db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+
+    assert _ids(main) == _ids(main, users[0])
+    assert _ids(shard) == _ids(shard, users[1])
+    # ID подписок шарда 1 начинаются с его диапазона
+    assert _ids(shard)[0] >= SHARD_ID_RANGE
+    assert db.get_users_with_subs() == sorted(users)
+    assert db.get_users_with_subs_page(limit=1) == [min(users)]
+    assert [sub[0] for sub in db.get_all_subs(users[1])] == ['Spotify']
+
+
+def test_add_shard_with_plan_and_rebalance(shard_db, monkeypatch):
+    main, shard = shard_db
+    # Данные записаны, пока был один файл БД
+    monkeypatch.setattr(db, 'DB_SHARDS', [])
+    for user_id in range(1, 21):
+        db.add_subscription(user_id, f'Сервис {user_id}', 100 + user_id, 'Другое', 5)
+        (sub_id, *_), = db.get_all_subs(user_id, include_id=True)
+        db.save_usage_score(sub_id, user_id, '2025-01-06', user_id % 10 + 1)
+    before = {user_id: db.get_all_subs(user_id, include_usage=True) for user_id in range(1, 21)}
+
+    monkeypatch.setattr(db, 'DB_SHARDS', [shard])
+    moving = db.get_misplaced_users(main)
+    assert moving and shards.plan() == len(moving)
+    # Закреплённые пользователи читаются из старого шарда до переноса
+    db.clear_subs_cache()
+    assert db.get_all_subs(moving[0], include_usage=True) == before[moving[0]]
+
+    assert shards.rebalance() == len(moving)
+    assert db.get_pinned_users() == []
+    assert sorted(db.get_shard_users(shard)) == moving
+    assert db.get_users_with_subs() == list(range(1, 21))
+    for user_id in range(1, 21):
+        assert [sub[1:] for sub in db.get_all_subs(user_id, include_usage=True)] == \
+               [sub[1:] for sub in before[user_id]]
+
+
+def test_move_user_then_add_on_both_shards(shard_db):
+    main, shard = shard_db
+    staying, moving = _user_on(main), _user_on(shard)
+    db.add_subscription(staying, 'Кинопоиск', 299, 'Музыка', 5)
+    db.add_subscription(moving, 'Spotify', 199, 'Музыка', 7)
+    (old_id,) = _ids(shard, moving)
+    db.save_usage_score(old_id, moving, '2025-01-06', 8)
+
+    db.move_user(moving, shard, main)
+
+    # Подписка переехала под новым ID из диапазона шарда 0 вместе с историей и агрегатами
+    (new_id,) = _ids(main, moving)
+    assert new_id < SHARD_ID_RANGE
+    conn = db.create_connection(main)
+    assert conn.execute('SELECT usage_score FROM usage_history WHERE subscription_id = ?', (new_id,)).fetchall() == [(8,)]
+    assert conn.execute('SELECT score_sum, score_count FROM usage_stats WHERE subscription_id = ?',
+                        (new_id,)).fetchone() == (8, 1)
+    assert _ids(shard) == []
+
+    # Новые подписки обоих шардов получают ID из своих диапазонов и не совпадают
+    db.add_subscription(staying, 'Netflix', 599, 'Музыка', 4)
+    db.add_subscription(_user_on(shard, skip=(moving,)), 'YouTube', 399, 'Музыка', 6)
+    assert all(sub_id < SHARD_ID_RANGE for sub_id in _ids(main))
+    assert all(SHARD_ID_RANGE <= sub_id < 2 * SHARD_ID_RANGE for sub_id in _ids(shard))
+    assert len(set(_ids(main)) | set(_ids(shard))) == 4
+
+
+def test_move_user_retry_after_partial_copy(shard_db):
+    main, shard = shard_db
+    moving = _user_on(shard)
+    db.add_subscription(moving, 'Spotify', 199, 'Музыка', 7)
+    # Как после сбоя между коммитами: копия уже зафиксирована в target
+    conn = db.create_connection(main)
+    conn.execute(
+        "INSERT INTO subscriptions (user_id, service_name, price, category) VALUES (?, 'Spotify', 199, 'Музыка')",
+        (moving,))
+    conn.commit()
+
+    db.move_user(moving, shard, main)
+
+    assert len(_ids(main, moving)) == 1
+    assert _ids(shard) == []
@@ -0,0 +1,76 @@
+import sqlite3
+
+import database as db
+
+
+def _foreign_write(path, sql, params=()):
+    """Запись мимо database.py - как из другого процесса бота"""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+def _add_subs(user_id):
+    db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+    db.add_subscription(user_id, 'Газ', 800, 'Коммуналка / ЖКХ', 10)
+
+
+def test_list_variants_share_one_cached_load(test_db):
+    _add_subs(1)
+    db.get_all_subs(1)
+    stats = db.get_subs_cache_stats()
+
+    assert db.get_all_subs(1) == [('Spotify', 199, 'Музыка', 7), ('Газ', 800, 'Коммуналка / ЖКХ', 10)]
+    assert db.get_all_subs(1, exclude_zkh=True) == [('Spotify', 199, 'Музыка', 7)]
+    assert [sub[1] for sub in db.get_all_subs(1, include_id=True)] == ['Spotify', 'Газ']
+    assert db.get_stats_by_category(1) == [('Коммуналка / ЖКХ', 800), ('Музыка', 199)]
+    after = db.get_subs_cache_stats()
+    assert after['misses'] == stats['misses']
+    assert after['hits'] == stats['hits'] + 4
+
+
+def test_writes_invalidate_only_their_user(test_db):
+    _add_subs(1)
+    _add_subs(2)
+    db.get_all_subs(1)
+    db.get_all_subs(2)
+
+    (sub_id, *_), _ = db.get_all_subs(1, include_id=True)
+    db.update_importance(1, sub_id, 3)
+    db.save_usage_score(sub_id, 1, '2025-01-06', 8)
+    assert db.get_all_subs(1, include_id=True, include_usage=True)[0][4:] == (3, 8.0)
+
+    db.delete_sub_by_id(1, sub_id)
+    assert [sub[0] for sub in db.get_all_subs(1)] == ['Газ']
+
+    misses = db.get_subs_cache_stats()['misses']
+    assert [sub[0] for sub in db.get_all_subs(2)] == ['Spotify', 'Газ']
+    assert db.get_subs_cache_stats()['misses'] == misses
+
+
+def test_disabled_cache(test_db, monkeypatch):
+    monkeypatch.setattr(db, 'SUBS_CACHE_SIZE', 0)
+    db.clear_subs_cache()
+    _add_subs(1)
+    db.get_all_subs(1)
+    db.get_all_subs(1)
+    assert db.get_subs_cache_stats()['entries'] == 0
+
+
+def test_cache_sees_writes_from_other_processes(shard_db):
+    user_id = 1
+    path = db.get_user_shard(user_id)
+    db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+    assert [sub[0] for sub in db.get_all_subs(user_id)] == ['Spotify']
+    assert db.get_all_subs(user_id) == db.get_all_subs(user_id)  # из кэша
+
+    _foreign_write(path, 'DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+    assert db.get_all_subs(user_id) == []
+
+    _foreign_write(path, "INSERT INTO subscriptions (user_id, service_name, price, category) "
+                         "VALUES (?, 'Netflix', 599, 'Музыка')", (user_id,))
+    (sub_id, *_), = db.get_all_subs(user_id, include_id=True)
+    _foreign_write(path, 'INSERT INTO usage_stats (subscription_id, score_sum, score_count) VALUES (?, 6, 2)',
+                   (sub_id,))
+    assert db.get_all_subs(user_id, include_usage=True)[0][5] == 3.0
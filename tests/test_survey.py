@@ -0,0 +1,43 @@
+import asyncio
+import json
+from datetime import date
+
+import database as db
+from services.survey import SurveySession
+
+WEEK = date(2025, 1, 6)
+
+
+def _button_texts(session):
+    return [button.text for row in session.markup().inline_keyboard for button in row]
+
+
+def test_session_loads_week_ratings(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    db.add_subscription(1, 'Netflix', 9.99, 'Кино', 5, 'USD')
+    db.add_subscription(1, 'Газ', 800, 'Коммуналка / ЖКХ', 10)
+    spotify_id, netflix_id = (sub[0] for sub in db.get_all_subs(1, include_id=True)[:2])
+    db.save_usage_score(spotify_id, 1, '2025-01-06', 8)
+    db.save_usage_score(netflix_id, 1, '2024-12-30', 3)
+
+    session = asyncio.run(SurveySession.load(1, WEEK))
+    # Цена показывается в валюте платежа
+    assert session.items == [[spotify_id, 'Spotify', '199₽', 8], [netflix_id, 'Netflix', '9.99$', None]]
+    assert _button_texts(session) == ['✅ Spotify (199₽) - 8/10', 'Netflix (9.99$)', '✅ Завершить опрос']
+
+
+def test_session_without_subscriptions(test_db):
+    db.add_subscription(1, 'Газ', 800, 'Коммуналка / ЖКХ', 10)
+    assert asyncio.run(SurveySession.load(1, WEEK)) is None
+
+
+def test_rate_flips_one_button_and_survives_fsm_roundtrip():
+    session = SurveySession('2025-01-06', [[1, 'Spotify', '199₽', None], [2, 'Netflix', '599₽', 4]], 10, 20)
+    assert session.rate(1, 9)
+    assert not session.rate(2, 4)
+    assert not session.rate(3, 5)
+
+    restored = SurveySession.from_dict(json.loads(json.dumps(session.to_dict())))
+    assert restored.is_message(10, 20)
+    assert restored.get_name(2) == 'Netflix'
+    assert _button_texts(restored)[:2] == ['✅ Spotify (199₽) - 9/10', '✅ Netflix (599₽) - 4/10']
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import database as db
+from services import transfer
+
+CSV_TEXT = (
+    "service_name,price,category,importance,usage\n"
+    "Spotify,199,Музыка,7,2025-01-06:8;2025-01-15:6\n"
+    "Netflix,599,Развлечения,,\n"
+    "Яндекс Плюс,299,Музыка,4,2025-01-13:2\n"
+)
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_csv_import_and_export(test_db, tmp_path):
+    assert transfer.import_file(_write(tmp_path, 'in.csv', CSV_TEXT), 'csv', user_id=5) == (3, 3)
+
+    subs = db.get_all_subs(5, include_usage=True)
+    assert [(sub[1], sub[4], sub[5]) for sub in subs] == [('Spotify', 7, 7.0), ('Netflix', 5, None),
+                                                         ('Яндекс Плюс', 4, 2.0)]
+
+    out = str(tmp_path / 'out.jsonl')
+    assert transfer.export_file(out, 'jsonl', user_id=5) == 3
+    first = json.loads(open(out, encoding='utf-8').readline())
+    # Оценка за среду 15.01 сохранена на понедельник той недели
+    assert first == {'user_id': 5, 'service_name': 'Spotify', 'price': 199.0, 'currency': 'RUB', 'category': 'Музыка',
+                     'importance': 7, 'usage': {'2025-01-06': 8, '2025-01-13': 6}}
+
+
+def test_export_import_round_trip_in_chunks(test_db):
+    records = [(user_id, f'Сервис {i}', 100 + i, 'USD' if i % 2 else 'RUB', 'Другое', 5, [('2025-01-06', i % 10 + 1)])
+               for user_id in (1, 2) for i in range(5)]
+    assert db.import_subscriptions(records, chunk_size=3) == (10, 10)
+    assert list(db.iter_subscriptions_export(page_size=4)) == records
+    assert list(db.iter_subscriptions_export(user_id=2)) == records[5:]
+
+
+def test_invalid_row_rolls_back_whole_file(test_db, tmp_path):
+    text = CSV_TEXT + "Кино,-1,Развлечения,5,\n"
+    with pytest.raises(transfer.TransferError, match="строка 5: цена"):
+        transfer.import_file(_write(tmp_path, 'bad.csv', text), 'csv', user_id=5)
+    assert db.get_all_subs(5) == []
+
+    lines = ['{"service_name": "Spotify", "price": 199, "category": "Музыка"}\n'] * 3
+    with pytest.raises(transfer.TransferError, match="слишком много записей"):
+        transfer.import_file(_write(tmp_path, 'big.jsonl', ''.join(lines)), 'jsonl', user_id=5, max_rows=2)
+    assert db.get_all_subs(5) == []
@@ -0,0 +1,86 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import database as db
+import trends
+import utils
+
+nan = np.nan
+
+
+def test_usage_matrix_places_scores_by_week():
+    ids, matrix = trends.usage_matrix([(7, 0, 5), (3, 2, 8), (7, 2, 9), (3, 9, 1)], weeks=3)
+    assert ids.tolist() == [3, 7]
+    np.testing.assert_array_equal(matrix, [[nan, nan, 8], [5, nan, 9]])  # неделя 9 вне периода
+
+
+def test_ewma_matches_weighted_average():
+    # Полураспад 1 неделя: веса 1/4, 1/2, 1 от старой недели к последней; пропуск не учитывается
+    matrix = np.array([[4, 6, 8], [4, nan, 8], [nan, nan, nan]])
+    np.testing.assert_allclose(
+        trends.ewma(matrix, halflife=1),
+        [(4 / 4 + 6 / 2 + 8) / 1.75, (4 / 4 + 8) / 1.25, nan],
+    )
+
+
+def test_slope_of_linear_series_with_gaps():
+    matrix = np.array([[10, nan, 8, 7, nan], [5, nan, nan, nan, 5], [nan, nan, 3, nan, nan]])
+    np.testing.assert_allclose(trends.slope(matrix, min_points=2), [-1.0, 0.0, nan])
+
+
+def test_compute_trends_and_lookup(monkeypatch):
+    monkeypatch.setattr(trends, 'TREND_SLOPE_WEEKS', 4)
+    monkeypatch.setattr(trends, 'TREND_MIN_POINTS', 3)
+    rows = [(1, week, 10 - week) for week in range(6)] + [(2, week, 6) for week in range(6)]
+    result = trends.compute_trends(rows, weeks=6)
+    np.testing.assert_allclose(result.slope, [-1.0, 0.0])
+    assert result.declining.tolist() == [True, False]
+
+    recent, slope, declining = trends.lookup(result, [2, 99, 1])
+    np.testing.assert_allclose(recent, [6.0, nan, result.ewma[0]])
+    np.testing.assert_allclose(slope, [0.0, nan, -1.0])
+    assert declining.tolist() == [False, False, True]
+
+
+
+def test_recent_usage_replaces_average_only_with_data():
+    result = trends.compute_trends([(1, 0, 4)], weeks=1)
+    rows = [(1, 'Spotify', 199.0, 'Музыка', 7, 9.0), (2, 'Netflix', 599.0, 'Кино', 5, 6.0)]
+    assert trends.recent_usage(result, rows) == [
+        (1, 'Spotify', 199.0, 'Музыка', 7, pytest.approx(4.0)),
+        (2, 'Netflix', 599.0, 'Кино', 5, 6.0),
+    ]
+
+
+def test_user_trends_from_database(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    db.add_subscription(1, 'Netflix', 599, 'Развлечения', 5)
+    spotify, netflix = (sub[0] for sub in db.get_all_subs(1, include_id=True))
+    for week, score in (('2024-12-30', 9), ('2025-01-06', 7), ('2025-01-20', 3), ('2025-01-27', 1)):
+        db.save_usage_score(spotify, 1, week, score)
+    db.save_usage_score(netflix, 1, '2024-11-04', 8)  # раньше периода
+
+    result = trends.get_user_trends(1, today=date(2025, 1, 29), weeks=5)
+    assert result.sub_ids.tolist() == [spotify]
+    np.testing.assert_allclose(result.slope, [-2.0])
+    assert result.declining.tolist() == [True]
+    recent, _, declining = trends.lookup(result, [netflix, spotify])
+    assert np.isnan(recent[0]) and 1 < recent[1] < 7
+    assert declining.tolist() == [False, True]
+
+
+def test_advice_uses_recent_usage_and_flags_decline(monkeypatch):
+    monkeypatch.setattr(trends, 'TREND_MIN_POINTS', 3)
+    # Netflix: в среднем 5 за всё время, но оценки падают; Spotify - без изменений
+    rows = [(2, week, score) for week, score in enumerate([8, 6, 4, 2, 1])]
+    rows += [(1, week, 8) for week in range(5)]
+    usage_trends = trends.compute_trends(rows, weeks=5)
+    subs = [(1, 'Spotify', 200.0, 'Музыка', 5, 8.0), (2, 'Netflix', 700.0, 'Развлечения', 5, 5.0)]
+
+    assert 'Netflix' not in utils.analyze_efficiency(subs)[0]
+    text, savings = utils.analyze_efficiency(subs, usage_trends)
+    assert 'Netflix</b>' in text and 'Использование снижается: -1.8 в неделю' in text
+    assert 'Spotify' not in text
+    assert savings > 0
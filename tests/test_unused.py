@@ -0,0 +1,45 @@
+import asyncio
+from datetime import date, timedelta
+
+import async_db as adb
+import database as db
+from services.broadcast import Broadcaster
+
+
+def _add_subs(conn):
+    """Подписки трёх пользователей, добавленные 10 недель назад; часть оценена недавно"""
+    for user_id in (1, 2, 3):
+        for name, category in (('Spotify', 'Музыка'), ('Netflix', 'Стриминг'), ('Газ', 'Коммуналка / ЖКХ')):
+            db.add_subscription(user_id, f'{name} {user_id}', 100 * user_id, category, 5)
+    with conn:
+        conn.execute("UPDATE subscriptions SET date_added = datetime('now', '-70 days')")
+    week = date.today() - timedelta(weeks=1)
+    for user_id in (1, 2, 3):
+        sub_id = db.get_all_subs(user_id, include_id=True)[0][0]
+        db.save_usage_score(sub_id, user_id, week, 5)
+
+
+def test_iter_unused_matches_per_user_query(test_db):
+    conn = db.create_connection()
+    _add_subs(conn)
+    expected = [(user_id, db.get_unused_subscriptions(user_id)) for user_id in (1, 2, 3)]
+    assert [len(subs) for _, subs in expected] == [1, 1, 1]  # оценённые и ЖКХ не попадают
+
+    # Страницы меньше числа пользователей: группы не должны разрываться на границе страниц
+    assert list(db.iter_unused_subscriptions(page_size=1)) == expected
+    assert list(db.iter_unused_subscriptions(weeks_threshold=20)) == []
+
+
+def test_async_stream_and_deliver_stream(test_db):
+    _add_subs(db.create_connection())
+    sent = []
+
+    async def messages():
+        async for user_id, subs in adb.iter_unused_subscriptions():
+            async def send(user_id=user_id, subs=subs):
+                sent.append((user_id, [sub[1] for sub in subs]))
+            yield user_id, send
+
+    summary = asyncio.run(Broadcaster(global_rate=1000, per_chat_rate=1000).deliver_stream(messages()))
+    assert summary == {'sent': 3}
+    assert sorted(sent) == [(1, ['Netflix 1']), (2, ['Netflix 2']), (3, ['Netflix 3'])]
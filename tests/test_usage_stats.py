@@ -0,0 +1,61 @@
+import threading
+
+import database as db
+
+
+def _stats(conn):
+    return conn.execute('SELECT * FROM usage_stats ORDER BY subscription_id').fetchall()
+
+
+def test_incremental_stats_match_rebuild(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    db.add_subscription(1, 'Netflix', 599, 'Стриминг', 5)
+    (spotify, *_), (netflix, *_) = db.get_all_subs(1, include_id=True)
+
+    for week, score in (('2025-01-06', 3), ('2025-01-13', 5), ('2025-01-20', 7), ('2025-01-27', 9),
+                        ('2025-02-03', 10), ('2025-01-13', 1)):  # последняя - переоценка недели
+        db.save_usage_score(spotify, 1, week, score)
+    db.save_usage_score(netflix, 1, '2025-01-06', 4)
+
+    conn = db.create_connection()
+    incremental = _stats(conn)
+    assert incremental == [(spotify, 30, 5, 6.75, '2025-02-03'), (netflix, 4, 1, 4.0, '2025-01-06')]
+    db.rebuild_usage_stats()
+    assert _stats(conn) == incremental
+
+    assert db.get_average_usage_score(1, spotify) == 6.75
+    assert db.get_average_usage_score(1, spotify, weeks=2) == 9.5
+    assert [sub[5] for sub in db.get_all_subs(1, include_id=True, include_usage=True)] == [6.0, 4.0]
+
+
+def test_delete_removes_history_and_stats(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    (sub_id, *_), = db.get_all_subs(1, include_id=True)
+    db.save_usage_score(sub_id, 1, '2025-01-06', 5)
+    db.delete_sub_by_id(1, sub_id)
+
+    conn = db.create_connection()
+    assert conn.execute('SELECT COUNT(*) FROM usage_history').fetchone() == (0,)
+    assert _stats(conn) == []
+
+
+def test_concurrent_rerating_keeps_aggregates(shard_db):
+    user_id = 1
+    db.add_subscription(user_id, 'Spotify', 199, 'Музыка', 7)
+    (sub_id, *_), = db.get_all_subs(user_id, include_id=True)
+
+    # Несколько потоков (у каждого своё соединение) переоценивают одну и ту же неделю
+    def rate(thread):
+        for i in range(30):
+            db.save_usage_score(sub_id, user_id, '2025-01-06', (thread + i) % 10 + 1)
+
+    threads = [threading.Thread(target=rate, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conn = db.create_connection(db.get_user_shard(user_id))
+    (score,), = conn.execute('SELECT usage_score FROM usage_history WHERE subscription_id = ?', (sub_id,))
+    assert conn.execute('SELECT score_sum, score_count FROM usage_stats WHERE subscription_id = ?',
+                        (sub_id,)).fetchone() == (score, 1)
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from aiogram import Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestClient, TestServer, unused_port
+
+import async_db as adb
+import main
+from benchmarks import percentile
+from benchmarks.fake_api import fake_update
+from benchmarks.fake_telegram import FakeBotAPI, parse_targets
+from services.fsm_storage import SQLiteStorage
+
+
+def test_parse_targets():
+    assert parse_targets('8081-8083,8090', 'localhost') == [
+        'http://localhost:8081', 'http://localhost:8082', 'http://localhost:8083', 'http://localhost:8090',
+    ]
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile(range(1, 101), 50) == 51
+    assert percentile(range(1, 101), 99) == 100
+
+
+def test_webhook_answers_updates_through_api_server(test_db, monkeypatch):
+    apps = []
+    monkeypatch.setattr(web, 'run_app', lambda app, **kwargs: apps.append(app))
+    monkeypatch.setattr(main, 'WEBHOOK_SECRET', 'secret')
+    monkeypatch.setattr(main, 'CHART_PREWARM', False)
+    # on_shutdown останавливает пул потоков БД - не трогаем общий
+    monkeypatch.setattr(adb, '_executor', adb.DBExecutor())
+
+    async def scenario():
+        api = FakeBotAPI()
+        api_server = TestServer(web.Application())
+        api_server.app.router.add_post('/bot{token}/{method}', api.handle)
+        await api_server.start_server()
+        monkeypatch.setattr(main, 'TELEGRAM_API_URL', str(api_server.make_url('')).rstrip('/'))
+        monkeypatch.setattr(main, 'bot', main.create_bot())
+        metrics_port = unused_port()
+        main.run_webhook(primary=False, metrics_port=metrics_port)
+
+        client = TestClient(TestServer(apps[0]))
+        await client.start_server()
+        try:
+            update = fake_update(1, 42, text='/help')
+            response = await client.post(main.WEBHOOK_PATH, json=update)
+            assert response.status == 401
+
+            headers = {'X-Telegram-Bot-Api-Secret-Token': 'secret'}
+            response = await client.post(main.WEBHOOK_PATH, json=update, headers=headers)
+            assert response.status == 200
+            for _ in range(100):
+                if api.calls.get('sendMessage'):
+                    break
+                await asyncio.sleep(0.05)
+
+            # Метрики - только на отдельном порту, не на публичном сервере webhook
+            assert (await client.get('/metrics')).status == 404
+            async with ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{metrics_port}/metrics') as response:
+                    assert response.status == 200
+                    assert 'bot_handler_seconds' in await response.text()
+        finally:
+            await client.close()
+            await api_server.close()
+        return api.calls
+
+    calls = asyncio.run(scenario())
+    assert calls.get('sendMessage') == 1
+
+
+def test_workers_require_shared_fsm_storage(monkeypatch):
+    monkeypatch.setattr(main, 'FSM_STORAGE', 'memory')
+    with pytest.raises(SystemExit, match="FSM_STORAGE = 'sqlite'"):
+        main.run_webhook_workers(2)
+
+
+def test_worker_processes_write_fsm_state_through(test_db, monkeypatch):
+    storage = SQLiteStorage(flush_interval=0.05)
+    monkeypatch.setattr(main, 'dp', Dispatcher(storage=storage))
+    monkeypatch.setattr(web, 'run_app', lambda app, **kwargs: None)
+    main.run_webhook(primary=False, shared=True)
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+    async def scenario():
+        await storage.set_state(key, 'AddSub:price')
+        # Следующий шаг диалога в другом процессе сразу видит новое состояние
+        return await SQLiteStorage().get_state(key)
+
+    assert storage.flush_interval == 0
+    assert asyncio.run(scenario()) == 'AddSub:price'
@@ -0,0 +1,49 @@
+import asyncio
+import sqlite3
+
+import async_db as adb
+import database as db
+
+
+def _subscription_ids(user_id):
+    return [sub[0] for sub in db.get_all_subs(user_id, include_id=True)]
+
+
+def test_failed_write_rolls_back_only_itself(test_db):
+    db.add_subscription(1, 'Spotify', 199, 'Музыка', 7)
+    sub_id, = _subscription_ids(1)
+
+    results = db.write_batch([
+        ('save_usage_score', (sub_id, 1, '2025-01-06', 8)),
+        ('save_usage_score', (sub_id, 1, '2025-01-13', 11)),
+        ('update_importance', (1, sub_id, 3)),
+        ('add_subscription', (2, 'Netflix', 599, 'Развлечения', 5)),
+    ])
+    assert [ok for ok, _ in results] == [True, False, True, True]
+    assert isinstance(results[1][1], sqlite3.IntegrityError)
+    assert results[2] == (True, 'Spotify')
+
+    assert db.get_all_subs(1, include_usage=True)[0][4:] == (3, 8.0)
+    assert [sub[0] for sub in db.get_all_subs(2)] == ['Netflix']
+
+
+def test_batcher_groups_concurrent_writes(test_db, monkeypatch):
+    for i in range(20):
+        db.add_subscription(1, f'Сервис {i}', 100, 'Другое', 5)
+    sub_ids = _subscription_ids(1)
+
+    batches = []
+    write_batch = db.write_batch
+    monkeypatch.setattr(db, 'write_batch', lambda writes: batches.append(len(writes)) or write_batch(writes))
+
+    async def scenario():
+        batcher = adb.WriteBatcher(adb.DBExecutor(), interval=0.05, max_batch=8)
+        ok = [batcher.submit('save_usage_score', sub_id, 1, '2025-01-06', 5) for sub_id in sub_ids]
+        bad = batcher.submit('save_usage_score', sub_ids[0], 1, '2025-01-13', 0)
+        return await asyncio.gather(*ok, bad, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert results[:-1] == [None] * 20
+    assert isinstance(results[-1], sqlite3.IntegrityError)
+    assert batches == [8, 8, 5]
+    assert [sub[5] for sub in db.get_all_subs(1, include_usage=True)] == [5.0] * 20
@@ -0,0 +1,124 @@
+"""
+Динамика использования подписок по еженедельным оценкам.
+
+История пользователя за TREND_HISTORY_WEEKS недель читается одним запросом
+и раскладывается в матрицу "подписка x неделя" (NaN - недели без оценки).
+Все показатели считаются векторно по этой матрице:
+    ewma      - экспоненциальное среднее с полураспадом TREND_HALFLIFE_WEEKS
+                (пропущенные недели не учитываются)
+    slope     - наклон МНК за TREND_SLOPE_WEEKS последних недель, баллов в неделю
+    declining - наклон не больше TREND_DECLINE_SLOPE при достаточном числе оценок
+"""
+import itertools
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+import config
+import database as db
+
+# Сколько последних недель истории учитывается
+TREND_HISTORY_WEEKS = getattr(config, 'TREND_HISTORY_WEEKS', 52)
+# Через сколько недель вес оценки в экспоненциальном среднем уменьшается вдвое
+TREND_HALFLIFE_WEEKS = getattr(config, 'TREND_HALFLIFE_WEEKS', 4)
+# Окно для наклона и сколько оценок в нём нужно, чтобы наклону можно было верить
+TREND_SLOPE_WEEKS = getattr(config, 'TREND_SLOPE_WEEKS', 8)
+TREND_MIN_POINTS = getattr(config, 'TREND_MIN_POINTS', 3)
+# Использование падает, если оценка снижается хотя бы на столько баллов в неделю
+TREND_DECLINE_SLOPE = getattr(config, 'TREND_DECLINE_SLOPE', -0.3)
+
+# Показатели по подпискам: массивы, выровненные по sub_ids (NaN - не определено)
+Trends = namedtuple('Trends', 'sub_ids ewma slope declining')
+
+
+def usage_matrix(rows, weeks):
+    """
+    Матрица оценок из строк (subscription_id, номер недели, usage_score).
+
+    Returns:
+        (ID подписок по возрастанию, матрица len(ids) x weeks; столбец - номер недели)
+    """
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, weeks))
+    data = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+    ids, row_index = np.unique(data[:, 0], return_inverse=True)
+    columns = data[:, 1]
+    matrix = np.full((len(ids), weeks), np.nan)
+    inside = (columns >= 0) & (columns < weeks)
+    matrix[row_index[inside], columns[inside]] = data[inside, 2]
+    return ids, matrix
+
+
+def ewma(matrix, halflife):
+    """Экспоненциальное среднее на последнюю неделю; пропуски не учитываются (веса нормируются)"""
+    weights = 0.5 ** (np.arange(matrix.shape[1])[::-1] / halflife)
+    observed = ~np.isnan(matrix)
+    total = observed @ weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, np.where(observed, matrix, 0.0) @ weights / total, np.nan)
+
+
+def slope(matrix, min_points=2):
+    """Наклон прямой МНК по строкам (баллов в неделю) по имеющимся оценкам"""
+    observed = ~np.isnan(matrix)
+    x = np.arange(matrix.shape[1], dtype=float)
+    y = np.where(observed, matrix, 0.0)
+    n = observed.sum(axis=1)
+    sx = observed @ x
+    sy = y.sum(axis=1)
+    sxx = observed @ (x * x)
+    sxy = y @ x
+    denominator = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = (n * sxy - sx * sy) / denominator
+    return np.where((n >= min_points) & (denominator > 0), result, np.nan)
+
+
+def compute_trends(rows, weeks):
+    """Показатели по строкам истории (subscription_id, номер недели, usage_score) за weeks недель"""
+    ids, matrix = usage_matrix(rows, weeks)
+    trend = slope(matrix[:, -TREND_SLOPE_WEEKS:], TREND_MIN_POINTS)
+    return Trends(
+        sub_ids=ids,
+        ewma=ewma(matrix, TREND_HALFLIFE_WEEKS),
+        slope=trend,
+        declining=trend <= TREND_DECLINE_SLOPE,  # NaN сравнивается как False
+    )
+
+
+def get_user_trends(user_id, today=None, weeks=TREND_HISTORY_WEEKS):
+    """Показатели подписок пользователя за последние weeks недель (один запрос к БД)"""
+    today = today or date.today()
+    since = today - timedelta(days=today.weekday(), weeks=weeks - 1)
+    return compute_trends(db.get_usage_series(user_id, since), weeks)
+
+
+def lookup(trends, sub_ids):
+    """
+    Показатели для подписок sub_ids в их порядке.
+
+    Returns:
+        (ewma, slope, declining); для подписок без оценок за период - NaN, NaN, False
+    """
+    sub_ids = np.asarray(sub_ids, dtype=np.int64)
+    if not len(trends.sub_ids):
+        missing = np.full(len(sub_ids), np.nan)
+        return missing, missing.copy(), np.zeros(len(sub_ids), dtype=bool)
+    position = np.minimum(np.searchsorted(trends.sub_ids, sub_ids), len(trends.sub_ids) - 1)
+    found = trends.sub_ids[position] == sub_ids
+    return (
+        np.where(found, trends.ewma[position], np.nan),
+        np.where(found, trends.slope[position], np.nan),
+        found & trends.declining[position],
+    )
+
+
+def recent_usage(trends, rows):
+    """
+    Строки get_all_subs(..., include_id=True, include_usage=True), в которых средняя оценка
+    за всё время заменена экспоненциальным средним (если за период есть оценки).
+    По ним строятся и советы (utils.analyze_efficiency), и гистограмма эффективности.
+    """
+    recent, _, _ = lookup(trends, [row[0] for row in rows])
+    return [(*row[:-1], row[-1] if np.isnan(value) else float(value)) for row, value in zip(rows, recent)]
@@ -1,6 +1,49 @@
-import matplotlib.pyplot as plt
+import functools
 import io
 
+import numpy as np
+
+import currency
+import efficiency
+import trends
+
+
+@functools.lru_cache(maxsize=None)
+def _plotting():
+    """
+    Ленивая загрузка matplotlib: модуль и кэш шрифтов инициализируются
+    только при первом построении графика, а не при старте бота.
+    """
+    import matplotlib
+    matplotlib.use('Agg', force=True)  # без GUI: бот работает на сервере
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    return Figure, FigureCanvasAgg
+
+
+def _new_figure(figsize):
+    """Новая фигура с холстом Agg"""
+    Figure, FigureCanvasAgg = _plotting()
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _figure_to_png(fig):
+    """Рендерит фигуру через Agg в PNG-буфер"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    buf.seek(0)
+    return buf
+
+
+def warm_up():
+    """Загрузить matplotlib и шрифты заранее, отрисовав пустой график"""
+    fig = _new_figure(figsize=(1, 1))
+    ax = fig.add_subplot()
+    ax.set_title(currency.SYMBOL)
+    _figure_to_png(fig)
+
 
 def generate_pie_chart(data):
     """
@@ -14,162 +57,220 @@ def generate_pie_chart(data):
     categories = [item[0] for item in data]
     costs = [item[1] for item in data]
 
-    # Настройка графика
-    plt.figure(figsize=(6, 6))
-    plt.pie(costs, labels=categories, autopct='%1.1f%%', startangle=140)
-    plt.title('Распределение бюджета')
+    # Настройка графика (без pyplot: отдельная фигура, безопасно для нескольких процессов и потоков)
+    fig = _new_figure(figsize=(6, 6))
+    ax = fig.add_subplot()
+    ax.pie(costs, labels=categories, autopct='%1.1f%%', startangle=140)
+    ax.set_title('Распределение бюджета')
 
     # Сохраняем в буфер памяти, а не в файл (чтобы не мусорить на диске)
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-
-    return buf
+    return _figure_to_png(fig)
 
 
 def generate_bar_chart(subscriptions_with_usage):
-    """Гистограмма: Стоимость за единицу удовольствия по подпискам"""
+    """
+    Гистограмма: Стоимость за единицу удовольствия по подпискам.
+    Использование берётся из строк как есть; бот передаёт строки trends.recent_usage,
+    чтобы график совпадал с советами.
+    """
     if not subscriptions_with_usage:
         return None
 
-    import database as db
-    
-    names = []
-    cost_per_unit = []
-    
-    for sub in subscriptions_with_usage:
-        if len(sub) == 6:
-            sub_id, name, price, category, importance, avg_usage = sub
-        else:
-            # Старый формат без использования
-            name, price, category, importance = sub
-            avg_usage = None
-        
-        if avg_usage is not None and importance > 0 and avg_usage > 0:
-            cost = price / (importance * float(avg_usage))
-            names.append(name)
-            cost_per_unit.append(cost)
-        elif avg_usage is None:
-            # Если нет данных - показываем как очень высокую стоимость
-            names.append(name)
-            cost_per_unit.append(999)  # Маркер для "нет данных"
-    
-    if not names:
+    batch = efficiency.batch_from_rows(subscriptions_with_usage)
+    scores = efficiency.score_batch(batch)
+
+    # Подписки с неопределённой стоимостью не показываем; без данных - серый столбец нулевой высоты
+    shown = np.flatnonzero(scores.tier != efficiency.TIER_UNDEFINED)
+    if not shown.size:
         return None
 
-    plt.figure(figsize=(12, 6))
+    names = [batch.names[i] for i in shown]
+    no_data = scores.tier[shown] == efficiency.TIER_NO_DATA
+    heights = np.where(no_data, 0, scores.cost[shown])
+    colors = efficiency.TIER_COLORS[scores.tier[shown]]
+
+    fig = _new_figure(figsize=(12, 6))
+    ax = fig.add_subplot()
     x = range(len(names))
-    colors = []
-    for cost in cost_per_unit:
-        if cost == 999:
-            colors.append('gray')  # Нет данных
-        elif cost > 50:
-            colors.append('red')  # Высокая стоимость
-        elif cost > 30:
-            colors.append('orange')  # Средняя стоимость
-        else:
-            colors.append('green')  # Низкая стоимость (оптимально)
-    
-    bars = plt.bar(x, [c if c != 999 else 0 for c in cost_per_unit], color=colors, alpha=0.7)
+    bars = ax.bar(x, heights, color=colors, alpha=0.7)
     
     # Добавляем подписи для подписок без данных
-    for i, (bar, cost) in enumerate(zip(bars, cost_per_unit)):
-        if cost == 999:
-            plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 5, 
+    for bar, cost, missing in zip(bars, heights, no_data):
+        if missing:
+            ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 5, 
                     'Нет данных', ha='center', va='bottom', fontsize=8, color='gray')
         else:
-            plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 2, 
-                    f'{cost:.1f}₽', ha='center', va='bottom', fontsize=8)
+            ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 2, 
+                    f'{cost:.1f}{currency.SYMBOL}', ha='center', va='bottom', fontsize=8)
     
-    plt.xticks(x, names, rotation=45, ha='right')
-    plt.ylabel('Стоимость за единицу удовольствия (₽)')
-    plt.title('Эффективность подписок')
-    plt.axhline(y=50, color='red', linestyle='--', alpha=0.5, label='Порог неэффективности (50₽)')
-    plt.axhline(y=30, color='orange', linestyle='--', alpha=0.5, label='Средняя эффективность (30₽)')
-    plt.legend()
-    plt.grid(axis='y', alpha=0.3)
-    plt.tight_layout()
+    ax.set_xticks(x)
+    ax.set_xticklabels(names, rotation=45, ha='right')
+    ax.set_ylabel(f'Стоимость за единицу удовольствия ({currency.SYMBOL})')
+    ax.set_title('Эффективность подписок')
+    ax.axhline(y=efficiency.HIGH_COST, color='red', linestyle='--', alpha=0.5,
+               label=f'Порог неэффективности ({efficiency.HIGH_COST}{currency.SYMBOL})')
+    ax.axhline(y=efficiency.MEDIUM_COST, color='orange', linestyle='--', alpha=0.5,
+               label=f'Средняя эффективность ({efficiency.MEDIUM_COST}{currency.SYMBOL})')
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+    fig.tight_layout()
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-    return buf
+    return _figure_to_png(fig)
 
 
-def analyze_efficiency(subscriptions_with_usage):
+# --- Страницы PDF-отчёта (services/report.py) ---
+
+# Альбомный A4, дюймы
+REPORT_PAGE_SIZE = (11.69, 8.27)
+
+
+def open_pdf(path):
+    """
+    Многостраничный PDF-файл: каждая страница пишется в файл при pdf.savefig(fig),
+    поэтому в памяти держится только текущая фигура.
+    """
+    _plotting()  # настройка matplotlib без GUI
+    from matplotlib.backends.backend_pdf import PdfPages
+    return PdfPages(path)
+
+
+def report_category_page(data, title):
+    """Страница с расходами по категориям: круговая диаграмма и суммы. data: (категория, сумма)"""
+    fig = _new_figure(figsize=REPORT_PAGE_SIZE)
+    fig.suptitle(title)
+    categories = [item[0] for item in data]
+    costs = [item[1] for item in data]
+
+    ax = fig.add_subplot(1, 2, 1)
+    ax.pie(costs, labels=categories, autopct='%1.1f%%', startangle=140)
+    ax.set_title('Распределение бюджета')
+
+    ax = fig.add_subplot(1, 2, 2)
+    bars = ax.barh(categories, costs, color='steelblue', alpha=0.7)
+    ax.bar_label(bars, labels=[f'{cost:.0f}{currency.SYMBOL}' for cost in costs], padding=3, fontsize=8)
+    ax.invert_yaxis()
+    ax.set_xlabel(f'{currency.SYMBOL} в месяц')
+    ax.set_title('Расходы по категориям')
+    fig.tight_layout()
+    return fig
+
+
+def report_trend_page(series, title, no_data=()):
+    """
+    Страница с динамикой стоимости за единицу удовольствия.
+
+    series: кортежи (название, недели, стоимость по неделям);
+    no_data: названия подписок без оценок за период (перечисляются внизу страницы).
+    """
+    fig = _new_figure(figsize=REPORT_PAGE_SIZE)
+    ax = fig.add_subplot()
+    for name, weeks, cost in series:
+        ax.plot(weeks, cost, marker='o', markersize=3, label=name)
+    ax.axhline(y=efficiency.HIGH_COST, color='red', linestyle='--', alpha=0.5)
+    ax.axhline(y=efficiency.MEDIUM_COST, color='orange', linestyle='--', alpha=0.5)
+    ax.set_ylabel(f'Стоимость за единицу удовольствия ({currency.SYMBOL})')
+    ax.set_title(title)
+    ax.grid(alpha=0.3)
+    if series:
+        ax.legend(fontsize=8, loc='upper left')
+    fig.autofmt_xdate()
+    if no_data:
+        fig.text(0.01, 0.01, 'Нет оценок за период: ' + ', '.join(no_data), fontsize=8, wrap=True)
+    return fig
+
+
+def report_forecast_page(monthly, savings, months, title):
+    """
+    Страница с прогнозом: накопленные расходы на months месяцев вперёд
+    при текущих подписках и после отказа от неэффективных (экономия savings в месяц).
+    """
+    fig = _new_figure(figsize=REPORT_PAGE_SIZE)
+    ax = fig.add_subplot()
+    x = np.arange(1, months + 1)
+    ax.plot(x, monthly * x, marker='o', label='Текущие подписки')
+    if savings > 0:
+        ax.plot(x, (monthly - savings) * x, marker='o', color='green',
+                label='Без неэффективных подписок')
+        ax.fill_between(x, (monthly - savings) * x, monthly * x, color='green', alpha=0.1)
+    ax.set_xticks(x)
+    ax.set_xlabel('Месяцев вперёд')
+    ax.set_ylabel(f'Накопленные расходы ({currency.SYMBOL})')
+    ax.set_title(title)
+    ax.grid(alpha=0.3)
+    ax.legend(loc='upper left')
+    summary = f'В месяц: {monthly:.0f}{currency.SYMBOL}   В год: {monthly * 12:.0f}{currency.SYMBOL}'
+    if savings > 0:
+        summary += (f'   Потенциальная экономия: {savings:.0f}{currency.SYMBOL}/мес, '
+                    f'{savings * 12:.0f}{currency.SYMBOL}/год')
+    fig.text(0.5, 0.02, summary, ha='center', fontsize=11)
+    fig.tight_layout(rect=(0, 0.05, 1, 1))
+    return fig
+
+
+# Текст рекомендации для каждого уровня эффективности (для оптимальных рекомендаций нет)
+_ADVICE = {
+    efficiency.TIER_VERY_HIGH: ("❌", "Очень высокая стоимость", "Рекомендуем отменить."),
+    efficiency.TIER_HIGH: ("⚠️", "Высокая стоимость", "Стоит подумать о более дешевой альтернативе."),
+    efficiency.TIER_MEDIUM: ("💡", "Средняя стоимость", "Можно оставить, но следите за использованием."),
+}
+
+
+def analyze_efficiency(subscriptions_with_usage, usage_trends=None):
     """
     Анализ эффективности трат на основе стоимости за единицу удовольствия.
     subscriptions_with_usage: список кортежей (id, name, price, category, importance, avg_usage)
-    где avg_usage - средняя оценка использования за последние 4 недели (1-10) или None
+    где avg_usage - средняя оценка использования (1-10) или None.
+    usage_trends: показатели trends.get_user_trends - тогда вместо средней за всё время
+    берётся экспоненциальное среднее последних недель, а о снижении использования
+    предупреждается отдельно.
     """
-    recommendations = []
-    total_waste = 0
+    slope = np.full(len(subscriptions_with_usage), np.nan)
+    declining = np.zeros(len(subscriptions_with_usage), dtype=bool)
+    if usage_trends is not None:
+        _, slope, declining = trends.lookup(usage_trends, [sub[0] for sub in subscriptions_with_usage])
+        subscriptions_with_usage = trends.recent_usage(usage_trends, subscriptions_with_usage)
+    batch = efficiency.batch_from_rows(subscriptions_with_usage)
+    scores = efficiency.score_batch(batch)
 
-    for sub in subscriptions_with_usage:
-        # Распаковываем данные
-        if len(sub) == 6:
-            sub_id, name, price, category, importance, avg_usage = sub
-        else:
-            # Обратная совместимость
-            name, price, category, importance = sub
-            avg_usage = None
+    recommendations = []
+    listed = np.isin(scores.tier, [efficiency.TIER_NO_DATA, *_ADVICE]) | declining
+    for i in np.flatnonzero(listed):
+        name = batch.names[i]
+        tier = scores.tier[i]
+        decline = (f" 📉 Использование снижается: {slope[i]:+.1f} в неделю."
+                   if declining[i] else "")
 
         # Если нет данных об использовании
-        if avg_usage is None:
+        if tier == efficiency.TIER_NO_DATA:
             recommendations.append(
                 f"ℹ️ <b>{name}</b>: Нет данных об использовании. "
                 f"Используйте команду /survey для оценки частоты использования подписки."
             )
             continue
 
-        # Преобразуем avg_usage в float
-        avg_usage = float(avg_usage) if avg_usage is not None else 0
-        
-        # Расчет "стоимости за единицу удовольствия"
-        # Формула: цена / (важность * частота использования)
-        if importance > 0 and avg_usage > 0:
-            cost_per_pleasure_unit = price / (importance * avg_usage)
-        else:
-            cost_per_pleasure_unit = None
-        
-        # Градация по стоимости за единицу удовольствия
-        if cost_per_pleasure_unit:
-            if cost_per_pleasure_unit > 100:
-                # Очень высокая стоимость - точно отменить
-                recommendations.append(
-                    f"❌ <b>{name}</b>: Очень высокая стоимость за единицу удовольствия ({cost_per_pleasure_unit:.1f}₽). "
-                    f"Важность: {importance}/10, использование: {avg_usage:.1f}/10. "
-                    f"Рекомендуем отменить."
-                )
-                total_waste += price  # Полная экономия
-            elif cost_per_pleasure_unit > 50:
-                # Высокая стоимость - стоит подумать
-                recommendations.append(
-                    f"⚠️ <b>{name}</b>: Высокая стоимость за единицу удовольствия ({cost_per_pleasure_unit:.1f}₽). "
-                    f"Важность: {importance}/10, использование: {avg_usage:.1f}/10. "
-                    f"Стоит подумать о более дешевой альтернативе."
-                )
-                total_waste += price * 0.5  # Частичная экономия
-            elif cost_per_pleasure_unit > 30:
-                # Средняя стоимость - можно оставить, но следить
-                recommendations.append(
-                    f"💡 <b>{name}</b>: Средняя стоимость за единицу удовольствия ({cost_per_pleasure_unit:.1f}₽). "
-                    f"Важность: {importance}/10, использование: {avg_usage:.1f}/10. "
-                    f"Можно оставить, но следите за использованием."
-                )
-                total_waste += price * 0.2  # Минимальная экономия
-            # Если <= 30 - оптимально, не добавляем рекомендацию
+        if tier not in _ADVICE:
+            # Стоимость пока в норме, но пользоваться стали реже
+            recommendations.append(
+                f"📉 <b>{name}</b>: Использование снижается ({slope[i]:+.1f} в неделю, "
+                f"сейчас {batch.avg_usage[i]:.1f}/10). Проверьте, нужна ли подписка."
+            )
+            continue
+
+        icon, label, action = _ADVICE[tier]
+        recommendations.append(
+            f"{icon} <b>{name}</b>: {label} за единицу удовольствия ({scores.cost[i]:.1f}{currency.SYMBOL}). "
+            f"Важность: {batch.importance[i]:.0f}/10, использование: {batch.avg_usage[i]:.1f}/10. "
+            f"{action}{decline}"
+        )
 
     if not recommendations:
         return "✅ Ваши траты выглядят оптимально! Все подписки используются эффективно.", 0
 
-    return "\n".join(recommendations), total_waste
+    return "\n".join(recommendations), float(scores.savings.sum())
 
 
 def calculate_monthly_forecast(subscriptions):
-    """Простой расчет итогов"""
+    """Простой расчет итогов (цены get_all_subs уже пересчитаны в базовую валюту)"""
     total = sum(s[1] for s in subscriptions)
     year_total = total * 12
     return total, year_total
\ No newline at end of file